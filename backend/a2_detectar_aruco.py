@@ -12,26 +12,117 @@ import json
 from pathlib import Path
 import logging
 from typing import Dict, Tuple, Optional, List
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from calidad_imagen import reducir_imagen, a_grises, EvaluadorCalidad, LADO_MINIATURA
+from metricas import etapa, FALLOS_DETECCION
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Pool compartido para la cascada de reintentos (detectMarkers libera el GIL)
+_pool_reintentos = None
+_pool_lock = threading.Lock()
+
+def _obtener_pool_reintentos() -> ThreadPoolExecutor:
+    """Crear bajo demanda el pool de hilos de la cascada de reintentos."""
+    global _pool_reintentos
+    with _pool_lock:
+        if _pool_reintentos is None:
+            _pool_reintentos = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 2),
+                                                  thread_name_prefix="aruco-reintento")
+        return _pool_reintentos
+
+def crear_parametros_detector(ajustes: Optional[Dict] = None):
+    """Crear DetectorParameters partiendo de los valores por defecto y aplicando ajustes."""
+    parametros = cv2.aruco.DetectorParameters()
+    for atributo, valor in (ajustes or {}).items():
+        setattr(parametros, atributo, valor)
+    return parametros
+
+def cargar_perfil_parametros(ruta: Optional[str]) -> Dict:
+    """
+    Cargar un perfil de DetectorParameters generado por autotune_aruco.py.
+    
+    Returns:
+        Dict atributo -> valor (vacío si no hay perfil: parámetros de serie)
+    """
+    if not ruta or not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            perfil = json.load(f)
+        parametros = perfil.get('parametros', {})
+        # Validar contra DetectorParameters antes de aceptarlo
+        crear_parametros_detector(parametros)
+        logger.info(f"⚙️ Perfil ArUco cargado de {ruta}: {parametros}")
+        return parametros
+    except Exception as e:
+        logger.error(f"Perfil ArUco inválido en {ruta}, se usan parámetros de serie: {e}")
+        return {}
+
+def _ajustar_gamma(gray: np.ndarray, gamma: float) -> np.ndarray:
+    """Corrección gamma por tabla de consulta (gamma < 1 aclara, > 1 oscurece)."""
+    lut = np.array([((i / 255.0) ** gamma) * 255 for i in range(256)], dtype=np.uint8)
+    return cv2.LUT(gray, lut)
+
+def _aplicar_clahe(gray: np.ndarray) -> np.ndarray:
+    """Ecualización adaptativa de contraste (CLAHE)."""
+    return cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)).apply(gray)
+
+# Cascada de reintentos: (nombre, preprocesado sobre gris, ajustes de DetectorParameters)
+CASCADA_REINTENTOS = [
+    ("clahe", _aplicar_clahe, {}),
+    ("gamma_0.5", lambda g: _ajustar_gamma(g, 0.5), {}),
+    ("gamma_1.8", lambda g: _ajustar_gamma(g, 1.8), {}),
+    ("umbral_amplio", None, {'adaptiveThreshWinSizeMin': 3, 'adaptiveThreshWinSizeMax': 63,
+                             'adaptiveThreshWinSizeStep': 10}),
+    ("umbral_fino", None, {'adaptiveThreshWinSizeMin': 3, 'adaptiveThreshWinSizeMax': 15,
+                           'adaptiveThreshWinSizeStep': 2, 'adaptiveThreshConstant': 3}),
+    ("clahe_subpix", _aplicar_clahe, {'cornerRefinementMethod': cv2.aruco.CORNER_REFINE_SUBPIX}),
+    ("gamma_0.5_contorno", lambda g: _ajustar_gamma(g, 0.5),
+     {'cornerRefinementMethod': cv2.aruco.CORNER_REFINE_CONTOUR,
+      'adaptiveThreshWinSizeMax': 43}),
+]
+
 class TablaAPIDetector:
-    def __init__(self, target_width: int = 800, target_height: int = 533):
+    def __init__(self, target_width: int = 800, target_height: int = 533,
+                 filtrar_calidad: bool = True, permitir_recuperacion: bool = True,
+                 reintentos_paralelos: bool = True, presupuesto_reintentos_ms: float = 1500.0,
+                 perfil_parametros: Optional[Dict] = None):
         """
         Inicializar detector de tabla API.
         
         Args:
             target_width: Ancho objetivo de la tabla rectificada
             target_height: Alto objetivo de la tabla rectificada
+            filtrar_calidad: Rechazar fotos borrosas o mal expuestas antes de buscar marcadores
+            permitir_recuperacion: Estimar el marcador que falta cuando solo se detectan 3 de 4
+            reintentos_paralelos: Si falla la detección, lanzar la cascada de reintentos en paralelo
+            presupuesto_reintentos_ms: Tiempo máximo total de la cascada de reintentos
+            perfil_parametros: Ajustes de DetectorParameters (ver cargar_perfil_parametros)
         """
         self.target_width = target_width
         self.target_height = target_height
+        self.filtrar_calidad = filtrar_calidad
+        self.permitir_recuperacion = permitir_recuperacion
+        self.reintentos_paralelos = reintentos_paralelos
+        self.presupuesto_reintentos_ms = presupuesto_reintentos_ms
+        self.pasada_deteccion = None
+        
+        # Modo rig fijo: desplazamiento máximo admitido respecto a la foto anterior
+        self.tolerancia_rig_px = 4.0
+        
+        # Error máximo admitido en la recuperación, como fracción del lado del marcador
+        self.max_error_recuperacion = 0.15
+        self.recuperacion = None
         
         # Configurar ArUco
         self.aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-        self.parameters = cv2.aruco.DetectorParameters()
+        self.parameters = crear_parametros_detector(perfil_parametros)
         self.detector = cv2.aruco.ArucoDetector(self.aruco_dict, self.parameters)
         
         # IDs esperados para cada esquina (ajustado según tu configuración real)
@@ -41,7 +132,15 @@ class TablaAPIDetector:
             1: "inferior_izquierda",    # ID 1 está en inferior izquierda
             2: "inferior_derecha"       # ID 2 está en inferior derecha
         }
+
+        # Filtro de calidad previo a la detección
+        self.evaluador_calidad = EvaluadorCalidad()
         
+        # Preflight sobre miniatura (~320 px): umbrales más permisivos
+        self.evaluador_preflight = EvaluadorCalidad(lado_max=LADO_MINIATURA, nitidez_min=50.0,
+                                                    luminancia_max=220.0, ratio_luces_max=0.5)
+        self._detector_miniatura = None
+
     def detectar_marcadores(self, img: np.ndarray) -> Tuple[Optional[Dict], bool, str]:
         """
         Detectar y validar marcadores ArUco.
@@ -49,35 +148,39 @@ class TablaAPIDetector:
         Returns:
             Tuple[marcadores_info, exito, mensaje]
         """
+        self.recuperacion = None
+        self.pasada_deteccion = "normal"
+        
         try:
             # Detectar marcadores
-            corners, ids, _ = self.detector.detectMarkers(img)
-            
-            if ids is None or len(ids) == 0:
+            with etapa('detect_markers'):
+                corners, ids, _ = self.detector.detectMarkers(img)
+            self.marcadores_detectados_todos, marcadores_validos = self._clasificar_marcadores(corners, ids)
+            
+            # Si la pasada normal falla, cascada de preprocesados/parámetros en paralelo
+            if (len(marcadores_validos) < 4 or not self._validar_geometria(marcadores_validos)) \
+                    and self.reintentos_paralelos:
+                with etapa('cascada_reintentos'):
+                    reintento = self._cascada_reintentos(img, len(marcadores_validos))
+                if reintento is not None:
+                    self.pasada_deteccion, self.marcadores_detectados_todos, marcadores_validos = reintento
+            
+            if not self.marcadores_detectados_todos:
+                FALLOS_DETECCION.inc(motivo='sin_marcadores')
                 return None, False, "No se detectaron marcadores ArUco"
             
-            # Crear diccionario de TODOS los marcadores detectados
-            self.marcadores_detectados_todos = {}
-            marcadores_validos = {}
-            
-            for i, marker_id in enumerate(ids.flatten()):
-                info_marcador = {
-                    'corners': corners[i][0],
-                    'centro': np.mean(corners[i][0], axis=0),
-                    'posicion': self.expected_ids.get(marker_id, f"desconocido_id_{marker_id}")
-                }
-                
-                # Guardar TODOS los marcadores detectados
-                self.marcadores_detectados_todos[marker_id] = info_marcador
-                
-                # Solo agregar a válidos si está en los IDs esperados
-                if marker_id in self.expected_ids:
-                    marcadores_validos[marker_id] = info_marcador
-            
             # Verificar si tenemos todos los marcadores necesarios
             expected_ids = set(self.expected_ids.keys())
             detected_valid_ids = set(marcadores_validos.keys())
             
+            # Recuperación: con 3 de 4 marcadores se estima el cuarto por homografía
+            if len(marcadores_validos) == 3 and self.permitir_recuperacion:
+                with etapa('recuperacion_marcador'):
+                    recuperados = self._recuperar_marcador_faltante(marcadores_validos)
+                if recuperados is not None:
+                    marcadores_validos = recuperados
+                    detected_valid_ids = set(marcadores_validos.keys())
+            
             if len(marcadores_validos) < 4:
                 missing = expected_ids - detected_valid_ids
                 found = detected_valid_ids
@@ -90,24 +193,247 @@ class TablaAPIDetector:
                 if extra:
                     mensaje += f"\n⚠️ Marcadores extra detectados: {sorted(extra)}"
                 
+                FALLOS_DETECCION.inc(motivo='marcadores_faltantes')
                 return None, False, mensaje
             
             # Validar que tenemos exactamente los IDs esperados
             if not expected_ids.issubset(detected_valid_ids):
                 missing = expected_ids - detected_valid_ids
+                FALLOS_DETECCION.inc(motivo='marcadores_faltantes')
                 return None, False, f"Faltan marcadores con IDs: {missing}"
             
             # Validar geometría de los marcadores
             if not self._validar_geometria(marcadores_validos):
+                FALLOS_DETECCION.inc(motivo='geometria_invalida')
                 return None, False, "La geometría de los marcadores no es válida"
             
+            if self.recuperacion is not None:
+                id_rec = self.recuperacion['id_recuperado']
+                mensaje = (f"Marcador ID_{id_rec}({self.expected_ids[id_rec]}) estimado a partir de 3/4 "
+                           f"(error estimado {self.recuperacion['error_estimado_px']:.1f} px)")
+                logger.info(f"🩹 {mensaje}")
+                return marcadores_validos, True, mensaje
+            
             logger.info(f"✅ Detectados correctamente {len(marcadores_validos)} marcadores ArUco")
+            if self.pasada_deteccion != "normal":
+                return marcadores_validos, True, f"Marcadores detectados correctamente (reintento: {self.pasada_deteccion})"
             return marcadores_validos, True, "Marcadores detectados correctamente"
             
         except Exception as e:
             logger.error(f"Error en detección de marcadores: {e}")
+            FALLOS_DETECCION.inc(motivo='error')
             return None, False, f"Error en detección: {str(e)}"
     
+    def _clasificar_marcadores(self, corners, ids) -> Tuple[Dict, Dict]:
+        """
+        Organizar la salida de detectMarkers.
+        
+        Returns:
+            Tuple[todos_los_marcadores, marcadores_con_id_esperado]
+        """
+        todos = {}
+        validos = {}
+        if ids is None or len(ids) == 0:
+            return todos, validos
+        
+        for i, marker_id in enumerate(ids.flatten()):
+            info_marcador = {
+                'corners': corners[i][0],
+                'centro': np.mean(corners[i][0], axis=0),
+                'posicion': self.expected_ids.get(marker_id, f"desconocido_id_{marker_id}")
+            }
+            
+            # Guardar TODOS los marcadores detectados
+            todos[marker_id] = info_marcador
+            
+            # Solo agregar a válidos si está en los IDs esperados
+            if marker_id in self.expected_ids:
+                validos[marker_id] = info_marcador
+        
+        return todos, validos
+    
+    def _pasada_reintento(self, gray: np.ndarray, nombre: str, preprocesado, ajustes: Dict,
+                          cancelado: threading.Event) -> Optional[Tuple[str, Dict, Dict]]:
+        """Ejecutar una pasada de la cascada; devuelve None si se canceló antes de empezar."""
+        if cancelado.is_set():
+            return None
+        
+        detector = cv2.aruco.ArucoDetector(self.aruco_dict, crear_parametros_detector(ajustes))
+        
+        img_pasada = preprocesado(gray) if preprocesado is not None else gray
+        if cancelado.is_set():
+            return None
+        corners, ids, _ = detector.detectMarkers(img_pasada)
+        todos, validos = self._clasificar_marcadores(corners, ids)
+        return nombre, todos, validos
+    
+    def _cascada_reintentos(self, img: np.ndarray, validos_iniciales: int) -> Optional[Tuple[str, Dict, Dict]]:
+        """
+        Cascada acotada de reintentos en paralelo (CLAHE, gamma, ventanas de umbral,
+        refinamiento de esquinas). Gana la primera pasada con los 4 marcadores y geometría
+        válida; las demás se cancelan. Respeta presupuesto_reintentos_ms.
+        
+        Returns:
+            (nombre_pasada, todos, validos) del mejor intento, o None si ninguno mejora la pasada normal
+        """
+        inicio = time.perf_counter()
+        limite = inicio + self.presupuesto_reintentos_ms / 1000.0
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+        
+        cancelado = threading.Event()
+        pool = _obtener_pool_reintentos()
+        pendientes = {
+            pool.submit(self._pasada_reintento, gray, nombre, preprocesado, ajustes, cancelado)
+            for nombre, preprocesado, ajustes in CASCADA_REINTENTOS
+        }
+        
+        mejor = None
+        mejor_validos = validos_iniciales
+        ganador = None
+        try:
+            while pendientes and ganador is None:
+                restante = limite - time.perf_counter()
+                if restante <= 0:
+                    break
+                terminados, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    try:
+                        salida = futuro.result()
+                    except Exception as e:
+                        logger.warning(f"⚠️ Pasada de reintento con error: {e}")
+                        continue
+                    if salida is None:
+                        continue
+                    nombre, todos, validos = salida
+                    if len(validos) == 4 and self._validar_geometria(validos):
+                        ganador = salida
+                        break
+                    if len(validos) > mejor_validos:
+                        mejor, mejor_validos = salida, len(validos)
+        finally:
+            # Cancelar lo que no ha empezado; las pasadas en curso terminan y se ignoran
+            cancelado.set()
+            for futuro in pendientes:
+                futuro.cancel()
+        
+        transcurrido = (time.perf_counter() - inicio) * 1000
+        if ganador is not None:
+            logger.info(f"🔁 Reintento '{ganador[0]}' detectó los 4 marcadores ({transcurrido:.0f} ms)")
+            return ganador
+        logger.info(f"🔁 Cascada de reintentos sin éxito completo ({transcurrido:.0f} ms, "
+                    f"mejor: {mejor[0] if mejor else 'ninguno'})")
+        return mejor
+    
+    # Esquina exterior (índice en corners) de cada marcador y, para estimarla si falta,
+    # los dos bordes de los marcadores vecinos que pasan por ella: (id_vecino, idx_a, idx_b)
+    _ESQUINA_EXTERIOR = {3: 0, 0: 1, 2: 2, 1: 3}
+    _BORDES_VECINOS = {
+        3: [(0, 0, 1), (1, 0, 3)],  # borde superior de ID 0, borde izquierdo de ID 1
+        0: [(3, 0, 1), (2, 1, 2)],  # borde superior de ID 3, borde derecho de ID 2
+        2: [(1, 3, 2), (0, 1, 2)],  # borde inferior de ID 1, borde derecho de ID 0
+        1: [(2, 3, 2), (3, 0, 3)]   # borde inferior de ID 2, borde izquierdo de ID 3
+    }
+    
+    def _layout_canonico(self, lado: float) -> Dict[int, np.ndarray]:
+        """Esquinas de los 4 marcadores en el plano de la tabla rectificada (marcadores de lado 'lado')."""
+        w, h, s = float(self.target_width - 1), float(self.target_height - 1), lado
+        return {
+            3: np.array([[0, 0], [s, 0], [s, s], [0, s]], dtype=np.float32),
+            0: np.array([[w - s, 0], [w, 0], [w, s], [w - s, s]], dtype=np.float32),
+            1: np.array([[0, h - s], [s, h - s], [s, h], [0, h]], dtype=np.float32),
+            2: np.array([[w - s, h - s], [w, h - s], [w, h], [w - s, h]], dtype=np.float32)
+        }
+    
+    @staticmethod
+    def _interseccion_rectas(p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, p4: np.ndarray) -> Optional[np.ndarray]:
+        """Intersección de la recta p1-p2 con la recta p3-p4 (coordenadas homogéneas)."""
+        l1 = np.cross([p1[0], p1[1], 1.0], [p2[0], p2[1], 1.0])
+        l2 = np.cross([p3[0], p3[1], 1.0], [p4[0], p4[1], 1.0])
+        punto = np.cross(l1, l2)
+        if abs(punto[2]) < 1e-9:
+            return None
+        return (punto[:2] / punto[2]).astype(np.float32)
+    
+    def _recuperar_marcador_faltante(self, marcadores: Dict) -> Optional[Dict]:
+        """
+        Estimar el marcador que falta a partir de las 12 esquinas de los otros tres.
+        
+        1. Estimación inicial de la esquina exterior por intersección de los bordes vecinos.
+        2. Homografía por mínimos cuadrados entre las 12 esquinas detectadas y el layout canónico.
+        
+        Returns:
+            Diccionario de marcadores completo (con el estimado marcado como 'recuperado') o None
+        """
+        try:
+            id_faltante = (set(self.expected_ids.keys()) - set(marcadores.keys())).pop()
+            
+            # 1. Esquina exterior por intersección de bordes (invariante proyectivo)
+            (id_a, a0, a1), (id_b, b0, b1) = self._BORDES_VECINOS[id_faltante]
+            ca, cb = marcadores[id_a]['corners'], marcadores[id_b]['corners']
+            esquina_inicial = self._interseccion_rectas(ca[a0], ca[a1], cb[b0], cb[b1])
+            if esquina_inicial is None:
+                return None
+            
+            # Homografía inicial con las 4 esquinas exteriores para estimar el lado del marcador
+            exteriores = {id_: info['corners'][self._ESQUINA_EXTERIOR[id_]] for id_, info in marcadores.items()}
+            exteriores[id_faltante] = esquina_inicial
+            pts_img = np.array([exteriores[3], exteriores[0], exteriores[2], exteriores[1]], dtype=np.float32)
+            canon_ext = self._layout_canonico(0.0)
+            pts_canon = np.array([canon_ext[3][0], canon_ext[0][1], canon_ext[2][2], canon_ext[1][3]], dtype=np.float32)
+            H_inicial = cv2.getPerspectiveTransform(pts_img, pts_canon)
+            
+            lados = []
+            for info in marcadores.values():
+                c = cv2.perspectiveTransform(info['corners'].reshape(-1, 1, 2).astype(np.float32), H_inicial).reshape(-1, 2)
+                lados.extend(np.linalg.norm(c - np.roll(c, -1, axis=0), axis=1))
+            lado = float(np.mean(lados))
+            if lado <= 0:
+                return None
+            
+            # 2. Homografía por mínimos cuadrados con las 12 esquinas conocidas
+            layout = self._layout_canonico(lado)
+            ids_presentes = sorted(marcadores.keys())
+            src = np.concatenate([layout[id_] for id_ in ids_presentes])
+            dst = np.concatenate([marcadores[id_]['corners'].astype(np.float32) for id_ in ids_presentes])
+            H, _ = cv2.findHomography(src, dst, 0)
+            if H is None:
+                return None
+            
+            proyectadas = cv2.perspectiveTransform(src.reshape(-1, 1, 2), H).reshape(-1, 2)
+            error_rms = float(np.sqrt(np.mean(np.sum((proyectadas - dst) ** 2, axis=1))))
+            
+            esquinas_faltante = cv2.perspectiveTransform(layout[id_faltante].reshape(-1, 1, 2), H).reshape(-1, 2)
+            idx_ext = self._ESQUINA_EXTERIOR[id_faltante]
+            discrepancia = float(np.linalg.norm(esquinas_faltante[idx_ext] - esquina_inicial))
+            error_estimado = max(error_rms, discrepancia)
+            
+            # Lado medio del marcador en la imagen, para un umbral relativo
+            lado_img = float(np.mean([np.linalg.norm(c - np.roll(c, -1, axis=0), axis=1).mean()
+                                      for c in dst.reshape(-1, 4, 2)]))
+            if error_estimado > self.max_error_recuperacion * lado_img:
+                logger.warning(f"⚠️ Recuperación de ID_{id_faltante} descartada: error {error_estimado:.1f} px "
+                               f"(lado marcador {lado_img:.1f} px)")
+                return None
+            
+            completos = dict(marcadores)
+            completos[id_faltante] = {
+                'corners': esquinas_faltante.astype(np.float32),
+                'centro': np.mean(esquinas_faltante, axis=0),
+                'posicion': self.expected_ids[id_faltante],
+                'recuperado': True
+            }
+            self.recuperacion = {
+                'id_recuperado': int(id_faltante),
+                'error_estimado_px': error_estimado,
+                'error_rms_px': error_rms,
+                'discrepancia_px': discrepancia
+            }
+            return completos
+            
+        except Exception as e:
+            logger.error(f"Error recuperando marcador faltante: {e}")
+            return None
+    
     def _validar_geometria(self, marcadores: Dict) -> bool:
         """
         Validar que los marcadores forman un cuadrilátero válido.
@@ -228,6 +554,61 @@ class TablaAPIDetector:
         
         return np.array(esquinas, dtype="float32")
     
+    def verificar_marcadores_previos(self, img: np.ndarray, rig_previo: Dict) -> Optional[Dict]:
+        """
+        Modo rig fijo: comprobar en ventanas pequeñas alrededor de las esquinas cacheadas
+        que los 4 marcadores siguen donde estaban en la foto anterior.
+        
+        Args:
+            img: Imagen actual
+            rig_previo: {'marcadores', 'homografia', 'dimensiones'} de una detección anterior
+        
+        Returns:
+            Los marcadores cacheados si todos siguen dentro de tolerancia_rig_px, o None
+        """
+        try:
+            h, w = img.shape[:2]
+            if tuple(rig_previo['dimensiones']) != (w, h):
+                return None
+            
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+            desplazamiento_max = 0.0
+            
+            for id_, info in rig_previo['marcadores'].items():
+                x, y, bw, bh = cv2.boundingRect(info['corners'].astype(np.float32))
+                margen = max(bw, bh) // 2
+                x0, y0 = max(0, x - margen), max(0, y - margen)
+                x1, y1 = min(w, x + bw + margen), min(h, y + bh + margen)
+                
+                corners, ids, _ = self.detector.detectMarkers(gray[y0:y1, x0:x1])
+                if ids is None or id_ not in ids.flatten():
+                    logger.info(f"🔧 Rig: ID_{id_} no encontrado en su ventana, detección completa")
+                    return None
+                
+                idx = list(ids.flatten()).index(id_)
+                esquinas = corners[idx][0] + np.array([x0, y0], dtype=np.float32)
+                desplazamiento = float(np.max(np.linalg.norm(esquinas - info['corners'], axis=1)))
+                desplazamiento_max = max(desplazamiento_max, desplazamiento)
+                if desplazamiento > self.tolerancia_rig_px:
+                    logger.info(f"🔧 Rig: ID_{id_} desplazado {desplazamiento:.1f} px, detección completa")
+                    return None
+            
+            logger.info(f"🔧 Rig fijo verificado (desplazamiento máximo {desplazamiento_max:.1f} px)")
+            return rig_previo['marcadores']
+            
+        except Exception as e:
+            logger.error(f"Error verificando rig fijo: {e}")
+            return None
+    
+    def rectificar_con_homografia(self, img: np.ndarray, M: np.ndarray) -> Optional[np.ndarray]:
+        """Rectificar reutilizando una homografía ya calculada."""
+        try:
+            with etapa('warp_perspective'):
+                return cv2.warpPerspective(img, M, (self.target_width, self.target_height))
+        except Exception as e:
+            logger.error(f"Error rectificando con homografía cacheada: {e}")
+            return None
+    
     def rectificar_tabla(self, img: np.ndarray, pts_src: np.ndarray) -> Tuple[Optional[np.ndarray], np.ndarray]:
         """
         Rectificar perspectiva de la tabla.
@@ -248,9 +629,10 @@ class TablaAPIDetector:
             M = cv2.getPerspectiveTransform(pts_src, pts_dst)
             
             # Aplicar transformación
-            tabla_rectificada = cv2.warpPerspective(
-                img, M, (self.target_width, self.target_height)
-            )
+            with etapa('warp_perspective'):
+                tabla_rectificada = cv2.warpPerspective(
+                    img, M, (self.target_width, self.target_height)
+                )
             
             logger.info(f"✅ Tabla rectificada a {self.target_width}x{self.target_height}")
             return tabla_rectificada, M
@@ -258,74 +640,186 @@ class TablaAPIDetector:
         except Exception as e:
             logger.error(f"Error rectificando tabla: {e}")
             return None, None
-    
-    def procesar_imagen(self, ruta_imagen: str) -> Dict:
+
+    def _obtener_detector_miniatura(self):
+        """Detector con ventanas de umbral pequeñas, ajustado a marcadores de pocos píxeles."""
+        if self._detector_miniatura is None:
+            parametros = cv2.aruco.DetectorParameters()
+            parametros.minMarkerPerimeterRate = 0.01
+            parametros.adaptiveThreshWinSizeMin = 3
+            parametros.adaptiveThreshWinSizeMax = 15
+            parametros.adaptiveThreshWinSizeStep = 4
+            self._detector_miniatura = cv2.aruco.ArucoDetector(self.aruco_dict, parametros)
+        return self._detector_miniatura
+
+    def preflight(self, img: np.ndarray) -> Dict:
+        """
+        Comprobación rápida sobre una miniatura antes de subir la foto completa.
+        Verifica presencia de marcadores, nitidez y exposición.
+
+        Returns:
+            Dict con 'enviar' (si merece la pena subir la imagen completa) y las métricas medidas
+        """
+        inicio = time.perf_counter()
+        miniatura, _ = reducir_imagen(img, LADO_MINIATURA)
+        gray = a_grises(miniatura)
+
+        _, ids, _ = self._obtener_detector_miniatura().detectMarkers(gray)
+        detectados = set() if ids is None else {int(id_) for id_ in ids.flatten()}
+        encontrados = sorted(detectados & set(self.expected_ids.keys()))
+        faltan = sorted(set(self.expected_ids.keys()) - detectados)
+
+        calidad = self.evaluador_preflight.evaluar(miniatura)
+
+        problemas = []
+        # En miniatura algún marcador puede perderse por la reducción: con 3 de 4 se sube igualmente
+        if len(encontrados) < 3:
+            problemas.append(f"Solo se ven {len(encontrados)}/4 marcadores; encuadra las cuatro esquinas")
+        if not calidad['apta']:
+            problemas.append(calidad['mensaje'])
+
+        return {
+            'enviar': not problemas,
+            'mensaje': "Imagen apta para procesar" if not problemas else "; ".join(problemas),
+            'marcadores_encontrados': encontrados,
+            'marcadores_faltantes': faltan,
+            **calidad['metricas'],
+            'tiempo_ms': (time.perf_counter() - inicio) * 1000
+        }
+
+    def procesar_imagen(self, ruta_imagen: str, rig_previo: Optional[Dict] = None) -> Dict:
         """
         Proceso completo: detectar, validar y rectificar.
         
+        Args:
+            ruta_imagen: Ruta de la foto
+            rig_previo: Resultado 'rig' de una detección anterior (modo rig fijo); si los
+                marcadores no se han movido se reutiliza su homografía sin detección completa
+        
         Returns:
             Dict con resultados del procesamiento
         """
-        resultado = {
+        if not os.path.exists(ruta_imagen):
+            return self._resultado_vacio(f"No se encuentra la imagen: {ruta_imagen}")
+            
+        with etapa('imread'):
+            img = cv2.imread(ruta_imagen)
+        if img is None:
+            return self._resultado_vacio(f"No se pudo cargar la imagen: {ruta_imagen}")
+        
+        return self.procesar_array(img, rig_previo)
+    
+    @staticmethod
+    def _resultado_vacio(mensaje: str = '') -> Dict:
+        """Resultado sin éxito con todos los campos a None."""
+        return {
             'exito': False,
-            'mensaje': '',
+            'mensaje': mensaje,
             'imagen_original': None,
             'imagen_marcadores': None,
             'imagen_rectificada': None,
             'marcadores': None,
-            'homografia': None
+            'homografia': None,
+            'calidad': None,
+            'recuperado': False,
+            'error_recuperacion_px': None,
+            'pasada_deteccion': None,
+            'rig': None
         }
+    
+    @etapa('procesar_imagen')
+    def procesar_array(self, img: np.ndarray, rig_previo: Optional[Dict] = None) -> Dict:
+        """
+        Igual que procesar_imagen con la foto ya decodificada (BGR).
+        
+        Args:
+            img: Foto en BGR
+            rig_previo: Resultado 'rig' de una detección anterior (modo rig fijo)
+        
+        Returns:
+            Dict con resultados del procesamiento
+        """
+        resultado = self._resultado_vacio()
         
         # Inicializar variable para todos los marcadores detectados
         self.marcadores_detectados_todos = {}
         
         try:
-            # Cargar imagen
-            if not os.path.exists(ruta_imagen):
-                resultado['mensaje'] = f"No se encuentra la imagen: {ruta_imagen}"
-                return resultado
-                
-            img = cv2.imread(ruta_imagen)
-            if img is None:
-                resultado['mensaje'] = f"No se pudo cargar la imagen: {ruta_imagen}"
-                return resultado
-                
             resultado['imagen_original'] = img.copy()
             logger.info(f"📸 Imagen cargada: {img.shape[1]}x{img.shape[0]}")
             
+            # Filtro de calidad antes de la detección
+            if self.filtrar_calidad:
+                with etapa('calidad'):
+                    calidad = self.evaluador_calidad.evaluar(img)
+                resultado['calidad'] = calidad['metricas']
+                if not calidad['apta']:
+                    FALLOS_DETECCION.inc(motivo='calidad')
+                    logger.warning(f"⚠️ Imagen rechazada por calidad: {calidad['mensaje']}")
+                    resultado['mensaje'] = calidad['mensaje']
+                    return resultado
+            
+            # Modo rig fijo: verificación barata de los marcadores de la foto anterior
+            marcadores = None
+            if rig_previo is not None:
+                with etapa('verificacion_rig'):
+                    marcadores = self.verificar_marcadores_previos(img, rig_previo)
+                if marcadores is not None:
+                    self.pasada_deteccion = "rig_fijo"
+                    self.recuperacion = None
+            
             # Detectar marcadores
-            marcadores, exito, mensaje = self.detectar_marcadores(img)
-            if not exito:
-                resultado['mensaje'] = mensaje
-                
-                # NUEVA FUNCIONALIDAD: Mostrar marcadores parciales si los hay
-                if hasattr(self, 'marcadores_detectados_todos') and self.marcadores_detectados_todos:
-                    img_marcadores_parciales = self.dibujar_marcadores_detallados(img, self.marcadores_detectados_todos)
-                    resultado['imagen_marcadores'] = img_marcadores_parciales
-                    logger.info(f"📋 Mostrando {len(self.marcadores_detectados_todos)} marcadores detectados parcialmente")
-                
-                return resultado
+            if marcadores is None:
+                marcadores, exito, mensaje = self.detectar_marcadores(img)
+                if not exito:
+                    resultado['mensaje'] = mensaje
+                    
+                    # NUEVA FUNCIONALIDAD: Mostrar marcadores parciales si los hay
+                    if hasattr(self, 'marcadores_detectados_todos') and self.marcadores_detectados_todos:
+                        img_marcadores_parciales = self.dibujar_marcadores_detallados(img, self.marcadores_detectados_todos)
+                        resultado['imagen_marcadores'] = img_marcadores_parciales
+                        logger.info(f"📋 Mostrando {len(self.marcadores_detectados_todos)} marcadores detectados parcialmente")
+                    
+                    return resultado
             
             resultado['marcadores'] = marcadores
+            resultado['pasada_deteccion'] = self.pasada_deteccion
             
             # Dibujar marcadores para visualización (método original)
             corners_list = [marcadores[id_]['corners'].reshape(1, -1, 2) for id_ in sorted(marcadores.keys())]
             ids_array = np.array([[id_] for id_ in sorted(marcadores.keys())])
             
             img_marcadores = cv2.aruco.drawDetectedMarkers(img.copy(), corners_list, ids_array)
-            resultado['imagen_marcadores'] = img_marcadores
             
-            # Extraer puntos para rectificación
-            pts_src = self.extraer_puntos_esquinas(marcadores)
+            # Resaltar el marcador estimado por recuperación
+            if self.recuperacion is not None:
+                id_rec = self.recuperacion['id_recuperado']
+                cv2.polylines(img_marcadores, [marcadores[id_rec]['corners'].reshape(1, -1, 2).astype(np.int32)],
+                              True, (0, 165, 255), 3)
+                resultado['recuperado'] = True
+                resultado['error_recuperacion_px'] = self.recuperacion['error_estimado_px']
+            
+            resultado['imagen_marcadores'] = img_marcadores
             
-            # Rectificar tabla
-            tabla_rectificada, homografia = self.rectificar_tabla(img, pts_src)
+            # Rectificar tabla (en rig fijo se reutiliza la homografía anterior)
+            if self.pasada_deteccion == "rig_fijo":
+                homografia = rig_previo['homografia']
+                tabla_rectificada = self.rectificar_con_homografia(img, homografia)
+            else:
+                pts_src = self.extraer_puntos_esquinas(marcadores)
+                tabla_rectificada, homografia = self.rectificar_tabla(img, pts_src)
             if tabla_rectificada is None:
+                FALLOS_DETECCION.inc(motivo='rectificacion')
                 resultado['mensaje'] = "Error en rectificación de perspectiva"
                 return resultado
                 
             resultado['imagen_rectificada'] = tabla_rectificada
             resultado['homografia'] = homografia
+            resultado['rig'] = {
+                'marcadores': marcadores,
+                'homografia': homografia,
+                'dimensiones': (img.shape[1], img.shape[0])
+            }
             resultado['exito'] = True
             resultado['mensaje'] = "Procesamiento completado exitosamente"
             
@@ -444,9 +938,15 @@ def main():
     # Crear detector
     detector = TablaAPIDetector(target_width=800, target_height=533)
     
-    # Procesar imagen
+    # Procesar imagen con el mismo grafo de etapas que la API
+    from pipeline_probetas import crear_pipeline, TAMANO_TABLA
     ruta_imagen = "tabla_con_aruco3.jpg"
-    resultado = detector.procesar_imagen(ruta_imagen)
+    img = cv2.imread(ruta_imagen)
+    if img is None:
+        print(f"❌ No se pudo cargar la imagen: {ruta_imagen}")
+        return
+    pipeline = crear_pipeline(crear_detector=lambda tamano: detector)
+    resultado = pipeline.ejecutar({'foto': img, 'tamano': TAMANO_TABLA, 'rig_previo': None}, ['deteccion'])['deteccion']
     
     # Mostrar resultados
     detector.mostrar_resultados(resultado)
@@ -461,4 +961,4 @@ def main():
         cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+💾 Instantáneas persistentes de las calibraciones activas
+Cada calibración se escribe en un SQLite local al activarse (una fila por usuario con
+los bytes de CalibracionCompacta y su índice) y al arrancar el proceso se cargan de
+golpe las que siguen vigentes: un deploy, un reinicio de Render o el reciclaje de un
+worker ya no obligan a los usuarios a repetir detección + extracción de la tabla.
+
+Con varios workers de gunicorn cada uno abre su propia conexión (modo WAL); si un
+usuario no está en la memoria del worker se busca en el archivo, así que una
+calibración hecha en un worker sirve en los demás.
+
+Los errores de SQLite solo se registran: la persistencia nunca tumba una petición.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+import metricas
+from calibracion_compacta import CalibracionCompacta
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RESTAURADAS = metricas.contador('probetas_calibraciones_restauradas_total',
+                                'Calibraciones recuperadas del almacén (al arrancar o desde otro worker)', ('origen',))
+RECALIBRACIONES_EVITADAS = metricas.contador('probetas_recalibraciones_evitadas_total',
+                                             'Análisis servidos con una calibración restaurada (primer uso por usuario)')
+ERRORES_ALMACEN = metricas.contador('probetas_almacen_calibraciones_errores_total',
+                                    'Errores de lectura o escritura del almacén de calibraciones', ('operacion',))
+RECUPERACION = metricas.medidor('probetas_calibraciones_recuperacion_segundos',
+                                'Duración de la carga de calibraciones al arrancar')
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS calibraciones (
+    user_code TEXT PRIMARY KEY,
+    creada REAL NOT NULL,
+    expira REAL NOT NULL,
+    datos BLOB NOT NULL,
+    indice TEXT NOT NULL
+)
+"""
+
+
+class AlmacenCalibraciones:
+    """Calibraciones por usuario en SQLite, con la misma expiración que en memoria."""
+
+    def __init__(self, ruta: Optional[str]):
+        """
+        Args:
+            ruta: Archivo SQLite (None o '' desactiva la persistencia)
+        """
+        self.ruta = ruta or None
+        self.escritas = 0
+        self.restauradas = 0
+        self.duracion_carga_s: Optional[float] = None
+        self._conexion: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _conectar(self) -> sqlite3.Connection:
+        # Una conexión por proceso: tras un fork la del padre no se reutiliza
+        if self._conexion is None or self._pid != os.getpid():
+            directorio = os.path.dirname(os.path.abspath(self.ruta))
+            os.makedirs(directorio, exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            conexion.execute(ESQUEMA)
+            self._conexion, self._pid = conexion, os.getpid()
+        return self._conexion
+
+    @staticmethod
+    def _entrada(fila, restaurada: bool = True) -> Dict:
+        _, creada, expira, datos, indice = fila
+        return {
+            'calibracion': CalibracionCompacta.deserializar(datos, indice),
+            'timestamp': datetime.fromtimestamp(creada),
+            'expires': datetime.fromtimestamp(expira),
+            'restaurada': restaurada
+        }
+
+    def guardar(self, user_code: str, calibracion: CalibracionCompacta, creada: datetime, expira: datetime):
+        """Escribir (o sustituir) la calibración del usuario."""
+        if self.ruta is None:
+            return
+        datos, indice = calibracion.serializar()
+        try:
+            with self._lock:
+                self._conectar().execute(
+                    'INSERT OR REPLACE INTO calibraciones VALUES (?, ?, ?, ?, ?)',
+                    (user_code, creada.timestamp(), expira.timestamp(), datos, indice))
+                self.escritas += 1
+        except sqlite3.Error as e:
+            ERRORES_ALMACEN.inc(operacion='guardar')
+            logger.warning(f"💾 No se pudo guardar la calibración de {user_code}: {e}")
+
+    def obtener(self, user_code: str, ahora: datetime, posterior_a: Optional[datetime] = None) -> Optional[Dict]:
+        """
+        Calibración vigente de un usuario guardada por otro worker o antes de un reinicio.
+
+        Args:
+            user_code: Usuario
+            ahora: Instante de referencia para la expiración
+            posterior_a: Creación de la que ya hay en memoria (solo se devuelve una más reciente)
+        """
+        if self.ruta is None:
+            return None
+        try:
+            with self._lock:
+                fila = self._conectar().execute(
+                    'SELECT * FROM calibraciones WHERE user_code = ? AND expira > ? AND creada > ?',
+                    (user_code, ahora.timestamp(), posterior_a.timestamp() if posterior_a else 0.0)).fetchone()
+        except sqlite3.Error as e:
+            ERRORES_ALMACEN.inc(operacion='obtener')
+            logger.warning(f"💾 No se pudo leer la calibración de {user_code}: {e}")
+            return None
+        if fila is None:
+            return None
+        RESTAURADAS.inc(origen='otro_worker')
+        self.restauradas += 1
+        # Sustituir una calibración más antigua no evita ninguna recalibración
+        return self._entrada(fila, restaurada=posterior_a is None)
+
+    def cargar_vigentes(self, ahora: datetime) -> Dict[str, Dict]:
+        """
+        Borrar las expiradas y cargar todas las vigentes en una sola consulta.
+
+        Returns:
+            user_code -> {'calibracion', 'timestamp', 'expires', 'restaurada'}
+        """
+        if self.ruta is None:
+            return {}
+        inicio = time.perf_counter()
+        try:
+            with self._lock:
+                conexion = self._conectar()
+                conexion.execute('DELETE FROM calibraciones WHERE expira <= ?', (ahora.timestamp(),))
+                filas = conexion.execute('SELECT * FROM calibraciones').fetchall()
+        except sqlite3.Error as e:
+            ERRORES_ALMACEN.inc(operacion='cargar')
+            logger.warning(f"💾 No se pudieron cargar las calibraciones de {self.ruta}: {e}")
+            return {}
+        entradas = {fila[0]: self._entrada(fila) for fila in filas}
+        self.duracion_carga_s = time.perf_counter() - inicio
+        RECUPERACION.set(self.duracion_carga_s)
+        RESTAURADAS.inc(len(entradas), origen='arranque')
+        self.restauradas += len(entradas)
+        if entradas:
+            logger.info(f"💾 {len(entradas)} calibraciones restauradas de {self.ruta} "
+                        f"en {self.duracion_carga_s * 1000:.1f} ms")
+        return entradas
+
+    def borrar_expiradas(self, ahora: datetime):
+        if self.ruta is None:
+            return
+        try:
+            with self._lock:
+                self._conectar().execute('DELETE FROM calibraciones WHERE expira <= ?', (ahora.timestamp(),))
+        except sqlite3.Error as e:
+            ERRORES_ALMACEN.inc(operacion='borrar')
+            logger.warning(f"💾 No se pudieron borrar las calibraciones expiradas: {e}")
+
+    @staticmethod
+    def registrar_uso(entrada: Dict):
+        """Primer análisis con una calibración restaurada: una recalibración evitada."""
+        if entrada.pop('restaurada', False):
+            RECALIBRACIONES_EVITADAS.inc()
+
+    def estadisticas(self) -> Dict:
+        return {
+            'ruta': self.ruta,
+            'escritas': self.escritas,
+            'restauradas': self.restauradas,
+            'carga_ms': round(self.duracion_carga_s * 1000, 2) if self.duracion_carga_s is not None else None
+        }
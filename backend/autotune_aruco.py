@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+⚙️ Autoajuste offline de DetectorParameters de ArUco
+Busca sobre un corpus de fotos de la tabla (reales o sintéticas) la combinación de
+parámetros con menor latencia de detección que mantenga una tasa mínima de detección,
+y guarda un perfil JSON que TablaAPIDetector carga al arrancar (ver ARUCO_PERFIL).
+
+Uso:
+    python autotune_aruco.py --corpus fotos/ --salida perfil_aruco.json
+"""
+
+import cv2
+import numpy as np
+import json
+import time
+import random
+import argparse
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from a2_detectar_aruco import TablaAPIDetector, crear_parametros_detector
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EXTENSIONES_IMAGEN = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+# Espacio de búsqueda: nuestros marcadores impresos tienen tamaño fijo en la foto,
+# así que no hace falta barrer todos los tamaños y ventanas de umbral de serie
+ESPACIO_BUSQUEDA = {
+    'minMarkerPerimeterRate': [0.01, 0.02, 0.03, 0.05, 0.08, 0.12],
+    'maxMarkerPerimeterRate': [0.5, 1.0, 2.0, 4.0],
+    'adaptiveThreshWinSizeMin': [3, 5, 7, 11],
+    'adaptiveThreshWinSizeMax': [11, 15, 23, 33, 43],
+    'adaptiveThreshWinSizeStep': [2, 4, 6, 10, 20],
+    'polygonalApproxAccuracyRate': [0.02, 0.03, 0.05, 0.08]
+}
+
+
+def cargar_corpus(directorio: str, lado_max: Optional[int] = None) -> List[np.ndarray]:
+    """Cargar las imágenes del corpus en escala de grises."""
+    imagenes = []
+    for ruta in sorted(Path(directorio).iterdir()):
+        if ruta.suffix.lower() not in EXTENSIONES_IMAGEN:
+            continue
+        img = cv2.imread(str(ruta), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            logger.warning(f"No se pudo cargar {ruta}")
+            continue
+        if lado_max and max(img.shape) > lado_max:
+            escala = lado_max / max(img.shape)
+            img = cv2.resize(img, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+        imagenes.append(img)
+    return imagenes
+
+
+def evaluar_parametros(imagenes: List[np.ndarray], ajustes: Dict, repeticiones: int = 1) -> Dict:
+    """
+    Medir tasa de detección (4 IDs esperados con geometría válida) y latencia de detectMarkers.
+
+    Returns:
+        Dict con 'tasa_deteccion', 'latencia_media_ms' y 'latencia_p95_ms'
+    """
+    # Sin filtro de calidad, reintentos ni recuperación: se mide solo la pasada normal
+    detector = TablaAPIDetector(filtrar_calidad=False, permitir_recuperacion=False,
+                                reintentos_paralelos=False, perfil_parametros=ajustes)
+    aciertos = 0
+    latencias = []
+    for img in imagenes:
+        mejor = float('inf')
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            corners, ids, _ = detector.detector.detectMarkers(img)
+            mejor = min(mejor, (time.perf_counter() - inicio) * 1000)
+        latencias.append(mejor)
+        _, validos = detector._clasificar_marcadores(corners, ids)
+        if len(validos) == 4 and detector._validar_geometria(validos):
+            aciertos += 1
+    return {
+        'tasa_deteccion': aciertos / len(imagenes) if imagenes else 0.0,
+        'latencia_media_ms': float(np.mean(latencias)) if latencias else 0.0,
+        'latencia_p95_ms': float(np.percentile(latencias, 95)) if latencias else 0.0
+    }
+
+
+def muestrear_ajustes(rng: random.Random) -> Optional[Dict]:
+    """Muestrear una combinación del espacio de búsqueda (None si es incoherente)."""
+    ajustes = {nombre: rng.choice(valores) for nombre, valores in ESPACIO_BUSQUEDA.items()}
+    if ajustes['adaptiveThreshWinSizeMin'] > ajustes['adaptiveThreshWinSizeMax']:
+        return None
+    if ajustes['minMarkerPerimeterRate'] >= ajustes['maxMarkerPerimeterRate']:
+        return None
+    try:
+        crear_parametros_detector(ajustes)
+    except Exception:
+        return None
+    return ajustes
+
+
+def autoajustar(imagenes: List[np.ndarray], iteraciones: int, tasa_minima: Optional[float],
+                semilla: int = 0, repeticiones: int = 1) -> Dict:
+    """
+    Búsqueda aleatoria: minimizar latencia media sujeta a tasa_deteccion >= tasa_minima.
+    Si no se indica tasa_minima se exige la tasa de los parámetros de serie.
+    """
+    base = evaluar_parametros(imagenes, {}, repeticiones)
+    print(f"📏 Parámetros de serie: tasa {base['tasa_deteccion']:.3f}, "
+          f"latencia media {base['latencia_media_ms']:.1f} ms")
+
+    suelo = base['tasa_deteccion'] if tasa_minima is None else tasa_minima
+    mejor = {'parametros': {}, **base}
+
+    rng = random.Random(semilla)
+    vistos = set()
+    for i in range(iteraciones):
+        ajustes = muestrear_ajustes(rng)
+        if ajustes is None:
+            continue
+        clave = tuple(sorted(ajustes.items()))
+        if clave in vistos:
+            continue
+        vistos.add(clave)
+
+        medida = evaluar_parametros(imagenes, ajustes, repeticiones)
+        if medida['tasa_deteccion'] >= suelo and medida['latencia_media_ms'] < mejor['latencia_media_ms']:
+            mejor = {'parametros': ajustes, **medida}
+            print(f"   ✓ [{i + 1}/{iteraciones}] tasa {medida['tasa_deteccion']:.3f}, "
+                  f"latencia {medida['latencia_media_ms']:.1f} ms: {ajustes}")
+
+    return {
+        'version': 1,
+        'generado': datetime.now().isoformat(timespec='seconds'),
+        'imagenes': len(imagenes),
+        'tasa_minima': suelo,
+        'tasa_deteccion': mejor['tasa_deteccion'],
+        'latencia_media_ms': mejor['latencia_media_ms'],
+        'latencia_p95_ms': mejor['latencia_p95_ms'],
+        'referencia_serie': base,
+        'parametros': mejor['parametros']
+    }
+
+
+def main():
+    """Función principal del autoajuste."""
+    parser = argparse.ArgumentParser(description="Autoajuste offline de DetectorParameters de ArUco")
+    parser.add_argument('--corpus', required=True, help="Directorio con fotos de la tabla con los 4 marcadores")
+    parser.add_argument('--salida', default='perfil_aruco.json', help="Ruta del perfil JSON generado")
+    parser.add_argument('--iteraciones', type=int, default=200, help="Combinaciones a probar")
+    parser.add_argument('--tasa-minima', type=float, default=None,
+                        help="Tasa de detección mínima (por defecto, la de los parámetros de serie)")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Repeticiones por imagen (se toma la mínima)")
+    parser.add_argument('--lado-max', type=int, default=None, help="Reducir las imágenes a este lado mayor")
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+    if args.repeticiones < 1:
+        parser.error("--repeticiones debe ser al menos 1")
+
+    imagenes = cargar_corpus(args.corpus, args.lado_max)
+    if not imagenes:
+        print(f"❌ No hay imágenes en {args.corpus}")
+        return
+    print(f"📂 Corpus: {len(imagenes)} imágenes")
+
+    perfil = autoajustar(imagenes, args.iteraciones, args.tasa_minima, args.semilla, args.repeticiones)
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(perfil, f, indent=2, ensure_ascii=False)
+
+    mejora = perfil['referencia_serie']['latencia_media_ms'] / perfil['latencia_media_ms'] \
+        if perfil['latencia_media_ms'] > 0 else 1.0
+    print(f"\n✅ Perfil guardado en {args.salida}")
+    print(f"   • Tasa de detección: {perfil['tasa_deteccion']:.3f} (mínimo {perfil['tasa_minima']:.3f})")
+    print(f"   • Latencia media: {perfil['latencia_media_ms']:.1f} ms (x{mejora:.2f} frente a serie)")
+    print(f"   • Parámetros: {perfil['parametros']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,16 @@ import cv2
 import numpy as np
 import os
 from openpyxl import Workbook
+import copy
 import json
 from pathlib import Path
 import logging
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass
 
+from calidad_imagen import EvaluadorCalidad
+from metricas import etapa
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -173,42 +177,50 @@ class SelectorTablaManual:
                 else:
                     print("⚠️ Primero debes hacer una selección")
 
+# Tabla del API Freshwater Master Test Kit (una columna por parámetro, de izquierda a derecha);
+# es la que describe referencia2.jpg y la plantilla plantillas/api_freshwater.json
+PARAMETROS_API_FRESHWATER = {
+    'pH': {
+        'valores': [6.0, 6.4, 6.6, 6.8, 7.0, 7.2, 7.6],
+        'posicion_columna': 0,
+        'nombre_completo': 'pH'
+    },
+    'High_Range_pH': {
+        'valores': [7.4, 7.8, 8.0, 8.2, 8.4, 8.8],
+        'posicion_columna': 1,
+        'nombre_completo': 'High Range pH'
+    },
+    'Ammonia': {
+        'valores': [0, 0.25, 0.50, 1.0, 2.0, 4.0, 8.0],
+        'posicion_columna': 2,
+        'nombre_completo': 'Ammonia (NH₃/NH₄⁺) ppm'
+    },
+    'Nitrite': {
+        'valores': [0, 0.25, 0.50, 1.0, 2.0, 5.0],
+        'posicion_columna': 3,
+        'nombre_completo': 'Nitrite (NO₂⁻) ppm'
+    },
+    'Nitrate': {
+        'valores': [0, 5, 10, 20, 40, 80, 160],
+        'posicion_columna': 4,
+        'nombre_completo': 'Nitrate (NO₃⁻) ppm'
+    }
+}
+
 class ExtractorProporcional:
     def __init__(self, 
                  tabla_rectificada_path: str = "tabla_rectificada.jpg",
-                 referencia_path: str = "referencia2.jpg"):
-        """Inicializar extractor proporcional."""
+                 referencia_path: str = "referencia2.jpg",
+                 filtrar_calidad: bool = True,
+                 parametros_config: Optional[Dict] = None):
+        """Inicializar extractor proporcional (parametros_config: columnas de otro kit, ver plantillas_kits)."""
         self.tabla_path = tabla_rectificada_path
         self.referencia_path = referencia_path
+        self.filtrar_calidad = filtrar_calidad
+        self.evaluador_calidad = EvaluadorCalidad()
         
-        # Configuración de parámetros
-        self.parametros_config = {
-            'pH': {
-                'valores': [6.0, 6.4, 6.6, 6.8, 7.0, 7.2, 7.6],
-                'posicion_columna': 0,
-                'nombre_completo': 'pH'
-            },
-            'High_Range_pH': {
-                'valores': [7.4, 7.8, 8.0, 8.2, 8.4, 8.8],
-                'posicion_columna': 1,
-                'nombre_completo': 'High Range pH'
-            },
-            'Ammonia': {
-                'valores': [0, 0.25, 0.50, 1.0, 2.0, 4.0, 8.0],
-                'posicion_columna': 2,
-                'nombre_completo': 'Ammonia (NH₃/NH₄⁺) ppm'
-            },
-            'Nitrite': {
-                'valores': [0, 0.25, 0.50, 1.0, 2.0, 5.0],
-                'posicion_columna': 3,
-                'nombre_completo': 'Nitrite (NO₂⁻) ppm'
-            },
-            'Nitrate': {
-                'valores': [0, 5, 10, 20, 40, 80, 160],
-                'posicion_columna': 4,
-                'nombre_completo': 'Nitrate (NO₃⁻) ppm'
-            }
-        }
+        # Configuración de parámetros (por defecto, la tabla del API Freshwater)
+        self.parametros_config = copy.deepcopy(parametros_config or PARAMETROS_API_FRESHWATER)
         
         # Parámetros de sampling
         self.puntos_por_rectangulo = 5
@@ -324,18 +336,20 @@ class ExtractorProporcional:
             x_min, x_max = min(x_positions), max(x_positions)
             ancho_total = x_max - x_min
             
-            columnas = {i: [] for i in range(5)}
+            # Una columna por parámetro
+            n_columnas = len(self.parametros_config)
+            columnas = {i: [] for i in range(n_columnas)}
             
             for rect in rectangulos:
                 x, y, w, h = rect
                 pos_relativa = (x - x_min) / ancho_total if ancho_total > 0 else 0
-                col_idx = min(4, int(pos_relativa * 5))
+                col_idx = min(n_columnas - 1, int(pos_relativa * n_columnas))
                 columnas[col_idx].append(rect)
             
             rectangulos_organizados = {}
             
             for i, (param, config) in enumerate(self.parametros_config.items()):
-                if i < 5 and i in columnas:
+                if i in columnas:
                     rects_columna = sorted(columnas[i], key=lambda r: r[1])
                     rectangulos_organizados[param] = rects_columna[:len(config['valores'])]
                 else:
@@ -437,83 +451,132 @@ class ExtractorProporcional:
             logger.error(f"Error extrayendo color con sampling: {e}")
             return None, 0.0
     
+    @etapa('extraccion_completa')
     def procesar_extraccion_completa(self, bbox_foto_manual: Tuple[int, int, int, int], 
                                     directorio_salida: str = ".") -> Dict:
         """Proceso completo de extracción proporcional con tabla seleccionada manualmente."""
-        resultado = {
-            'exito': False,
-            'mensaje': '',
-            'tabla_foto': None,
-            'tabla_referencia': None,
-            'colores_extraidos': [],
-            'estadisticas': {},
-            'archivos_generados': []
-        }
+        resultado = self._resultado_vacio()
         
         try:
             Path(directorio_salida).mkdir(exist_ok=True)
             
             # Cargar imágenes
-            img_tabla, img_ref = self.cargar_imagenes()
+            with etapa('imread'):
+                img_tabla, img_ref = self.cargar_imagenes()
             if img_tabla is None or img_ref is None:
                 resultado['mensaje'] = "No se pudieron cargar las imágenes"
                 return resultado
             
-            # Usar bbox manual
-            bbox_foto = bbox_foto_manual
-            resultado['tabla_foto'] = bbox_foto
-            logger.info(f"✅ Usando tabla seleccionada manualmente: {bbox_foto}")
-            
             # Detectar tabla en referencia
-            bbox_ref = self.detectar_tabla_en_referencia(img_ref)
+            with etapa('analisis_referencia'):
+                bbox_ref = self.detectar_tabla_en_referencia(img_ref)
             if bbox_ref is None:
                 resultado['mensaje'] = "No se pudo detectar la tabla en la referencia"
                 return resultado
             
-            resultado['tabla_referencia'] = bbox_ref
-            
             # Extraer rectángulos de referencia
-            rectangulos_ref = self.extraer_rectangulos_referencia(img_ref, bbox_ref)
+            with etapa('analisis_referencia'):
+                rectangulos_ref = self.extraer_rectangulos_referencia(img_ref, bbox_ref)
             if not rectangulos_ref:
                 resultado['mensaje'] = "No se pudieron extraer rectángulos de la referencia"
                 return resultado
             
+            resultado = self.extraer_colores(img_tabla, bbox_foto_manual, bbox_ref, rectangulos_ref)
+            if resultado['exito']:
+                with etapa('escritura_artefactos'):
+                    self.guardar_artefactos(resultado, directorio_salida)
+            
+            return resultado
+            
+        except Exception as e:
+            logger.error(f"Error en extracción completa: {e}")
+            resultado['mensaje'] = f"Error inesperado: {str(e)}"
+            return resultado
+    
+    @staticmethod
+    def _resultado_vacio() -> Dict:
+        """Resultado sin éxito con todos los campos vacíos."""
+        return {
+            'exito': False,
+            'mensaje': '',
+            'tabla_foto': None,
+            'tabla_referencia': None,
+            'colores_extraidos': [],
+            'estadisticas': {},
+            'archivos_generados': [],
+            'calidad': None,
+            'imagen_debug': None
+        }
+    
+    def extraer_colores(self, img_tabla: np.ndarray, bbox_foto: Tuple[int, int, int, int],
+                        bbox_ref: Tuple[int, int, int, int],
+                        rectangulos_ref: Dict[str, List[Tuple[int, int, int, int]]]) -> Dict:
+        """
+        Muestreo de colores con la referencia ya analizada, sin leer ni escribir archivos.
+        
+        Args:
+            img_tabla: Tabla rectificada en BGR
+            bbox_foto: Área de la tabla seleccionada en la foto
+            bbox_ref: Tabla detectada en la referencia (detectar_tabla_en_referencia)
+            rectangulos_ref: Rectángulos por parámetro (extraer_rectangulos_referencia)
+        
+        Returns:
+            Dict como procesar_extraccion_completa, con la imagen de debug en memoria
+        """
+        resultado = self._resultado_vacio()
+        
+        try:
+            resultado['tabla_foto'] = bbox_foto
+            resultado['tabla_referencia'] = bbox_ref
+            logger.info(f"✅ Usando tabla seleccionada manualmente: {bbox_foto}")
+            
+            # Filtro de calidad sobre el área seleccionada antes del muestreo
+            if self.filtrar_calidad:
+                with etapa('calidad'):
+                    calidad = self.evaluador_calidad.evaluar(img_tabla, bbox_foto)
+                resultado['calidad'] = calidad['metricas']
+                if not calidad['apta']:
+                    logger.warning(f"⚠️ Tabla rechazada por calidad: {calidad['mensaje']}")
+                    resultado['mensaje'] = calidad['mensaje']
+                    return resultado
+            
             logger.info(f"🎨 Iniciando extracción de colores con mapeo proporcional")
             
             # Extraer colores
             colores_extraidos = []
             
-            for parametro, rects_ref in rectangulos_ref.items():
-                config = self.parametros_config[parametro]
-                logger.info(f"   📋 Procesando {parametro}: {len(rects_ref)} rectángulos")
-                
-                for i, rect_ref in enumerate(rects_ref):
-                    if i >= len(config['valores']):
-                        break
-                    
-                    valor = config['valores'][i]
-                    
-                    rect_foto = self.mapear_coordenadas(bbox_foto, bbox_ref, rect_ref)
+            with etapa('muestreo_colores'):
+                for parametro, rects_ref in rectangulos_ref.items():
+                    config = self.parametros_config[parametro]
+                    logger.info(f"   📋 Procesando {parametro}: {len(rects_ref)} rectángulos")
                     
-                    color_info, confianza = self.extraer_color_con_sampling(img_tabla, rect_foto)
-                    
-                    if color_info is not None:
-                        color_obj = ColorInfo(
-                            parametro=parametro,
-                            valor=valor,
-                            posicion_foto=rect_foto,
-                            posicion_ref=rect_ref,
-                            color_bgr=color_info['bgr'],
-                            color_rgb=color_info['rgb'],
-                            color_lab=color_info['lab'],
-                            confianza=confianza,
-                            puntos_muestreados=color_info['puntos_muestreados']
-                        )
-                        colores_extraidos.append(color_obj)
+                    for i, rect_ref in enumerate(rects_ref):
+                        if i >= len(config['valores']):
+                            break
+                        
+                        valor = config['valores'][i]
+                        
+                        rect_foto = self.mapear_coordenadas(bbox_foto, bbox_ref, rect_ref)
                         
-                        logger.debug(f"     ✓ {valor}: RGB{color_info['rgb']} (conf: {confianza:.3f})")
-                    else:
-                        logger.warning(f"     ⚠️ Error extrayendo {parametro} = {valor}")
+                        color_info, confianza = self.extraer_color_con_sampling(img_tabla, rect_foto)
+                        
+                        if color_info is not None:
+                            color_obj = ColorInfo(
+                                parametro=parametro,
+                                valor=valor,
+                                posicion_foto=rect_foto,
+                                posicion_ref=rect_ref,
+                                color_bgr=color_info['bgr'],
+                                color_rgb=color_info['rgb'],
+                                color_lab=color_info['lab'],
+                                confianza=confianza,
+                                puntos_muestreados=color_info['puntos_muestreados']
+                            )
+                            colores_extraidos.append(color_obj)
+                            
+                            logger.debug(f"     ✓ {valor}: RGB{color_info['rgb']} (conf: {confianza:.3f})")
+                        else:
+                            logger.warning(f"     ⚠️ Error extrayendo {parametro} = {valor}")
             
             if not colores_extraidos:
                 resultado['mensaje'] = "No se pudieron extraer colores"
@@ -525,21 +588,7 @@ class ExtractorProporcional:
             stats = self._generar_estadisticas(colores_extraidos, bbox_foto, bbox_ref)
             resultado['estadisticas'] = stats
             
-            # Generar imagen de debug
-            debug_img = self._generar_imagen_debug(img_tabla, bbox_foto, colores_extraidos)
-            ruta_debug = os.path.join(directorio_salida, "extraccion_proporcional_debug.jpg")
-            cv2.imwrite(ruta_debug, debug_img)
-            resultado['archivos_generados'].append(ruta_debug)
-            
-            # Generar Excel simplificado
-            ruta_xlsx = os.path.join(directorio_salida, "colores_proporcional.xlsx")
-            self._generar_excel_simplificado(colores_extraidos, ruta_xlsx)
-            resultado['archivos_generados'].append(ruta_xlsx)
-            
-            # Guardar metadatos
-            ruta_meta = os.path.join(directorio_salida, "proporcional_metadatos.json")
-            self._guardar_metadatos(resultado, ruta_meta)
-            resultado['archivos_generados'].append(ruta_meta)
+            resultado['imagen_debug'] = self._generar_imagen_debug(img_tabla, bbox_foto, colores_extraidos)
             
             resultado['exito'] = True
             resultado['mensaje'] = f"Extracción completada: {len(colores_extraidos)} colores extraídos"
@@ -551,6 +600,25 @@ class ExtractorProporcional:
             resultado['mensaje'] = f"Error inesperado: {str(e)}"
             return resultado
     
+    def guardar_artefactos(self, resultado: Dict, directorio_salida: str = "."):
+        """Escribir imagen de debug, Excel simplificado y metadatos de una extracción."""
+        Path(directorio_salida).mkdir(exist_ok=True)
+        
+        # Generar imagen de debug
+        ruta_debug = os.path.join(directorio_salida, "extraccion_proporcional_debug.jpg")
+        cv2.imwrite(ruta_debug, resultado['imagen_debug'])
+        resultado['archivos_generados'].append(ruta_debug)
+        
+        # Generar Excel simplificado
+        ruta_xlsx = os.path.join(directorio_salida, "colores_proporcional.xlsx")
+        self._generar_excel_simplificado(resultado['colores_extraidos'], ruta_xlsx)
+        resultado['archivos_generados'].append(ruta_xlsx)
+        
+        # Guardar metadatos
+        ruta_meta = os.path.join(directorio_salida, "proporcional_metadatos.json")
+        self._guardar_metadatos(resultado, ruta_meta)
+        resultado['archivos_generados'].append(ruta_meta)
+    
     def _generar_estadisticas(self, colores: List[ColorInfo], bbox_foto: Tuple[int, int, int, int], 
                              bbox_ref: Tuple[int, int, int, int]) -> Dict:
         """Generar estadísticas detalladas."""
@@ -667,6 +735,7 @@ class ExtractorProporcional:
                     'radio_sampling': self.radio_sampling
                 },
                 'parametros_config': self.parametros_config,
+                'iluminacion': resultado.get('iluminacion'),
                 'archivos_fuente': {
                     'tabla': self.tabla_path,
                     'referencia': self.referencia_path
@@ -688,13 +757,12 @@ def main():
     print(f"📂 Directorio de trabajo: {os.getcwd()}")
     
     # Verificar archivos necesarios
-    archivos_necesarios = ["tabla_rectificada.jpg", "referencia2.jpg"]
+    archivos_necesarios = ["tabla_rectificada.jpg"]
     faltantes = [f for f in archivos_necesarios if not os.path.exists(f)]
     
     if faltantes:
         print(f"❌ Archivos faltantes: {', '.join(faltantes)}")
         print("   • tabla_rectificada.jpg: Ejecuta detectar_aruco_mejorado.py")
-        print("   • referencia2.jpg: Imagen de referencia en B&N")
         return
     
     # Cargar imagen rectificada
@@ -724,8 +792,28 @@ def main():
     print("\n🎨 PASO 2: Extracción de colores con mapeo proporcional")
     print("-" * 60)
     
-    extractor = ExtractorProporcional()
-    resultado = extractor.procesar_extraccion_completa(bbox_tabla)
+    # Mismo grafo de etapas que la API; los artefactos se escriben en el directorio actual
+    from pipeline import EtapaFallida
+    from pipeline_probetas import crear_pipeline
+    from iluminacion import normalizar_colores
+    from plantillas_kits import KIT_POR_DEFECTO
+    try:
+        ejecucion = crear_pipeline().ejecutar({
+            'tabla': img_tabla,
+            'bbox_tabla': bbox_tabla,
+            'kit': KIT_POR_DEFECTO
+        }, ['plantilla', 'extraccion', 'iluminacion_tabla'])
+        extractor = ExtractorProporcional(parametros_config=ejecucion['plantilla'].parametros_config())
+        resultado = ejecucion['extraccion']
+        iluminacion = ejecucion['iluminacion_tabla']
+        if iluminacion is not None:
+            # El Excel lleva los colores normalizados, como la calibración de la API
+            resultado['colores_extraidos'] = normalizar_colores(resultado['colores_extraidos'], iluminacion)
+            resultado['iluminacion'] = iluminacion.a_dict()
+            print(f"💡 Colores normalizados con los neutros de {iluminacion.marcadores} marcadores")
+        extractor.guardar_artefactos(resultado)
+    except EtapaFallida as e:
+        resultado = {'exito': False, 'mensaje': e.mensaje}
     
     # Mostrar resultados
     if resultado['exito']:
@@ -778,7 +866,7 @@ def main():
         
         print(f"\n💡 Posibles soluciones:")
         print(f"   1. Selecciona toda el área de la tabla incluyendo todos los colores")
-        print(f"   2. Verifica que referencia2.jpg sea correcta")
+        print(f"   2. Verifica que la plantilla del kit sea la de tu tabla (construir_plantillas.py)")
         print(f"   3. Asegúrate de que tabla_rectificada.jpg tenga buena calidad")
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+📊 Benchmark de las diferencias de color
+Colores por segundo comparados contra las referencias de un parámetro (7 colores) con
+el camino escalar (una llamada por par color-referencia, como el bucle anterior de
+clasificar_color) y con el vectorizado de diferencia_color.distancias (una llamada para
+todos los colores). Antes comprueba CIEDE2000 con los pares de Sharma, Wu y Dalal (2005).
+
+Uso:
+    python bench_diferencia_color.py --colores 100000
+"""
+
+import time
+import argparse
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from diferencia_color import METRICAS, ciede2000, delta_e76, delta_e94, distancias, rgb_a_lab
+
+# (Lab 1, Lab 2, ΔE00 esperado) de la tabla de Sharma et al.
+PARES_SHARMA = [
+    ((50.0, 2.6772, -79.7751), (50.0, 0.0, -82.7485), 2.0425),
+    ((50.0, 3.1571, -77.2803), (50.0, 0.0, -82.7485), 2.8615),
+    ((50.0, 2.8361, -74.0200), (50.0, 0.0, -82.7485), 3.4412),
+    ((50.0, -1.3802, -84.2814), (50.0, 0.0, -82.7485), 1.0000),
+    ((50.0, 0.0, 0.0), (50.0, -1.0, 2.0), 2.3669),
+    ((50.0, 2.49, -0.001), (50.0, -2.49, 0.0009), 7.1792),
+    ((50.0, 2.5, 0.0), (73.0, 25.0, -18.0), 27.1492),
+    ((50.0, 2.5, 0.0), (61.0, -5.0, 29.0), 22.8977),
+    ((50.0, 2.5, 0.0), (50.0, 3.1736, 0.5854), 1.0000),
+    ((60.2574, -34.0099, 36.2677), (60.4626, -34.1751, 39.4387), 1.2644),
+    ((63.0109, -31.0961, -5.8663), (62.8187, -29.7946, -4.0864), 1.2630),
+    ((2.0776, 0.0795, -1.1350), (0.9033, -0.0636, -0.5514), 0.9082)
+]
+
+
+def distancia_rgb_escalar(color1: Tuple[int, int, int], color2: Tuple[int, int, int]) -> float:
+    """Distancia euclídea RGB de un par, como la calculaba el bucle anterior de clasificar_color."""
+    r1, g1, b1 = color1
+    r2, g2, b2 = color2
+    return float(np.sqrt((r1-r2)**2 + (g1-g2)**2 + (b1-b2)**2))
+
+
+# Distancia de un par con la misma función que el camino vectorizado, pero de uno en uno
+DISTANCIA_ESCALAR: Dict[str, Callable] = {
+    'rgb': lambda rgb, ref_rgb, ref_lab: distancia_rgb_escalar(rgb, ref_rgb),
+    'de76': lambda rgb, ref_rgb, ref_lab: float(delta_e76(rgb_a_lab(rgb), ref_lab)),
+    'de94': lambda rgb, ref_rgb, ref_lab: float(delta_e94(ref_lab, rgb_a_lab(rgb))),
+    'ciede2000': lambda rgb, ref_rgb, ref_lab: float(ciede2000(ref_lab, rgb_a_lab(rgb)))
+}
+
+
+def comprobar_ciede2000() -> float:
+    """Error máximo frente a los valores publicados (falla si pasa de 1e-4)."""
+    lab1 = np.array([p[0] for p in PARES_SHARMA])
+    lab2 = np.array([p[1] for p in PARES_SHARMA])
+    esperado = np.array([p[2] for p in PARES_SHARMA])
+    error = max(np.abs(ciede2000(lab1, lab2) - esperado).max(), np.abs(ciede2000(lab2, lab1) - esperado).max())
+    if error > 1e-4:
+        raise AssertionError(f"CIEDE2000 se aleja de Sharma et al.: error máximo {error:.6f}")
+    return float(error)
+
+
+def medir_escalar(metrica: str, colores: np.ndarray, referencias: np.ndarray) -> float:
+    """Colores por segundo del camino escalar."""
+    referencias_lab = rgb_a_lab(referencias)
+    pares = [(tuple(r), l) for r, l in zip(referencias.tolist(), referencias_lab)]
+    distancia = DISTANCIA_ESCALAR[metrica]
+    inicio = time.perf_counter()
+    for color in colores.tolist():
+        for ref_rgb, ref_lab in pares:
+            distancia(color, ref_rgb, ref_lab)
+    return len(colores) / (time.perf_counter() - inicio)
+
+
+def medir_vectorizado(metrica: str, colores: np.ndarray, referencias: np.ndarray, repeticiones: int = 3) -> float:
+    """Colores por segundo del camino vectorizado (mejor de varias repeticiones)."""
+    referencias_lab = rgb_a_lab(referencias)
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        distancias(colores, referencias, referencias_lab, metrica)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return len(colores) / mejor
+
+
+def main():
+    """Función principal del benchmark."""
+    parser = argparse.ArgumentParser(description="Throughput de las diferencias de color")
+    parser.add_argument('--colores', type=int, default=100000, help='Colores del camino vectorizado')
+    parser.add_argument('--colores-escalar', type=int, default=5000, help='Colores del camino escalar')
+    parser.add_argument('--referencias', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"🎯 CIEDE2000 frente a Sharma et al. ({len(PARES_SHARMA)} pares): "
+          f"error máximo {comprobar_ciede2000():.2e}")
+
+    rng = np.random.default_rng(0)
+    referencias = rng.integers(0, 256, (args.referencias, 3)).astype(np.uint8)
+    colores = rng.integers(0, 256, (args.colores, 3)).astype(np.uint8)
+
+    # Las dos rutas deben dar las mismas distancias
+    muestra = colores[:200]
+    referencias_lab = rgb_a_lab(referencias)
+    for metrica in METRICAS:
+        escalar = np.array([[DISTANCIA_ESCALAR[metrica](tuple(c), tuple(r), l)
+                             for r, l in zip(referencias.tolist(), referencias_lab)] for c in muestra.tolist()])
+        if not np.allclose(escalar, distancias(muestra, referencias, referencias_lab, metrica)):
+            raise AssertionError(f"El camino vectorizado de {metrica} no coincide con el escalar")
+
+    print(f"\n📊 {args.referencias} referencias; escalar con {args.colores_escalar} colores, "
+          f"vectorizado con {args.colores}")
+    print(f"{'métrica':<10} {'escalar (col/s)':>16} {'vectorizado (col/s)':>20} {'aceleración':>12}")
+    for metrica in METRICAS:
+        escalar = medir_escalar(metrica, colores[:args.colores_escalar], referencias)
+        vectorizado = medir_vectorizado(metrica, colores, referencias)
+        print(f"{metrica:<10} {escalar:>16,.0f} {vectorizado:>20,.0f} {'x' + format(vectorizado / escalar, '.0f'):>12}")
+
+
+if __name__ == "__main__":
+    main()
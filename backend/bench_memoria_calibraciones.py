@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+📊 Benchmark de memoria de calibraciones activas
+Compara la representación anterior (lista de ColorInfo + dict de estadísticas) con
+CalibracionCompacta simulando N sesiones con 33 colores de referencia cada una.
+
+Uso:
+    python bench_memoria_calibraciones.py --sesiones 10000
+"""
+
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from b3_extractor import ColorInfo, PARAMETROS_API_FRESHWATER
+from calibracion_compacta import CalibracionCompacta
+
+# Parámetros y valores de la tabla de referencia (33 colores)
+TABLA_REFERENCIA = {parametro: [float(v) for v in config['valores']]
+                    for parametro, config in PARAMETROS_API_FRESHWATER.items()}
+
+
+def colores_sesion(rng: random.Random) -> List[ColorInfo]:
+    """Lista de ColorInfo como la que devuelve ExtractorProporcional."""
+    colores = []
+    for parametro, valores in TABLA_REFERENCIA.items():
+        for valor in valores:
+            r, g, b = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+            x, y = rng.randrange(800), rng.randrange(533)
+            colores.append(ColorInfo(
+                parametro=parametro,
+                valor=valor,
+                posicion_foto=(x, y, 20, 20),
+                posicion_ref=(x, y, 20, 20),
+                color_bgr=(b, g, r),
+                color_rgb=(r, g, b),
+                color_lab=(rng.uniform(0, 100), rng.uniform(-128, 127), rng.uniform(-128, 127)),
+                confianza=rng.uniform(0.5, 1.0),
+                puntos_muestreados=9
+            ))
+    return colores
+
+
+def estadisticas_sesion(colores: List[ColorInfo]) -> Dict:
+    """Dict de estadísticas con la forma de ExtractorProporcional._generar_estadisticas."""
+    confianzas = [c.confianza for c in colores]
+    stats = {
+        'mapeo': {
+            'tabla_foto': (20, 20, 760, 493),
+            'tabla_referencia': (0, 0, 760, 493),
+            'escala_x': 1.0,
+            'escala_y': 1.0
+        },
+        'colores': {
+            'total_extraidos': len(colores),
+            'total_esperados': len(colores),
+            'porcentaje_exito': 100.0,
+            'confianza_promedio': np.mean(confianzas),
+            'confianza_minima': np.min(confianzas),
+            'confianza_maxima': np.max(confianzas),
+            'puntos_promedio': np.mean([c.puntos_muestreados for c in colores])
+        },
+        'por_parametro': {}
+    }
+    for parametro, valores in TABLA_REFERENCIA.items():
+        colores_param = [c for c in colores if c.parametro == parametro]
+        stats['por_parametro'][parametro] = {
+            'esperados': len(valores),
+            'detectados': len(colores_param),
+            'porcentaje_exito': 100.0,
+            'confianza_promedio': np.mean([c.confianza for c in colores_param]),
+            'valores_detectados': sorted(c.valor for c in colores_param)
+        }
+    return stats
+
+
+def medir(nombre: str, sesiones: int, construir: Callable[[random.Random], Dict]) -> int:
+    """Bytes retenidos por `sesiones` calibraciones construidas con `construir`."""
+    rng = random.Random(0)
+    gc.collect()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    calibraciones = {f'usuario_{i}': construir(rng) for i in range(sesiones)}
+    segundos = time.perf_counter() - inicio
+    gc.collect()
+    retenidos, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"   • {nombre:<10} {retenidos / 2**20:8.1f} MiB  "
+          f"({retenidos / sesiones:7.0f} B/sesión, construcción {segundos:.2f} s)")
+    del calibraciones
+    return retenidos
+
+
+def main():
+    """Función principal del benchmark."""
+    parser = argparse.ArgumentParser(description="Memoria de calibraciones activas")
+    parser.add_argument('--sesiones', type=int, default=10000)
+    args = parser.parse_args()
+
+    # Las listas de ColorInfo se generan antes de medir para no contar basura temporal
+    rng = random.Random(0)
+    plantillas = [colores_sesion(rng) for _ in range(min(args.sesiones, 256))]
+
+    def anterior(r: random.Random) -> Dict:
+        colores = colores_sesion(r)
+        return {'colores': colores, 'estadisticas': estadisticas_sesion(colores)}
+
+    def compacta(r: random.Random) -> Dict:
+        return {'calibracion': CalibracionCompacta.desde_colores(plantillas[r.randrange(len(plantillas))])}
+
+    print(f"📊 {args.sesiones} sesiones con {len(plantillas[0])} colores cada una")
+    bytes_anterior = medir('anterior', args.sesiones, anterior)
+    bytes_compacta = medir('compacta', args.sesiones, compacta)
+    print(f"\n✅ Reducción: x{bytes_anterior / max(bytes_compacta, 1):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+⏱️ Benchmark por etapas del pipeline sobre escenas sintéticas
+Genera fotos de la tabla con los 4 marcadores a varias resoluciones (escenas_sinteticas),
+mide cada etapa de TablaAPIDetector, ExtractorProporcional y de los handlers de main.py
+(cliente de pruebas de Flask, flujo completo de 4 llamadas) y guarda un JSON comparable
+con una línea base.
+
+Uso:
+    python bench_pipeline.py --megapixeles 2 12 48 --salida bench.json
+    python bench_pipeline.py --linea-base bench_base.json            # compara, sale con 1 si hay regresiones
+    python bench_pipeline.py --linea-base bench_base.json --actualizar-linea-base
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import argparse
+import logging
+import platform
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import cv2
+import numpy as np
+
+# Sin caché ni deduplicación: cada repetición debe recalcular
+os.environ.setdefault('CACHE_RESULTADOS_MB', '0')
+os.environ.setdefault('IDEMPOTENCIA_TTL_S', '0')
+
+import metricas
+from a2_detectar_aruco import TablaAPIDetector
+from b3_extractor import ExtractorProporcional
+from escenas_sinteticas import generar_escena_tabla, codificar_jpeg
+
+USUARIO_BENCH = 'bench'
+
+
+class ColectorEtapas:
+    """Oyente de metricas.etapa(): acumula la duración de cada etapa durante una medición."""
+
+    def __init__(self):
+        self.activo = False
+        self.tiempos: Dict[str, float] = defaultdict(float)
+
+    def __call__(self, nombre: str, inicio: float, duracion: float):
+        if self.activo:
+            self.tiempos[nombre] += duracion
+
+    def medir(self, funcion: Callable):
+        """Ejecutar funcion y devolver (resultado, total_ms, etapas_ms)."""
+        self.tiempos = defaultdict(float)
+        self.activo = True
+        inicio = time.perf_counter()
+        try:
+            resultado = funcion()
+        finally:
+            total = time.perf_counter() - inicio
+            self.activo = False
+        return resultado, total * 1000, {k: v * 1000 for k, v in self.tiempos.items()}
+
+
+def resumir(mediciones: List[tuple]) -> Dict:
+    """Mediana y mínimo del total y mediana por etapa de varias repeticiones."""
+    totales = [m[0] for m in mediciones]
+    etapas = sorted({e for m in mediciones for e in m[1]})
+    return {
+        'total_ms': {'mediana': round(float(np.median(totales)), 2), 'min': round(float(np.min(totales)), 2)},
+        'etapas_ms': {e: round(float(np.median([m[1].get(e, 0.0) for m in mediciones])), 2) for e in etapas}
+    }
+
+
+def data_url(jpeg: bytes) -> str:
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+
+
+def medir_resolucion(megapixeles: float, repeticiones: int, rng: np.random.Generator,
+                     colector: ColectorEtapas, cliente, directorio: str) -> Dict:
+    """Medir detector, extractor y endpoints sobre una escena de la resolución dada."""
+    escena = generar_escena_tabla(megapixeles, rng)
+    jpeg = codificar_jpeg(escena.imagen)
+    alto, ancho = escena.imagen.shape[:2]
+    print(f"\n📐 {megapixeles} MP ({ancho}x{alto}, JPEG {len(jpeg) / 1e6:.1f} MB)")
+
+    ruta_foto = os.path.join(directorio, f'escena_{megapixeles}mp.jpg')
+    with open(ruta_foto, 'wb') as f:
+        f.write(jpeg)
+    bbox_tabla = list(escena.a_rectificada(escena.bbox_tabla, 800, 533))
+    resultado = {'escena': {'ancho': ancho, 'alto': alto, 'bytes_jpeg': len(jpeg)}}
+
+    # Detector directo
+    detector = TablaAPIDetector(target_width=800, target_height=533)
+    mediciones = []
+    rectificada = None
+    for _ in range(repeticiones):
+        r, total, etapas = colector.medir(lambda: detector.procesar_imagen(ruta_foto))
+        if not r['exito']:
+            raise RuntimeError(f"Detección fallida a {megapixeles} MP: {r['mensaje']}")
+        rectificada = r['imagen_rectificada']
+        mediciones.append((total, etapas))
+    resultado['detector'] = resumir(mediciones)
+
+    # Extractor directo sobre la tabla rectificada
+    ruta_rect = os.path.join(directorio, 'tabla_rectificada.jpg')
+    cv2.imwrite(ruta_rect, rectificada)
+    extractor = ExtractorProporcional(tabla_rectificada_path=ruta_rect, referencia_path='referencia2.jpg')
+    mediciones = []
+    for _ in range(repeticiones):
+        r, total, etapas = colector.medir(lambda: extractor.procesar_extraccion_completa(tuple(bbox_tabla), directorio))
+        if not r['exito']:
+            raise RuntimeError(f"Extracción fallida a {megapixeles} MP: {r['mensaje']}")
+        mediciones.append((total, etapas))
+    resultado['extractor'] = resumir(mediciones)
+
+    # Handlers: flujo completo de 4 llamadas
+    imagen = data_url(jpeg)
+    primer_ph = next(p for p in escena.parches if p['parametro'] == 'pH')
+    x, y, w, h = escena.a_rectificada(primer_ph['rect'], 800, 513)
+    area = [x + w // 4, y + h // 4, max(5, w // 2), max(5, h // 2)]
+    por_endpoint = defaultdict(list)
+    for _ in range(repeticiones):
+        llamadas = [
+            ('detectar_aruco', lambda: {'imagen': imagen}),
+            ('extraer_colores', lambda: {'imagen_rectificada': respuestas['detectar_aruco']['imagen_rectificada'],
+                                         'bbox_tabla': bbox_tabla}),
+            ('rectificar_probeta', lambda: {'imagen_probeta': imagen}),
+            ('analizar_probeta', lambda: {'imagen_probeta': respuestas['rectificar_probeta']['imagen_rectificada'],
+                                          'tipo_test': 'ph', 'area_seleccionada': area})
+        ]
+        respuestas = {}
+        for endpoint, cuerpo in llamadas:
+            payload = {'user_code': USUARIO_BENCH, **cuerpo()}
+            r, total, etapas = colector.medir(lambda: cliente.post(f'/{endpoint}', json=payload))
+            datos = r.get_json()
+            if r.status_code != 200 or not datos.get('exito'):
+                raise RuntimeError(f"{endpoint} falló a {megapixeles} MP: {datos.get('mensaje')}")
+            respuestas[endpoint] = datos
+            por_endpoint[endpoint].append((total, etapas))
+    resultado['endpoints'] = {e: resumir(m) for e, m in por_endpoint.items()}
+
+    for bloque in ('detector', 'extractor'):
+        print(f"   • {bloque:<20} {resultado[bloque]['total_ms']['mediana']:9.1f} ms")
+    for endpoint, resumen in resultado['endpoints'].items():
+        print(f"   • /{endpoint:<19} {resumen['total_ms']['mediana']:9.1f} ms")
+    return resultado
+
+
+def aplanar(resultados: Dict) -> Dict[str, float]:
+    """Medianas indexadas por ruta 'resolución/bloque/[endpoint/]total|etapa'."""
+    planos = {}
+    for resolucion, bloques in resultados.items():
+        for bloque, contenido in bloques.items():
+            if bloque == 'escena':
+                continue
+            grupos = contenido.items() if bloque == 'endpoints' else [(None, contenido)]
+            for nombre, resumen in grupos:
+                prefijo = f"{resolucion}/{bloque}" + (f"/{nombre}" if nombre else '')
+                planos[f"{prefijo}/total"] = resumen['total_ms']['mediana']
+                for etapa, ms in resumen['etapas_ms'].items():
+                    planos[f"{prefijo}/{etapa}"] = ms
+    return planos
+
+
+def comparar(actual: Dict, base: Dict, tolerancia: float, minimo_ms: float = 2.0) -> List[Dict]:
+    """Tiempos que empeoran más de la tolerancia respecto a la línea base."""
+    planos_actual = aplanar(actual['resultados'])
+    planos_base = aplanar(base['resultados'])
+    regresiones = []
+    for clave, ms in sorted(planos_actual.items()):
+        ms_base = planos_base.get(clave)
+        if ms_base is None or max(ms, ms_base) < minimo_ms:
+            continue
+        ratio = ms / ms_base if ms_base > 0 else float('inf')
+        if ratio > 1 + tolerancia:
+            regresiones.append({'clave': clave, 'base_ms': ms_base, 'actual_ms': ms, 'ratio': round(ratio, 3)})
+    return regresiones
+
+
+def main():
+    """Función principal del benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark por etapas sobre escenas sintéticas")
+    parser.add_argument('--megapixeles', type=float, nargs='+', default=[2, 12, 48])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', default='bench_resultados.json', help="JSON con los resultados")
+    parser.add_argument('--linea-base', default=None, help="JSON de referencia con el que comparar")
+    parser.add_argument('--actualizar-linea-base', action='store_true', help="Sobrescribir la línea base con esta ejecución")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="Empeoramiento relativo admitido (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Los logs INFO por petición distorsionan los tiempos
+    logging.disable(logging.INFO)
+    import main as api
+
+    colector = ColectorEtapas()
+    metricas.registrar_oyente(colector)
+    cliente = api.app.test_client()
+    rng = np.random.default_rng(args.semilla)
+
+    directorio = tempfile.mkdtemp(prefix='bench_probetas_')
+    try:
+        resultados = {}
+        for mp in args.megapixeles:
+            resultados[f"{mp:g}MP"] = medir_resolucion(mp, args.repeticiones, rng, colector, cliente, directorio)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    informe = {
+        'version': 1,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'procesador': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'repeticiones': args.repeticiones,
+        'semilla': args.semilla,
+        'resultados': resultados
+    }
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados guardados en {args.salida}")
+
+    if not args.linea_base:
+        return
+    if args.actualizar_linea_base or not os.path.exists(args.linea_base):
+        shutil.copyfile(args.salida, args.linea_base)
+        print(f"📌 Línea base guardada en {args.linea_base}")
+        return
+
+    with open(args.linea_base, encoding='utf-8') as f:
+        base = json.load(f)
+    regresiones = comparar(informe, base, args.tolerancia)
+    if not regresiones:
+        print(f"✅ Sin regresiones frente a {args.linea_base} (tolerancia {args.tolerancia:.0%})")
+        return
+    print(f"❌ {len(regresiones)} regresiones frente a {args.linea_base}:")
+    for r in regresiones:
+        print(f"   • {r['clave']}: {r['base_ms']:.1f} → {r['actual_ms']:.1f} ms (x{r['ratio']:.2f})")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
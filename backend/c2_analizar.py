@@ -24,6 +24,11 @@ except ImportError:
     print("❌ No se puede importar a2_detectar_aruco.py")
     sys.exit(1)
 
+# Módulos propios del backend: si fallan se ve su ImportError, no el aviso de a2_detectar_aruco
+from diferencia_color import ESCALAS, distancias
+from iluminacion import EstimadorIluminacion, Iluminacion
+from pipeline_probetas import crear_pipeline
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -46,11 +51,14 @@ class ResultadoProbetaManual:
 class CalibradorManual:
     """Calibrador usando datos reales de calibración con interpolación."""
     
-    def __init__(self):
+    def __init__(self, metrica: str = 'rgb'):
+        self.metrica = metrica  # 'rgb', 'de76', 'de94' o 'ciede2000' (diferencia_color)
         # Se cargarán desde el Excel
         self.valores_por_tipo = {}
         self.colores_extraidos = {}  # Mantener para compatibilidad
         self.factores_correccion = {'r': 1.0, 'g': 1.0, 'b': 1.0}
+        self.negro_correccion = {'r': 0.0, 'g': 0.0, 'b': 0.0}
+        self.iluminacion_tabla = None  # Neutros de la tabla si el Excel está normalizado
         self.calibrado = False
         
     def cargar_datos_calibracion(self) -> bool:
@@ -108,9 +116,17 @@ class CalibradorManual:
                 if valores:
                     logger.info(f"  {tipo.upper()}: {len(valores)} valores cargados")
             
-            # Como ahora usamos los valores RGB reales de la foto,
-            # no necesitamos factores de corrección (ya están "corregidos")
+            # Sin neutros en los metadatos el Excel lleva los RGB de la foto tal cual
+            # y no se aplica corrección; con neutros se ajusta con ajustar_iluminacion()
             self.factores_correccion = {'r': 1.0, 'g': 1.0, 'b': 1.0}
+            self.negro_correccion = {'r': 0.0, 'g': 0.0, 'b': 0.0}
+            self.iluminacion_tabla = None
+            if os.path.exists("proporcional_metadatos.json"):
+                with open("proporcional_metadatos.json", encoding='utf-8') as f:
+                    iluminacion = json.load(f).get('iluminacion')
+                if iluminacion:
+                    self.iluminacion_tabla = Iluminacion.desde_dict(iluminacion)
+                    logger.info("💡 Colores de calibración normalizados por iluminación")
             
             self.calibrado = True
             logger.info(f"✅ Calibración cargada desde Excel: {sum(len(v) for v in self.valores_por_tipo.values())} colores")
@@ -120,12 +136,25 @@ class CalibradorManual:
             logger.error(f"Error cargando calibración desde Excel: {e}")
             return False
     
-    def _calcular_factores_correccion(self):
-        """Como usamos valores RGB directos del Excel, no necesitamos corrección adicional."""
-        # Los valores del Excel ya incluyen las características de tu cámara e iluminación
-        # Por tanto, no aplicamos corrección adicional
-        self.factores_correccion = {'r': 1.0, 'g': 1.0, 'b': 1.0}
-        logger.info("🔧 Usando valores RGB directos del Excel (sin corrección adicional)")
+    def ajustar_iluminacion(self, iluminacion_probeta: Optional[Iluminacion]):
+        """Factores para llevar el color de la probeta a la escala normalizada del Excel."""
+        if self.iluminacion_tabla is None:
+            # Los valores del Excel ya incluyen las características de tu cámara e iluminación
+            self.factores_correccion = {'r': 1.0, 'g': 1.0, 'b': 1.0}
+            self.negro_correccion = {'r': 0.0, 'g': 0.0, 'b': 0.0}
+            logger.info("🔧 Usando valores RGB directos del Excel (sin corrección adicional)")
+            return
+        # Sin neutros en la foto de la probeta se supone la misma luz que en la tabla
+        neutros = iluminacion_probeta or self.iluminacion_tabla
+        canales = ('r', 'g', 'b')
+        self.negro_correccion = {c: float(n) for c, n in zip(canales, neutros.negro)}
+        self.factores_correccion = {c: 255.0 / (float(b) - float(n))
+                                    for c, b, n in zip(canales, neutros.blanco, neutros.negro)}
+        if iluminacion_probeta is not None:
+            deriva = self.iluminacion_tabla.deriva(iluminacion_probeta)
+            logger.info(f"💡 Neutros de la probeta (deriva respecto a la tabla: {deriva})")
+        else:
+            logger.warning("💡 Sin neutros en la probeta: se usan los de la tabla")
     
     def corregir_color(self, color_rgb: Tuple[int, int, int]) -> Tuple[int, int, int]:
         """Aplicar corrección de color."""
@@ -133,17 +162,15 @@ class CalibradorManual:
             return color_rgb
         
         r, g, b = color_rgb
-        r_corr = np.clip(int(r * self.factores_correccion['r']), 0, 255)
-        g_corr = np.clip(int(g * self.factores_correccion['g']), 0, 255)
-        b_corr = np.clip(int(b * self.factores_correccion['b']), 0, 255)
+        r_corr = np.clip(int(round((r - self.negro_correccion['r']) * self.factores_correccion['r'])), 0, 255)
+        g_corr = np.clip(int(round((g - self.negro_correccion['g']) * self.factores_correccion['g'])), 0, 255)
+        b_corr = np.clip(int(round((b - self.negro_correccion['b']) * self.factores_correccion['b'])), 0, 255)
         
         return (r_corr, g_corr, b_corr)
     
     def calcular_distancia_color(self, color1: Tuple[int, int, int], color2: Tuple[int, int, int]) -> float:
-        """Calcular distancia euclidiana entre colores."""
-        r1, g1, b1 = color1
-        r2, g2, b2 = color2
-        return np.sqrt((r1-r2)**2 + (g1-g2)**2 + (b1-b2)**2)
+        """Calcular distancia entre dos colores con la métrica del calibrador."""
+        return float(distancias(color1, np.array([color2]), metrica=self.metrica)[0])
     
     def encontrar_valores_cercanos(self, color_corregido: Tuple[int, int, int], 
                                  tipo_test: str) -> List[Tuple[str, float, Tuple[int, int, int], float]]:
@@ -152,16 +179,17 @@ class CalibradorManual:
             return []
         
         valores_tipo = self.valores_por_tipo[tipo_test]
-        distancias = []
+        if not valores_tipo:
+            return []
         
-        for valor, color_ref in valores_tipo.items():
-            distancia = self.calcular_distancia_color(color_corregido, color_ref)
-            param_name = f"{tipo_test} {valor}"
-            distancias.append((param_name, valor, color_ref, distancia))
+        # Distancias a todas las referencias del tipo en una sola operación
+        distancias_ref = distancias(color_corregido, np.array(list(valores_tipo.values())), metrica=self.metrica)
+        cercanos = [(f"{tipo_test} {valor}", valor, color_ref, float(distancia))
+                    for (valor, color_ref), distancia in zip(valores_tipo.items(), distancias_ref)]
         
         # Ordenar por distancia
-        distancias.sort(key=lambda x: x[3])
-        return distancias
+        cercanos.sort(key=lambda x: x[3])
+        return cercanos
     
     def interpolar_valor(self, color_corregido: Tuple[int, int, int], 
                         valores_cercanos: List[Tuple[str, float, Tuple[int, int, int], float]]) -> Tuple[float, bool]:
@@ -173,8 +201,8 @@ class CalibradorManual:
         param1, valor1, color1, dist1 = valores_cercanos[0]
         param2, valor2, color2, dist2 = valores_cercanos[1]
         
-        # Si el más cercano está muy cerca, usar directamente
-        if dist1 < 10:  # Threshold de proximidad
+        # Si el más cercano está muy cerca, usar directamente (umbral según la métrica)
+        if dist1 < ESCALAS[self.metrica][0]:
             return valor1, False
         
         # Interpolación lineal basada en distancias
@@ -385,7 +413,9 @@ def main():
     # 1. Detección ArUco y rectificación
     print("\n🔍 Paso 1: Rectificando imagen...")
     detector_aruco = TablaAPIDetector(target_width=800, target_height=533)
-    resultado_aruco = detector_aruco.procesar_imagen(imagen_probeta)
+    pipeline = crear_pipeline(crear_detector=lambda tamano: detector_aruco)
+    resultado_aruco = pipeline.ejecutar({'foto': cv2.imread(imagen_probeta), 'tamano': (800, 533), 'rig_previo': None},
+                                        ['deteccion'])['deteccion']
     
     if not resultado_aruco['exito']:
         print(f"❌ Error ArUco: {resultado_aruco['mensaje']}")
@@ -417,6 +447,7 @@ def main():
         print("❌ Error cargando calibración")
         return
     
+    calibrador.ajustar_iluminacion(EstimadorIluminacion().estimar(img_rectificada, 'probeta'))
     print("✅ Calibración cargada correctamente")
     
     # 3. Solicitar tipo de test
@@ -457,7 +488,7 @@ def main():
     
     # Calcular confianza basada en distancia al más cercano
     distancia_minima = valores_cercanos[0][3]
-    confianza = max(0.1, min(1.0, 1 - (distancia_minima / 100)))
+    confianza = max(0.1, min(1.0, 1 - (distancia_minima / ESCALAS[calibrador.metrica][1])))
     
     # Crear resultado
     x1, y1, x2, y2 = area_seleccionada
@@ -514,7 +545,7 @@ def main():
             {'parametro': v[0], 'valor': v[1], 'color_rgb': v[2], 'distancia': v[3]}
             for v in valores_cercanos[:3]
         ],
-        'calibracion': calibrador.factores_correccion
+        'calibracion': {'factores': calibrador.factores_correccion, 'negro': calibrador.negro_correccion}
     }
     
     json_path = f"resultado_manual_{tipo_test}.json"
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+🗃️ Caché de resultados direccionada por contenido
+Los móviles reenvían la misma foto cuando una petición expira y los usuarios pulsan
+"procesar" dos veces: la clave es la huella que da el pipeline a cada etapa (contenido de
+sus entradas encadenado con las etapas previas), de modo que una repetición se sirve sin
+decodificar, detectar ni rectificar.
+VuelosUnicos cubre además los duplicados concurrentes: esperan al cálculo en curso.
+"""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def estimar_bytes(valor: Any) -> int:
+    """Tamaño aproximado de un resultado: cadenas (imágenes base64) y arrays dominan."""
+    if isinstance(valor, (str, bytes)):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(estimar_bytes(v) for v in valor.values()) + 64 * len(valor)
+    if isinstance(valor, (list, tuple)):
+        return sum(estimar_bytes(v) for v in valor) + 8 * len(valor)
+    if hasattr(valor, 'nbytes'):
+        return int(valor.nbytes() if callable(valor.nbytes) else valor.nbytes)
+    return 32
+
+
+class CacheResultados:
+    """LRU acotada por número de entradas y por memoria aproximada, segura entre hilos."""
+
+    def __init__(self, max_bytes: int = 64 * 2**20, max_entradas: int = 256):
+        """
+        Inicializar caché.
+
+        Args:
+            max_bytes: Memoria máxima aproximada de los resultados guardados
+            max_entradas: Número máximo de entradas
+        """
+        self.max_bytes = max_bytes
+        self.max_entradas = max_entradas
+        self.entradas: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Resultado guardado para la clave (None si no está) y cuenta acierto/fallo."""
+        with self._lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave: str, valor: Any):
+        """Guardar un resultado expulsando los menos usados hasta caber en los límites."""
+        tamano = estimar_bytes(valor)
+        if tamano > self.max_bytes:
+            logger.info(f"🗃️ Resultado de {tamano / 2**20:.1f} MiB no cacheado (límite {self.max_bytes / 2**20:.0f} MiB)")
+            return
+        with self._lock:
+            anterior = self.entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes_usados -= anterior[1]
+            self.entradas[clave] = (valor, tamano)
+            self.bytes_usados += tamano
+            while self.bytes_usados > self.max_bytes or len(self.entradas) > self.max_entradas:
+                _, (_, tamano_expulsado) = self.entradas.popitem(last=False)
+                self.bytes_usados -= tamano_expulsado
+                self.expulsiones += 1
+
+    def estadisticas(self) -> Dict:
+        """Contadores de aciertos/fallos y ocupación."""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'expulsiones': self.expulsiones,
+                'entradas': len(self.entradas),
+                'bytes': self.bytes_usados,
+                'max_bytes': self.max_bytes
+            }
+
+
+class _Vuelo:
+    """Cálculo en curso compartido por las peticiones duplicadas."""
+
+    __slots__ = ('evento', 'resultado')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+
+
+class VuelosUnicos:
+    """
+    Deduplicación single-flight: la primera petición con una clave calcula y las
+    concurrentes con la misma clave esperan y comparten su resultado. El resultado se
+    conserva ttl_s segundos para los reintentos que llegan justo después, dentro de un
+    límite de memoria aparte del de CacheResultados (las respuestas llevan imágenes base64).
+    """
+
+    def __init__(self, ttl_s: float = 30.0, max_completados: int = 64, max_bytes: int = 16 * 2**20):
+        """
+        Inicializar deduplicador.
+
+        Args:
+            ttl_s: Segundos que se conserva un resultado ya calculado
+            max_completados: Máximo de resultados conservados
+            max_bytes: Memoria máxima aproximada de los resultados conservados
+        """
+        self.ttl_s = ttl_s
+        self.max_completados = max_completados
+        self.max_bytes = max_bytes
+        self.en_curso: Dict[str, _Vuelo] = {}
+        self.completados: 'OrderedDict[str, Tuple[Any, float, int]]' = OrderedDict()
+        self.bytes_usados = 0
+        self.ejecutados = 0
+        self.compartidos = 0
+        self.repetidos = 0
+        self._lock = threading.Lock()
+
+    def _purgar(self, ahora: float):
+        while self.completados:
+            clave, (_, expira, _) = next(iter(self.completados.items()))
+            if expira > ahora and len(self.completados) <= self.max_completados \
+                    and self.bytes_usados <= self.max_bytes:
+                break
+            self.bytes_usados -= self.completados.pop(clave)[2]
+
+    def ejecutar(self, clave: str, funcion: Callable[[], Any],
+                 conservar: Callable[[Any], bool] = lambda r: True) -> Tuple[Any, str]:
+        """
+        Ejecutar funcion una sola vez por clave.
+
+        Args:
+            clave: Clave de idempotencia o huella de la petición
+            funcion: Cálculo a ejecutar (sin argumentos)
+            conservar: Si devuelve False el resultado no se guarda para reintentos posteriores
+
+        Returns:
+            (resultado, origen) con origen 'calculado', 'compartido' o 'repetido'
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar(ahora)
+            completado = self.completados.get(clave)
+            if completado is not None:
+                self.repetidos += 1
+                return completado[0], 'repetido'
+            vuelo = self.en_curso.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = _Vuelo()
+                self.en_curso[clave] = vuelo
+
+        if not lider:
+            vuelo.evento.wait()
+            if vuelo.resultado is not None:
+                with self._lock:
+                    self.compartidos += 1
+                return vuelo.resultado, 'compartido'
+            # El cálculo original falló sin resultado: calcular de nuevo
+            return funcion(), 'calculado'
+
+        try:
+            vuelo.resultado = funcion()
+            return vuelo.resultado, 'calculado'
+        finally:
+            with self._lock:
+                self.ejecutados += 1
+                del self.en_curso[clave]
+                if vuelo.resultado is not None and conservar(vuelo.resultado):
+                    tamano = estimar_bytes(vuelo.resultado)
+                    # Un resultado que no cabe solo no desplaza a los demás
+                    if tamano <= self.max_bytes:
+                        anterior = self.completados.pop(clave, None)
+                        if anterior is not None:
+                            self.bytes_usados -= anterior[2]
+                        self.completados[clave] = (vuelo.resultado, time.monotonic() + self.ttl_s, tamano)
+                        self.bytes_usados += tamano
+                        self._purgar(time.monotonic())
+            vuelo.evento.set()
+
+    def estadisticas(self) -> Dict:
+        """Contadores de ejecuciones y duplicados evitados."""
+        with self._lock:
+            return {
+                'ejecutados': self.ejecutados,
+                'compartidos': self.compartidos,
+                'repetidos': self.repetidos,
+                'en_curso': len(self.en_curso),
+                'conservados': len(self.completados),
+                'bytes': self.bytes_usados,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+🗜️ Representación compacta de una calibración activa
+Un único array estructurado de NumPy agrupado por parámetro (en el orden de la tabla) y
+ordenado por valor, con un índice por tipo de test (parámetro -> slice) construido una
+sola vez al calibrar. Si la foto de
+la tabla tenía neutros legibles, los colores están normalizados y la calibración guarda
+esos neutros (iluminacion).
+"""
+
+import json
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from b3_extractor import ColorInfo
+from diferencia_color import rgb_a_lab
+from iluminacion import Iluminacion, normalizar_colores
+
+# Una fila por color de referencia
+DTYPE_CALIBRACION = np.dtype([
+    ('valor', np.float64),
+    ('rgb', np.uint8, (3,)),
+    ('lab', np.float32, (3,)),
+    ('confianza', np.float32)
+])
+
+
+class CalibracionCompacta:
+    """Colores de referencia de una calibración, agrupados por parámetro."""
+
+    __slots__ = ('datos', 'indice', 'iluminacion')
+
+    def __init__(self, datos: np.ndarray, indice: Dict[str, slice], iluminacion: Optional[Iluminacion] = None):
+        """
+        Args:
+            datos: Array estructurado DTYPE_CALIBRACION agrupado por parámetro (orden de extracción) y
+                ordenado por valor
+            indice: Parámetro -> slice de sus filas en datos
+            iluminacion: Neutros de la foto de la tabla si los colores están normalizados
+        """
+        self.datos = datos
+        self.indice = indice
+        self.iluminacion = iluminacion
+
+    @classmethod
+    def desde_colores(cls, colores: List[ColorInfo], iluminacion: Optional[Iluminacion] = None) -> 'CalibracionCompacta':
+        """Construir a partir de la lista de ColorInfo que devuelve ExtractorProporcional
+        (normalizando los colores con los neutros de la tabla si se dan)."""
+        if iluminacion is not None:
+            colores = normalizar_colores(colores, iluminacion)
+        # Parámetros en el orden de extracción (columnas de la tabla) y valores ascendentes
+        orden_parametros = {p: i for i, p in enumerate(dict.fromkeys(c.parametro for c in colores))}
+        ordenados = sorted(colores, key=lambda c: (orden_parametros[c.parametro], float(c.valor)))
+        datos = np.empty(len(ordenados), dtype=DTYPE_CALIBRACION)
+        indice = {}
+        inicio = 0
+        for i, color in enumerate(ordenados):
+            datos[i] = (color.valor, color.color_rgb, color.color_lab, color.confianza)
+            if i + 1 == len(ordenados) or ordenados[i + 1].parametro != color.parametro:
+                indice[color.parametro] = slice(inicio, i + 1)
+                inicio = i + 1
+        return cls(datos, indice, iluminacion)
+
+    def __len__(self) -> int:
+        return len(self.datos)
+
+    @property
+    def normalizada(self) -> bool:
+        return self.iluminacion is not None
+
+    def tipos(self) -> List[str]:
+        """Parámetros presentes en la calibración."""
+        return list(self.indice.keys())
+
+    def referencias(self, tipo: str) -> np.ndarray:
+        """Filas (vista, sin copia) del parámetro dado."""
+        return self.datos[self.indice[tipo]]
+
+    def valores_y_rgb(self, tipo: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Valores (float64) y colores RGB (uint8, n x 3) del parámetro dado."""
+        filas = self.referencias(tipo)
+        return filas['valor'], filas['rgb']
+
+    def lab_cie(self, tipo: str) -> np.ndarray:
+        """CIE Lab (float64, n x 3) de los colores del parámetro dado."""
+        return rgb_a_lab(self.referencias(tipo)['rgb'])
+
+    def huella(self) -> str:
+        """Hash del contenido (clave de caché de las etapas que dependen de la calibración)."""
+        h = hashlib.blake2b(self.datos.tobytes(), digest_size=16)
+        h.update(repr(sorted((t, s.start, s.stop) for t, s in self.indice.items())).encode())
+        if self.iluminacion is not None:
+            h.update(self.iluminacion.huella().encode())
+        return h.hexdigest()
+
+    def serializar(self) -> Tuple[bytes, str]:
+        """(bytes de los datos, índice y neutros en JSON) para guardarla fuera del proceso."""
+        meta = {
+            'indice': [[t, s.start, s.stop] for t, s in self.indice.items()],
+            'iluminacion': self.iluminacion.a_dict() if self.iluminacion is not None else None
+        }
+        return self.datos.tobytes(), json.dumps(meta)
+
+    @classmethod
+    def deserializar(cls, datos: bytes, meta: str) -> 'CalibracionCompacta':
+        """Inversa de serializar(); los datos se leen sin copia (array de solo lectura)."""
+        meta = json.loads(meta)
+        if isinstance(meta, list):  # Formato anterior: solo el índice
+            meta = {'indice': meta, 'iluminacion': None}
+        iluminacion = Iluminacion.desde_dict(meta['iluminacion']) if meta['iluminacion'] else None
+        return cls(np.frombuffer(datos, dtype=DTYPE_CALIBRACION),
+                   {t: slice(inicio, fin) for t, inicio, fin in meta['indice']}, iluminacion)
+
+    def nbytes(self) -> int:
+        """Bytes ocupados por los datos numéricos."""
+        return int(self.datos.nbytes)
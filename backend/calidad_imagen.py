@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+🔎 Métricas rápidas de calidad de imagen
+Nitidez (varianza del Laplaciano) y exposición calculadas sobre una copia reducida.
+Incluye un filtro de calidad que corta el pipeline antes de ArUco y extracción
+cuando la foto no puede dar un resultado fiable.
+"""
+
+import cv2
+import numpy as np
+import logging
+from typing import Dict, Tuple, Optional
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Lado mayor de las miniaturas usadas para las métricas
+LADO_MINIATURA = 320
+
+# Lado mayor de la copia reducida usada por el filtro de calidad
+LADO_EVALUACION = 640
+
+
+def reducir_imagen(img: np.ndarray, lado_max: int = LADO_MINIATURA) -> Tuple[np.ndarray, float]:
+    """
+    Reducir una imagen para que su lado mayor no supere lado_max.
+
+    Returns:
+        Tuple[imagen_reducida, escala_aplicada]
+    """
+    h, w = img.shape[:2]
+    escala = min(1.0, lado_max / max(h, w))
+    if escala >= 1.0:
+        return img, 1.0
+    reducida = cv2.resize(img, (max(1, int(round(w * escala))), max(1, int(round(h * escala)))),
+                          interpolation=cv2.INTER_AREA)
+    return reducida, escala
+
+
+def a_grises(img: np.ndarray) -> np.ndarray:
+    """Convertir a escala de grises si la imagen es BGR."""
+    if len(img.shape) == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+
+def medir_nitidez(gray: np.ndarray) -> float:
+    """Varianza del Laplaciano: valores bajos indican imagen desenfocada o movida."""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def medir_exposicion(gray: np.ndarray) -> Dict[str, float]:
+    """Luminancia media y fracción de píxeles saturados en sombras y luces."""
+    total = float(gray.size) if gray.size else 1.0
+    return {
+        'luminancia_media': float(np.mean(gray)),
+        'ratio_sombras': float(np.count_nonzero(gray <= 5)) / total,
+        'ratio_luces': float(np.count_nonzero(gray >= 250)) / total
+    }
+
+
+class EvaluadorCalidad:
+    """Filtro de calidad (desenfoque, exposición, reflejos) previo a las etapas pesadas."""
+
+    def __init__(self, lado_max: int = LADO_EVALUACION,
+                 nitidez_min: float = 20.0,
+                 luminancia_min: float = 40.0,
+                 luminancia_max: float = 225.0,
+                 ratio_luces_max: float = 0.35):
+        """
+        Inicializar evaluador.
+
+        Args:
+            lado_max: Lado mayor de la copia reducida sobre la que se mide
+            nitidez_min: Varianza mínima del Laplaciano (a la escala de lado_max)
+            luminancia_min: Luminancia media mínima del área de la tabla
+            luminancia_max: Luminancia media máxima del área de la tabla
+            ratio_luces_max: Fracción máxima de píxeles saturados (>= 250) en el área de la tabla
+        """
+        self.lado_max = lado_max
+        self.nitidez_min = nitidez_min
+        self.luminancia_min = luminancia_min
+        self.luminancia_max = luminancia_max
+        self.ratio_luces_max = ratio_luces_max
+
+    def _recortar_area(self, gray: np.ndarray, area: Optional[Tuple[int, int, int, int]],
+                       escala: float) -> np.ndarray:
+        """Recortar el área de la tabla; sin área conocida se usa el 60% central."""
+        h, w = gray.shape[:2]
+        if area is not None:
+            x, y, aw, ah = [int(round(v * escala)) for v in area]
+            x, y = max(0, x), max(0, y)
+            recorte = gray[y:min(h, y + ah), x:min(w, x + aw)]
+            if recorte.size > 0:
+                return recorte
+        return gray[int(h * 0.2):int(h * 0.8), int(w * 0.2):int(w * 0.8)]
+
+    def evaluar(self, img: np.ndarray, area: Optional[Tuple[int, int, int, int]] = None) -> Dict:
+        """
+        Medir calidad sobre una copia reducida.
+
+        Args:
+            img: Imagen BGR a tamaño completo
+            area: (x, y, w, h) de la tabla en coordenadas de img, si se conoce
+
+        Returns:
+            Dict con 'apta', 'mensaje' y 'metricas'
+        """
+        reducida, escala = reducir_imagen(img, self.lado_max)
+        gray = a_grises(reducida)
+        gray_area = self._recortar_area(gray, area, escala)
+
+        exposicion = medir_exposicion(gray_area)
+        metricas = {
+            'nitidez': medir_nitidez(gray),
+            'luminancia_media': exposicion['luminancia_media'],
+            'ratio_luces': exposicion['ratio_luces'],
+            'ratio_sombras': exposicion['ratio_sombras'],
+            'dimensiones_evaluadas': [int(reducida.shape[1]), int(reducida.shape[0])]
+        }
+
+        problemas = []
+        if metricas['nitidez'] < self.nitidez_min:
+            problemas.append("Imagen borrosa; sujeta el móvil firme y enfoca la tabla")
+        if metricas['luminancia_media'] < self.luminancia_min:
+            problemas.append("Imagen muy oscura; acerca una fuente de luz")
+        elif metricas['luminancia_media'] > self.luminancia_max:
+            problemas.append("Imagen sobreexpuesta; evita la luz directa")
+        if metricas['ratio_luces'] > self.ratio_luces_max:
+            problemas.append("Demasiados reflejos sobre la tabla; cambia el ángulo de la foto")
+
+        return {
+            'apta': not problemas,
+            'mensaje': "Calidad de imagen correcta" if not problemas else "; ".join(problemas),
+            'metricas': metricas
+        }
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+👥 Prueba de carga con usuarios concurrentes
+Arranca el servidor en local (gunicorn como en el Procfile, o el servidor de Flask) y
+simula N técnicos, cada uno con su user_code y su propio kit sintético: un parche objetivo
+con un color de una rejilla RGB, el resto de parches con colores de relleno alejados de
+todos los objetivos, y una probeta con el color del parche objetivo. Cada usuario repite el
+flujo de 4 llamadas (detectar_aruco → extraer_colores → rectificar_probeta →
+analizar_probeta) y se comprueba que cada respuesta corresponde a sus propias fotos:
+una respuesta con la imagen o la calibración de otro usuario falla la comprobación.
+
+Informa del throughput y de p50/p95/p99 por endpoint; sale con código 1 si alguna
+comprobación falla.
+
+Uso:
+    python carga_concurrente.py --usuarios 8 --rondas 3
+    python carga_concurrente.py --usuarios 16 --workers 2 --threads 8 --salida carga.json
+    python carga_concurrente.py --url http://127.0.0.1:5000 --usuarios 4   # servidor ya arrancado
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import itertools
+import logging
+import subprocess
+import threading
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from escenas_sinteticas import construir_tabla, componer_hoja, fotografiar, generar_escena_probeta, codificar_jpeg
+from dataset_sintetico import TIPOS_TEST, TAMANO_TABLA, TAMANO_PROBETA
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ('detectar_aruco', 'extraer_colores', 'rectificar_probeta', 'analizar_probeta')
+
+# Fotos limpias: aquí se mide concurrencia, no robustez del detector. La luz algo atenuada
+# evita que el filtro de calidad rechace la probeta (casi todo papel blanco) por sobreexposición
+GANANCIA_LUZ = 0.85
+DEGRADACIONES = {'perspectiva': 0.04, 'desenfoque': 0.0, 'ruido': 2.0, 'ganancia_rgb': (GANANCIA_LUZ,) * 3}
+
+# Diferencia RGB mínima entre el color de la probeta y el resto de colores en juego
+SEPARACION_MIN = 60.0
+
+# Colores objetivo en una rejilla con paso 70 (> SEPARACION_MIN) y de relleno en los centros de
+# sus celdas: cada relleno está a 35·√3 ≈ 60.6 de cualquier objetivo
+NIVELES_OBJETIVO = (30, 100, 170, 240)
+NIVELES_RELLENO = (65, 135, 205)
+COLORES_OBJETIVO = [(r, g, b) for r in NIVELES_OBJETIVO for g in NIVELES_OBJETIVO for b in NIVELES_OBJETIVO]
+COLORES_RELLENO = [(r, g, b) for r in NIVELES_RELLENO for g in NIVELES_RELLENO for b in NIVELES_RELLENO]
+
+# Diferencia RGB máxima admitida al comprobar una imagen devuelta
+TOLERANCIA_RGB = 30.0
+
+
+@dataclass
+class Usuario:
+    """Kit sintético y fotos de un técnico simulado."""
+    user_code: str
+    parametro: str
+    valor_esperado: float
+    rgb_parche: Tuple[int, int, int]  # Color impreso
+    rgb_foto: Tuple[int, int, int]  # Color esperado en las fotos (con la luz aplicada)
+    rect_parche: List[int]  # Parche de la probeta en la tabla rectificada
+    area_probeta: List[int]  # Área de muestreo en la probeta rectificada
+    bbox_tabla: List[int]
+    fotos: List[Tuple[str, str]] = field(default_factory=list)  # (tabla, probeta) por ronda, data URL
+
+
+def _distancia(a, b) -> float:
+    return float(np.linalg.norm(np.subtract(a, b, dtype=np.float64)))
+
+
+def _data_url(img: np.ndarray) -> str:
+    return 'data:image/jpeg;base64,' + base64.b64encode(codificar_jpeg(img)).decode()
+
+
+def _area_central(rect) -> List[int]:
+    x, y, w, h = rect
+    return [x + w // 4, y + h // 4, max(5, w // 2), max(5, h // 2)]
+
+
+def _a_rectificada(rect, tamano_contenido, tamano) -> List[int]:
+    sx, sy = tamano[0] / tamano_contenido[0], tamano[1] / tamano_contenido[1]
+    x, y, w, h = rect
+    return [int(round(x * sx)), int(round(y * sy)), int(round(w * sx)), int(round(h * sy))]
+
+
+def crear_usuario(indice: int, rondas: int, megapixeles: float, rng: np.random.Generator) -> Usuario:
+    """
+    Kit del usuario `indice` con un par (color objetivo, parche objetivo) único.
+
+    El color recorre COLORES_OBJETIVO y en cada vuelta completa el parche objetivo avanza uno
+    (primero por los valores del mismo parámetro). Así la tabla de otro usuario nunca tiene
+    el color esperado en el parche objetivo (o es otro color de la rejilla o es un relleno), y
+    dos usuarios con la misma probeta difieren en el valor que da su calibración.
+
+    Raises:
+        ValueError: Si no quedan pares (color, parche) libres para este usuario
+    """
+    color = COLORES_OBJETIVO[indice % len(COLORES_OBJETIVO)]
+    vuelta = indice // len(COLORES_OBJETIVO)
+    orden_parche = itertools.count()
+
+    def colores(parametro, i, valor):
+        if next(orden_parche) == vuelta:
+            return color
+        return COLORES_RELLENO[int(rng.integers(len(COLORES_RELLENO)))]
+
+    contenido, bbox_tabla, parches = construir_tabla(colores)
+    if vuelta >= len(parches):
+        raise ValueError(f"Sin pares (color, parche) libres para el usuario {indice}: "
+                         f"el máximo es {len(COLORES_OBJETIVO) * len(parches)} usuarios")
+    objetivo = parches[vuelta]
+
+    tamano_contenido = (contenido.shape[1], contenido.shape[0])
+    hoja, esquinas_hoja = componer_hoja(contenido)
+    usuario = Usuario(
+        user_code=f"carga{indice:03d}",
+        parametro=objetivo['parametro'],
+        valor_esperado=float(objetivo['valor']),
+        rgb_parche=objetivo['rgb'],
+        rgb_foto=tuple(int(round(c * GANANCIA_LUZ)) for c in objetivo['rgb']),
+        rect_parche=_area_central(_a_rectificada(objetivo['rect'], tamano_contenido, TAMANO_TABLA)),
+        area_probeta=[],
+        bbox_tabla=_a_rectificada(bbox_tabla, tamano_contenido, TAMANO_TABLA)
+    )
+    for _ in range(rondas):
+        # Foto nueva en cada ronda: la caché de resultados no debe servir las repeticiones
+        foto_tabla, _ = fotografiar(hoja, esquinas_hoja, megapixeles, rng, **DEGRADACIONES)
+        escena_probeta = generar_escena_probeta(megapixeles, rng, objetivo['rgb'], **DEGRADACIONES)
+        usuario.fotos.append((_data_url(foto_tabla), _data_url(escena_probeta.imagen)))
+    usuario.area_probeta = _area_central(escena_probeta.a_rectificada(escena_probeta.area_liquido, *TAMANO_PROBETA))
+    return usuario
+
+
+def color_medio(imagen_b64: Optional[str], rect: List[int]) -> Optional[Tuple[int, int, int]]:
+    """Color RGB medio de un rectángulo de una imagen base64 devuelta por el servidor."""
+    if not imagen_b64:
+        return None
+    img = cv2.imdecode(np.frombuffer(base64.b64decode(imagen_b64.split(',')[-1]), np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    x, y, w, h = rect
+    b, g, r, _ = cv2.mean(img[y:y + h, x:x + w])
+    return int(round(r)), int(round(g)), int(round(b))
+
+
+class ClienteCarga:
+    """Ejecuta el flujo de 4 llamadas de un usuario y comprueba cada respuesta."""
+
+    def __init__(self, url: str, timeout: float = 300.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.latencias: Dict[str, List[float]] = defaultdict(list)
+        self.errores: Dict[str, int] = defaultdict(int)
+        self.fallos: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def _post(self, endpoint: str, payload: Dict) -> Optional[Dict]:
+        peticion = urllib.request.Request(f"{self.url}/{endpoint}", data=json.dumps(payload).encode(),
+                                          headers={'Content-Type': 'application/json'}, method='POST')
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                datos = json.loads(respuesta.read())
+        except urllib.error.HTTPError as e:
+            datos = json.loads(e.read() or b'{}')
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            datos = {'exito': False, 'mensaje': f'{type(e).__name__}: {e}'}
+        duracion = time.perf_counter() - inicio
+        with self._lock:
+            self.latencias[endpoint].append(duracion)
+            if not datos.get('exito'):
+                self.errores[endpoint] += 1
+        return datos
+
+    def _fallo(self, usuario: Usuario, ronda: int, endpoint: str, motivo: str):
+        with self._lock:
+            self.fallos.append({'user_code': usuario.user_code, 'ronda': ronda, 'endpoint': endpoint, 'motivo': motivo})
+
+    def _comprobar_color(self, usuario, ronda, endpoint, imagen, rect, esperado) -> bool:
+        medido = color_medio(imagen, rect)
+        if medido is None or _distancia(medido, esperado) > TOLERANCIA_RGB:
+            self._fallo(usuario, ronda, endpoint, f"color {medido} en la imagen devuelta, esperado {esperado}")
+            return False
+        return True
+
+    def flujo(self, usuario: Usuario, ronda: int) -> bool:
+        """Las 4 llamadas de una ronda; False en cuanto una respuesta no es la del usuario."""
+        foto_tabla, foto_probeta = usuario.fotos[ronda]
+
+        datos = self._post('detectar_aruco', {'user_code': usuario.user_code, 'imagen': foto_tabla})
+        if not datos.get('exito'):
+            self._fallo(usuario, ronda, 'detectar_aruco', datos.get('mensaje', ''))
+            return False
+        tabla = datos['imagen_rectificada']
+        if not self._comprobar_color(usuario, ronda, 'detectar_aruco', tabla, usuario.rect_parche, usuario.rgb_foto):
+            return False
+
+        datos = self._post('extraer_colores', {'user_code': usuario.user_code, 'imagen_rectificada': tabla,
+                                               'bbox_tabla': usuario.bbox_tabla})
+        if not datos.get('exito'):
+            self._fallo(usuario, ronda, 'extraer_colores', datos.get('mensaje', ''))
+            return False
+        # La imagen de debug sale de un archivo temporal: aquí se vería la de otro usuario
+        if not self._comprobar_color(usuario, ronda, 'extraer_colores', datos.get('imagen_debug'),
+                                     usuario.rect_parche, usuario.rgb_foto):
+            return False
+
+        datos = self._post('rectificar_probeta', {'user_code': usuario.user_code, 'imagen_probeta': foto_probeta})
+        if not datos.get('exito'):
+            self._fallo(usuario, ronda, 'rectificar_probeta', datos.get('mensaje', ''))
+            return False
+        probeta = datos['imagen_rectificada']
+        if not self._comprobar_color(usuario, ronda, 'rectificar_probeta', probeta,
+                                     usuario.area_probeta, usuario.rgb_foto):
+            return False
+
+        datos = self._post('analizar_probeta', {'user_code': usuario.user_code, 'imagen_probeta': probeta,
+                                                'tipo_test': TIPOS_TEST[usuario.parametro],
+                                                'area_seleccionada': usuario.area_probeta})
+        if not datos.get('exito'):
+            self._fallo(usuario, ronda, 'analizar_probeta', datos.get('mensaje', ''))
+            return False
+        if abs(datos['valor_final'] - usuario.valor_esperado) > 1e-6:
+            self._fallo(usuario, ronda, 'analizar_probeta',
+                        f"valor {datos['valor_final']} ({datos.get('parametro_cercano')}), "
+                        f"esperado {usuario.parametro} {usuario.valor_esperado}")
+            return False
+        return True
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servidor(servidor: str, puerto: int, workers: int, threads: int) -> subprocess.Popen:
+    """Servidor local en un subproceso (mismo comando que el Procfile para gunicorn)."""
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    if servidor == 'gunicorn':
+        comando = [sys.executable, '-m', 'gunicorn', 'main:app', '--bind', f'127.0.0.1:{puerto}',
+                   '--timeout', '300', '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning']
+    else:
+        comando = [sys.executable, '-c',
+                   f"import main; main.app.run(host='127.0.0.1', port={puerto}, threaded=True, debug=False)"]
+    return subprocess.Popen(comando, cwd=directorio, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def esperar_servidor(url: str, proceso: Optional[subprocess.Popen], limite_s: float = 60.0):
+    fin = time.monotonic() + limite_s
+    while time.monotonic() < fin:
+        if proceso is not None and proceso.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar (código {proceso.returncode})")
+        try:
+            with urllib.request.urlopen(url + '/', timeout=2):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.3)
+    raise RuntimeError(f"El servidor no respondió en {limite_s:.0f} s")
+
+
+def percentiles_ms(latencias: List[float]) -> Dict:
+    if not latencias:
+        return {}
+    ms = np.array(latencias) * 1000
+    return {'n': len(ms), 'p50': round(float(np.percentile(ms, 50)), 1), 'p95': round(float(np.percentile(ms, 95)), 1),
+            'p99': round(float(np.percentile(ms, 99)), 1), 'max': round(float(ms.max()), 1)}
+
+
+def main():
+    """Función principal de la prueba de carga."""
+    parser = argparse.ArgumentParser(description="Prueba de carga con usuarios concurrentes")
+    parser.add_argument('--usuarios', type=int, default=8)
+    parser.add_argument('--rondas', type=int, default=3, help="Flujos completos por usuario")
+    parser.add_argument('--megapixeles', type=float, default=2)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--url', default=None, help="Servidor ya arrancado (si no, se arranca uno local)")
+    parser.add_argument('--servidor', choices=['gunicorn', 'flask'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Workers de gunicorn (las calibraciones viven en memoria de cada worker)")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--salida', default=None, help="JSON con los resultados")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.semilla)
+    print(f"🧪 Generando kits y fotos para {args.usuarios} usuarios ({args.rondas} rondas, {args.megapixeles:g} MP)...")
+    try:
+        usuarios = [crear_usuario(i, args.rondas, args.megapixeles, rng) for i in range(args.usuarios)]
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    proceso = None
+    url = args.url
+    if url is None:
+        puerto = puerto_libre()
+        url = f"http://127.0.0.1:{puerto}"
+        proceso = arrancar_servidor(args.servidor, puerto, args.workers, args.threads)
+        print(f"🚀 Servidor {args.servidor} en {url} (workers={args.workers}, threads={args.threads})")
+
+    cliente = ClienteCarga(url)
+    try:
+        esperar_servidor(url, proceso)
+        barrera = threading.Barrier(len(usuarios))
+
+        def simular(usuario: Usuario) -> int:
+            barrera.wait()
+            return sum(cliente.flujo(usuario, ronda) for ronda in range(args.rondas))
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(usuarios)) as pool:
+            correctos = sum(pool.map(simular, usuarios))
+        duracion = time.perf_counter() - inicio
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+
+    flujos = args.usuarios * args.rondas
+    peticiones = sum(len(v) for v in cliente.latencias.values())
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'usuarios': args.usuarios, 'rondas': args.rondas, 'megapixeles': args.megapixeles,
+        'servidor': args.servidor if args.url is None else args.url,
+        'workers': args.workers, 'threads': args.threads,
+        'duracion_s': round(duracion, 2),
+        'flujos': flujos, 'flujos_correctos': correctos,
+        'flujos_por_s': round(flujos / duracion, 3),
+        'peticiones_por_s': round(peticiones / duracion, 3),
+        'endpoints': {e: {**percentiles_ms(cliente.latencias[e]), 'errores': cliente.errores[e]} for e in ENDPOINTS},
+        'fallos': cliente.fallos
+    }
+
+    print(f"\n⏱️ {flujos} flujos en {duracion:.1f} s: {informe['flujos_por_s']:.2f} flujos/s, "
+          f"{informe['peticiones_por_s']:.2f} peticiones/s")
+    print(f"{'endpoint':<20} {'n':>5} {'errores':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for endpoint, r in informe['endpoints'].items():
+        if 'n' in r:
+            print(f"{endpoint:<20} {r['n']:>5} {r['errores']:>8} {r['p50']:>9.1f} {r['p95']:>9.1f} "
+                  f"{r['p99']:>9.1f} {r['max']:>9.1f}")
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Resultados guardados en {args.salida}")
+
+    if cliente.fallos:
+        print(f"\n❌ {len(cliente.fallos)} flujos con respuestas incorrectas:")
+        for fallo in cliente.fallos[:20]:
+            print(f"   • [{fallo['user_code']} ronda {fallo['ronda']}] /{fallo['endpoint']}: {fallo['motivo']}")
+        sys.exit(1)
+    print(f"\n✅ {correctos}/{flujos} flujos correctos: cada usuario recibió sus propios resultados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+🛠️ Compilar la plantilla de un kit desde su imagen de referencia
+Analiza una vez la imagen de referencia en B&N (parches negros sobre fondo blanco, una
+columna por parámetro) y escribe plantillas/<kit_id>.json para RegistroPlantillas.
+Los parámetros del kit se dan en un JSON con el formato de parametros_config, en orden
+de columna de izquierda a derecha:
+
+    {"pH": {"valores": [6.0, 6.4, ...], "nombre_completo": "pH"}, ...}
+
+Sin --parametros se usa la tabla del API Freshwater.
+
+Uso:
+    python construir_plantillas.py --referencia referencia2.jpg --kit api_freshwater \\
+        --nombre "API Freshwater Master Test Kit"
+    python construir_plantillas.py --referencia otra_tabla.png --kit otro_kit --nombre "Otro kit" \\
+        --parametros otro_kit_parametros.json
+"""
+
+import sys
+import json
+import argparse
+
+import cv2
+
+from b3_extractor import PARAMETROS_API_FRESHWATER
+from plantillas_kits import DIRECTORIO_PLANTILLAS, construir_plantilla, guardar_plantilla
+
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description="Compilar la plantilla de un kit de test")
+    parser.add_argument('--referencia', required=True, help="Imagen de referencia en B&N")
+    parser.add_argument('--kit', required=True, help="kit_id (nombre del archivo de la plantilla)")
+    parser.add_argument('--nombre', required=True, help="Nombre legible del kit")
+    parser.add_argument('--parametros', default=None, help="JSON con los parámetros en orden de columna")
+    parser.add_argument('--salida', default=DIRECTORIO_PLANTILLAS, help="Directorio de plantillas")
+    args = parser.parse_args()
+
+    img_ref = cv2.imread(args.referencia)
+    if img_ref is None:
+        print(f"❌ No se pudo cargar {args.referencia}")
+        sys.exit(1)
+
+    parametros_config = PARAMETROS_API_FRESHWATER
+    if args.parametros:
+        with open(args.parametros, 'r', encoding='utf-8') as f:
+            parametros_config = json.load(f)
+
+    try:
+        plantilla = construir_plantilla(args.kit, args.nombre, img_ref, parametros_config)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    ruta = guardar_plantilla(plantilla, args.salida)
+    print(f"✅ Plantilla {plantilla.kit_id} guardada en {ruta}")
+    print(f"   • Tabla en referencia: {plantilla.tamano_referencia[0]}x{plantilla.tamano_referencia[1]} px")
+    for p in plantilla.parametros:
+        print(f"   • {p['nombre_completo']}: {len(p['rectangulos'])}/{len(p['valores'])} parches")
+
+
+if __name__ == "__main__":
+    main()
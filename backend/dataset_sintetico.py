@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+🧪 Dataset sintético con verdad de referencia
+Genera pares de fotos (tabla de colores + probeta) con los 4 marcadores ArUco. Los
+colores impresos de cada parámetro siguen un degradado conocido sobre los valores de
+ExtractorProporcional.parametros_config y el líquido de cada probeta tiene el color de
+un valor real continuo (interpolado entre los dos parches vecinos). Cada muestra varía
+iluminación (intensidad y color de la luz), perspectiva, desenfoque y ruido; todo se
+anota en manifiesto.json para evaluar_pipeline.py.
+
+Uso:
+    python dataset_sintetico.py --salida dataset --muestras 50 --megapixeles 12
+"""
+
+import os
+import json
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from b3_extractor import ExtractorProporcional
+from escenas_sinteticas import (construir_tabla, componer_hoja, fotografiar, generar_escena_probeta,
+                                codificar_jpeg)
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Tamaños de las imágenes rectificadas que produce el backend
+TAMANO_TABLA = (800, 533)
+TAMANO_PROBETA = (800, 513)
+
+# Colores impresos (RGB) del primer, central y último valor de cada parámetro
+GRADIENTES = {
+    'pH': [(222, 196, 52), (226, 140, 48), (206, 72, 60)],
+    'High_Range_pH': [(228, 150, 64), (196, 78, 96), (140, 48, 128)],
+    'Ammonia': [(226, 216, 84), (146, 186, 82), (44, 122, 92)],
+    'Nitrite': [(116, 176, 214), (166, 118, 186), (198, 62, 146)],
+    'Nitrate': [(236, 198, 86), (226, 120, 64), (172, 36, 44)]
+}
+
+# Parámetro de la calibración → tipo_test que envía el frontend
+TIPOS_TEST = {'pH': 'pH', 'High_Range_pH': 'high_ph', 'Ammonia': 'ammonia', 'Nitrite': 'nitrite', 'Nitrate': 'nitrate'}
+
+
+def color_en_posicion(parametro: str, posicion: float, n_valores: int) -> Tuple[int, int, int]:
+    """
+    Color del degradado en una posición de la escala de valores.
+
+    Args:
+        posicion: Índice continuo en la lista de valores (0 = primer parche, n-1 = último)
+    """
+    anclas = np.array(GRADIENTES[parametro], dtype=np.float64)
+    t = np.linspace(0, 1, len(anclas))
+    fraccion = posicion / (n_valores - 1)
+    return tuple(int(round(np.interp(fraccion, t, anclas[:, c]))) for c in range(3))
+
+
+def colores_kit(parametros_config: Dict):
+    """fn(parametro, indice, valor) -> rgb de los parches impresos."""
+    def color(parametro: str, indice: int, valor: float) -> Tuple[int, int, int]:
+        return color_en_posicion(parametro, indice, len(parametros_config[parametro]['valores']))
+    return color
+
+
+def iluminacion_aleatoria(rng: np.random.Generator) -> Dict:
+    """Intensidad, temperatura de color y degradaciones de una toma."""
+    intensidad = float(rng.uniform(0.8, 1.1))
+    temperatura = float(rng.uniform(-0.08, 0.08))  # >0 cálida, <0 fría
+    return {
+        'intensidad': round(intensidad, 4),
+        'temperatura': round(temperatura, 4),
+        'ganancia_rgb': [round(intensidad * (1 + temperatura), 4), round(intensidad, 4),
+                         round(intensidad * (1 - temperatura), 4)],
+        'gradiente': round(float(rng.uniform(0.0, 0.2)), 4),
+        'desenfoque': round(float(rng.uniform(0.0, 1.2)), 3),
+        'ruido': round(float(rng.uniform(1.0, 4.0)), 3),
+        'perspectiva': 0.06
+    }
+
+
+def derivar_iluminacion(base: Dict, deriva: float, rng: np.random.Generator) -> Dict:
+    """Iluminación de la segunda foto: la de la tabla con una deriva relativa por canal."""
+    ganancia = [round(g * float(rng.uniform(1 - deriva, 1 + deriva)), 4) for g in base['ganancia_rgb']]
+    return {**base, 'ganancia_rgb': ganancia,
+            'desenfoque': round(float(rng.uniform(0.0, 1.2)), 3),
+            'ruido': round(float(rng.uniform(1.0, 4.0)), 3)}
+
+
+def _degradaciones(iluminacion: Dict) -> Dict:
+    return {'perspectiva': iluminacion['perspectiva'], 'desenfoque': iluminacion['desenfoque'],
+            'ruido': iluminacion['ruido'], 'ganancia_rgb': tuple(iluminacion['ganancia_rgb']),
+            'gradiente': iluminacion['gradiente']}
+
+
+def _area_central(rect: Tuple[int, int, int, int]) -> List[int]:
+    """Mitad central de un rectángulo (lo que seleccionaría el usuario)."""
+    x, y, w, h = rect
+    return [x + w // 4, y + h // 4, max(5, w // 2), max(5, h // 2)]
+
+
+def generar_dataset(directorio: str, muestras: int, megapixeles: float, semilla: int = 0,
+                    deriva: float = 0.03, ruta_referencia: str = 'referencia2.jpg') -> Dict:
+    """Generar las fotos y el manifiesto; devuelve el manifiesto."""
+    os.makedirs(directorio, exist_ok=True)
+    rng = np.random.default_rng(semilla)
+    parametros_config = ExtractorProporcional(referencia_path=ruta_referencia).parametros_config
+
+    # La tabla impresa es la misma en todas las muestras: se compone una vez
+    contenido, bbox_tabla, parches = construir_tabla(colores_kit(parametros_config), ruta_referencia)
+    hoja_tabla, esquinas_hoja_tabla = componer_hoja(contenido)
+    tamano_contenido = (contenido.shape[1], contenido.shape[0])
+
+    def a_tabla_rectificada(rect):
+        sx, sy = TAMANO_TABLA[0] / tamano_contenido[0], TAMANO_TABLA[1] / tamano_contenido[1]
+        x, y, w, h = rect
+        return [int(round(x * sx)), int(round(y * sy)), int(round(w * sx)), int(round(h * sy))]
+
+    parametros = list(parametros_config.keys())
+    lista_muestras = []
+    for i in range(muestras):
+        parametro = parametros[i % len(parametros)]
+        valores = parametros_config[parametro]['valores']
+
+        # Valor real uniforme en la escala del kit (no en unidades: Nitrate va de 0 a 160)
+        posicion = float(rng.uniform(0, len(valores) - 1))
+        valor_real = float(np.interp(posicion, np.arange(len(valores)), valores))
+        rgb_liquido = color_en_posicion(parametro, posicion, len(valores))
+
+        luz_tabla = iluminacion_aleatoria(rng)
+        luz_probeta = derivar_iluminacion(luz_tabla, deriva, rng)
+
+        foto_tabla, esquinas_tabla = fotografiar(hoja_tabla, esquinas_hoja_tabla, megapixeles, rng,
+                                                 **_degradaciones(luz_tabla))
+        escena_probeta = generar_escena_probeta(megapixeles, rng, rgb_liquido, **_degradaciones(luz_probeta))
+
+        archivo_tabla = f"muestra_{i:04d}_tabla.jpg"
+        archivo_probeta = f"muestra_{i:04d}_probeta.jpg"
+        with open(os.path.join(directorio, archivo_tabla), 'wb') as f:
+            f.write(codificar_jpeg(foto_tabla))
+        with open(os.path.join(directorio, archivo_probeta), 'wb') as f:
+            f.write(codificar_jpeg(escena_probeta.imagen))
+
+        area_liquido = escena_probeta.a_rectificada(escena_probeta.area_liquido, *TAMANO_PROBETA)
+        lista_muestras.append({
+            'id': i,
+            'parametro': parametro,
+            'tipo_test': TIPOS_TEST[parametro],
+            'valor_real': round(valor_real, 6),
+            'rgb_liquido': list(rgb_liquido),
+            'tabla': {'archivo': archivo_tabla, 'esquinas': esquinas_tabla.round(2).tolist(),
+                      'iluminacion': luz_tabla},
+            'probeta': {'archivo': archivo_probeta, 'esquinas': escena_probeta.esquinas.round(2).tolist(),
+                        'area_liquido': list(area_liquido), 'area_muestra': _area_central(area_liquido),
+                        'iluminacion': luz_probeta}
+        })
+        logger.info(f"🧪 Muestra {i}: {parametro} = {valor_real:.3f} RGB{rgb_liquido}")
+
+    manifiesto = {
+        'version': 1,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'semilla': semilla,
+        'megapixeles': megapixeles,
+        'deriva_iluminacion': deriva,
+        'tamano_tabla': list(TAMANO_TABLA),
+        'tamano_probeta': list(TAMANO_PROBETA),
+        'bbox_tabla': a_tabla_rectificada(bbox_tabla),
+        'parches': [{'parametro': p['parametro'], 'valor': p['valor'], 'rgb': list(p['rgb']),
+                     'rect': a_tabla_rectificada(p['rect'])} for p in parches],
+        'muestras': lista_muestras
+    }
+    with open(os.path.join(directorio, 'manifiesto.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    return manifiesto
+
+
+def main():
+    """Función principal del generador."""
+    parser = argparse.ArgumentParser(description="Dataset sintético de tabla + probeta con verdad de referencia")
+    parser.add_argument('--salida', default='dataset_sintetico', help="Directorio de salida")
+    parser.add_argument('--muestras', type=int, default=50)
+    parser.add_argument('--megapixeles', type=float, default=12)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--deriva-iluminacion', type=float, default=0.03,
+                        help="Variación relativa de la luz entre la foto de la tabla y la de la probeta")
+    parser.add_argument('--referencia', default='referencia2.jpg')
+    args = parser.parse_args()
+
+    manifiesto = generar_dataset(args.salida, args.muestras, args.megapixeles, args.semilla,
+                                 args.deriva_iluminacion, args.referencia)
+    print(f"✅ {len(manifiesto['muestras'])} muestras en {args.salida}/manifiesto.json")
+
+
+if __name__ == "__main__":
+    main()
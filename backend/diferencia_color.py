@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+🎨 Diferencias de color vectorizadas (RGB, ΔE76, ΔE94, CIEDE2000)
+Todas las funciones trabajan con arrays (..., 3) y hacen broadcasting, de modo que un
+color o una imagen entera se compara con todas las referencias de un tipo de test en
+una sola llamada: consulta (..., 1, 3) frente a referencias (n, 3) → distancias (..., n).
+
+Lab es CIE L*a*b* (D65, L en 0-100). Referencias y consulta se convierten desde sRGB con
+la misma fórmula en float64: la columna 'lab' de CalibracionCompacta viene de OpenCV sobre
+uint8 y su cuantización (±0.5) ya es del orden de un ΔE de umbral.
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Métricas que acepta la API ('rgb' es la distancia euclídea histórica)
+METRICAS = ('rgb', 'de76', 'de94', 'ciede2000')
+
+# Escala de cada métrica para la clasificación: (distancia por debajo de la cual se toma el
+# valor más cercano sin interpolar, distancia a la que la confianza llega al mínimo).
+# En RGB son los umbrales históricos; en Lab, ~1 JND (ΔE76 ≈ 2.3) y un color claramente distinto.
+ESCALAS: Dict[str, Tuple[float, float]] = {
+    'rgb': (10.0, 100.0),
+    'de76': (4.0, 40.0),
+    'de94': (2.5, 25.0),
+    'ciede2000': (2.5, 25.0)
+}
+
+# Blanco de referencia D65 (XYZ normalizado) y matriz sRGB → XYZ
+_BLANCO_D65 = np.array([0.950456, 1.0, 1.088754])
+_SRGB_A_XYZ = np.array([[0.412453, 0.357580, 0.180423],
+                        [0.212671, 0.715160, 0.072169],
+                        [0.019334, 0.119193, 0.950227]])
+
+
+def rgb_a_lab(rgb: np.ndarray) -> np.ndarray:
+    """sRGB 0-255 (..., 3) → CIE Lab (..., 3) en float64."""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    lineal = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = (lineal @ _SRGB_A_XYZ.T) / _BLANCO_D65
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    L = np.where(xyz[..., 1] > 0.008856, 116.0 * f[..., 1] - 16.0, 903.3 * xyz[..., 1])
+    return np.stack([L, 500.0 * (f[..., 0] - f[..., 1]), 200.0 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def lab_opencv_a_cie(lab: np.ndarray) -> np.ndarray:
+    """Lab de cv2.COLOR_BGR2LAB sobre uint8 (L*255/100, a+128, b+128) → CIE Lab."""
+    lab = np.asarray(lab, dtype=np.float64)
+    return np.stack([lab[..., 0] * (100.0 / 255.0), lab[..., 1] - 128.0, lab[..., 2] - 128.0], axis=-1)
+
+
+def delta_e76(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """Distancia euclídea en Lab."""
+    return np.sqrt(np.sum((np.asarray(lab1, dtype=np.float64) - lab2) ** 2, axis=-1))
+
+
+def delta_e94(lab1: np.ndarray, lab2: np.ndarray, kL: float = 1.0, K1: float = 0.045, K2: float = 0.015) -> np.ndarray:
+    """CIE94 (artes gráficas); lab1 es la referencia (no es simétrica)."""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    dL = lab1[..., 0] - lab2[..., 0]
+    C1 = np.hypot(lab1[..., 1], lab1[..., 2])
+    C2 = np.hypot(lab2[..., 1], lab2[..., 2])
+    dC = C1 - C2
+    da = lab1[..., 1] - lab2[..., 1]
+    db = lab1[..., 2] - lab2[..., 2]
+    dH2 = np.maximum(da * da + db * db - dC * dC, 0.0)
+    SC = 1.0 + K1 * C1
+    SH = 1.0 + K2 * C1
+    return np.sqrt((dL / kL) ** 2 + (dC / SC) ** 2 + dH2 / SH ** 2)
+
+
+def ciede2000(lab1: np.ndarray, lab2: np.ndarray, kL: float = 1.0, kC: float = 1.0, kH: float = 1.0) -> np.ndarray:
+    """CIEDE2000 (Sharma, Wu y Dalal 2005)."""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C_media = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2.0
+    C7 = C_media ** 7
+    G = 0.5 * (1.0 - np.sqrt(C7 / (C7 + 25.0 ** 7)))
+    a1p, a2p = (1.0 + G) * a1, (1.0 + G) * a2
+    C1p, C2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360.0
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360.0
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    producto_C = C1p * C2p
+    dh = h2p - h1p
+    dh = np.where(dh > 180.0, dh - 360.0, np.where(dh < -180.0, dh + 360.0, dh))
+    dh = np.where(producto_C == 0, 0.0, dh)
+    dHp = 2.0 * np.sqrt(producto_C) * np.sin(np.radians(dh / 2.0))
+
+    Lp_media = (L1 + L2) / 2.0
+    Cp_media = (C1p + C2p) / 2.0
+    suma_h = h1p + h2p
+    hp_media = np.where(np.abs(h1p - h2p) <= 180.0, suma_h / 2.0,
+                        np.where(suma_h < 360.0, (suma_h + 360.0) / 2.0, (suma_h - 360.0) / 2.0))
+    hp_media = np.where(producto_C == 0, suma_h, hp_media)
+
+    T = (1.0 - 0.17 * np.cos(np.radians(hp_media - 30.0)) + 0.24 * np.cos(np.radians(2.0 * hp_media))
+         + 0.32 * np.cos(np.radians(3.0 * hp_media + 6.0)) - 0.20 * np.cos(np.radians(4.0 * hp_media - 63.0)))
+    d_theta = 30.0 * np.exp(-(((hp_media - 275.0) / 25.0) ** 2))
+    Cp7 = Cp_media ** 7
+    RC = 2.0 * np.sqrt(Cp7 / (Cp7 + 25.0 ** 7))
+    L50 = (Lp_media - 50.0) ** 2
+    SL = 1.0 + 0.015 * L50 / np.sqrt(20.0 + L50)
+    SC = 1.0 + 0.045 * Cp_media
+    SH = 1.0 + 0.015 * Cp_media * T
+    RT = -np.sin(np.radians(2.0 * d_theta)) * RC
+
+    tL, tC, tH = dLp / (kL * SL), dCp / (kC * SC), dHp / (kH * SH)
+    return np.sqrt(tL ** 2 + tC ** 2 + tH ** 2 + RT * tC * tH)
+
+
+def distancias(consulta_rgb: np.ndarray, referencias_rgb: np.ndarray,
+               referencias_lab: Optional[np.ndarray] = None, metrica: str = 'rgb') -> np.ndarray:
+    """
+    Distancia de uno o varios colores a todas las referencias.
+
+    Args:
+        consulta_rgb: Color RGB (3,) o array de colores (..., 3)
+        referencias_rgb: Colores RGB de las referencias (n, 3)
+        referencias_lab: CIE Lab de las referencias (n, 3); si falta se calcula desde RGB
+        metrica: 'rgb', 'de76', 'de94' o 'ciede2000'
+
+    Returns:
+        Array (..., n) de distancias
+    """
+    if metrica not in METRICAS:
+        raise ValueError(f"Métrica desconocida: {metrica} (disponibles: {', '.join(METRICAS)})")
+    consulta = np.asarray(consulta_rgb, dtype=np.float64)[..., None, :]
+    if metrica == 'rgb':
+        return np.sqrt(np.sum((consulta - np.asarray(referencias_rgb, dtype=np.float64)) ** 2, axis=-1))
+
+    if referencias_lab is None:
+        referencias_lab = rgb_a_lab(referencias_rgb)
+    lab_consulta = rgb_a_lab(consulta)
+    if metrica == 'de76':
+        return delta_e76(lab_consulta, referencias_lab)
+    if metrica == 'de94':
+        return delta_e94(referencias_lab, lab_consulta)
+    return ciede2000(referencias_lab, lab_consulta)
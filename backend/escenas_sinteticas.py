@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+🖼️ Generación de escenas sintéticas con los 4 marcadores ArUco
+Compone una hoja con los marcadores DICT_4X4_50 (IDs 3/0/1/2 en las esquinas) y un
+contenido entre ellos, la "fotografía" con perspectiva aleatoria a la resolución pedida
+y aplica desenfoque, iluminación y ruido. La tabla se construye con la geometría de
+referencia2.jpg que usa ExtractorProporcional, así que las posiciones de los parches en
+la imagen rectificada son conocidas; la probeta es un tubo centrado con el líquido del
+color pedido.
+"""
+
+import cv2
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from b3_extractor import ExtractorProporcional
+
+# Posición de cada marcador en el contenido: (ID, esquina del contenido que ocupa)
+MARCADORES_ESQUINAS = {3: 'superior_izquierda', 0: 'superior_derecha', 1: 'inferior_izquierda', 2: 'inferior_derecha'}
+
+# Tamaño base del contenido entre marcadores (proporción 800x533 de la tabla rectificada)
+ANCHO_CONTENIDO = 1500
+ALTO_CONTENIDO = 1000
+
+# Contenido de la foto de probeta (proporción 800x513)
+ALTO_CONTENIDO_PROBETA = 962
+
+COLOR_PAPEL = (238, 238, 238)
+COLOR_FONDO = (95, 105, 115)
+
+# Filas por franja al aplicar iluminación y ruido (acota la memoria a 48 MP)
+FILAS_FRANJA = 512
+
+
+@dataclass
+class EscenaSintetica:
+    """Foto sintética y su verdad de referencia."""
+    imagen: np.ndarray
+    esquinas: np.ndarray  # Esquinas exteriores de los marcadores en la foto (orden de rectificación)
+    tamano_contenido: Tuple[int, int]  # (ancho, alto) del contenido entre marcadores
+    bbox_tabla: Optional[Tuple[int, int, int, int]] = None  # Tabla en coordenadas del contenido
+    parches: List[Dict] = field(default_factory=list)  # parametro, valor, rgb, rect (contenido)
+    area_liquido: Optional[Tuple[int, int, int, int]] = None  # Líquido de la probeta (contenido)
+
+    def a_rectificada(self, rect: Tuple[int, int, int, int], ancho: int, alto: int) -> Tuple[int, int, int, int]:
+        """Pasar un rectángulo del contenido a la imagen rectificada de ancho x alto."""
+        sx = ancho / self.tamano_contenido[0]
+        sy = alto / self.tamano_contenido[1]
+        x, y, w, h = rect
+        return (int(round(x * sx)), int(round(y * sy)), int(round(w * sx)), int(round(h * sy)))
+
+
+def cargar_geometria_referencia(ruta_referencia: str = 'referencia2.jpg') -> Tuple[Tuple[int, int, int, int], Dict]:
+    """bbox de la tabla y rectángulos por parámetro tal como los ve ExtractorProporcional."""
+    extractor = ExtractorProporcional(referencia_path=ruta_referencia)
+    img_ref = cv2.imread(ruta_referencia)
+    if img_ref is None:
+        raise FileNotFoundError(f"No se pudo cargar {ruta_referencia}")
+    bbox_ref = extractor.detectar_tabla_en_referencia(img_ref)
+    rectangulos = extractor.extraer_rectangulos_referencia(img_ref, bbox_ref)
+    return bbox_ref, rectangulos
+
+
+def construir_tabla(colores: Callable[[str, int, float], Tuple[int, int, int]],
+                    ruta_referencia: str = 'referencia2.jpg',
+                    ancho: int = ANCHO_CONTENIDO, alto: int = ALTO_CONTENIDO,
+                    lado_marcador: Optional[int] = None) -> Tuple[np.ndarray, Tuple[int, int, int, int], List[Dict]]:
+    """
+    Contenido con la tabla de colores entre los marcadores.
+
+    Args:
+        colores: fn(parametro, indice, valor) -> (r, g, b) de cada parche
+        ruta_referencia: Imagen de referencia con los rectángulos de la tabla
+        ancho, alto: Tamaño del contenido
+        lado_marcador: Lado de los marcadores (por defecto 10% del ancho)
+
+    Returns:
+        (contenido BGR, bbox de la tabla en el contenido, parches)
+    """
+    lado_marcador = lado_marcador or ancho // 10
+    bbox_ref, rectangulos = cargar_geometria_referencia(ruta_referencia)
+    parametros = ExtractorProporcional(referencia_path=ruta_referencia).parametros_config
+
+    # La tabla ocupa el espacio entre las columnas de marcadores
+    hueco = lado_marcador // 5
+    bbox_tabla = (lado_marcador + hueco, hueco, ancho - 2 * (lado_marcador + hueco), alto - 2 * hueco)
+    xt, yt, wt, ht = bbox_tabla
+    xr, yr, wr, hr = bbox_ref
+    sx, sy = wt / wr, ht / hr
+
+    contenido = np.full((alto, ancho, 3), COLOR_PAPEL, dtype=np.uint8)
+    parches = []
+    for parametro, rects in rectangulos.items():
+        valores = parametros[parametro]['valores']
+        for i, (rx, ry, rw, rh) in enumerate(rects[:len(valores)]):
+            rect = (xt + int((rx - xr) * sx), yt + int((ry - yr) * sy), int(rw * sx), int(rh * sy))
+            r, g, b = colores(parametro, i, valores[i])
+            cv2.rectangle(contenido, (rect[0], rect[1]), (rect[0] + rect[2] - 1, rect[1] + rect[3] - 1),
+                          (int(b), int(g), int(r)), -1)
+            parches.append({'parametro': parametro, 'valor': valores[i], 'rgb': (int(r), int(g), int(b)), 'rect': rect})
+    return contenido, bbox_tabla, parches
+
+
+def construir_probeta(rgb: Tuple[int, int, int], ancho: int = ANCHO_CONTENIDO,
+                      alto: int = ALTO_CONTENIDO_PROBETA) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+    """
+    Contenido con una probeta vertical centrada entre los marcadores.
+
+    Returns:
+        (contenido BGR, rectángulo interior del líquido en el contenido)
+    """
+    contenido = np.full((alto, ancho, 3), COLOR_PAPEL, dtype=np.uint8)
+    ancho_tubo, alto_tubo = int(ancho * 0.12), int(alto * 0.7)
+    x0, y0 = (ancho - ancho_tubo) // 2, (alto - alto_tubo) // 2
+    grosor = max(2, ancho_tubo // 15)
+
+    # Líquido en los dos tercios inferiores, vidrio como contorno gris
+    y_liquido = y0 + alto_tubo // 3
+    r, g, b = rgb
+    cv2.rectangle(contenido, (x0, y_liquido), (x0 + ancho_tubo, y0 + alto_tubo), (int(b), int(g), int(r)), -1)
+    cv2.rectangle(contenido, (x0, y0), (x0 + ancho_tubo, y0 + alto_tubo), (150, 150, 150), grosor)
+    area_liquido = (x0 + grosor, y_liquido + grosor, ancho_tubo - 2 * grosor, y0 + alto_tubo - y_liquido - 2 * grosor)
+    return contenido, area_liquido
+
+
+def componer_hoja(contenido: np.ndarray, lado_marcador: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dibujar los marcadores en las esquinas del contenido y añadir margen blanco.
+
+    Returns:
+        (hoja BGR, esquinas exteriores de los marcadores en la hoja, orden ID3-ID0-ID2-ID1)
+    """
+    alto, ancho = contenido.shape[:2]
+    lado = lado_marcador or ancho // 10
+    diccionario = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    interior = contenido.copy()
+    posiciones = {3: (0, 0), 0: (ancho - lado, 0), 1: (0, alto - lado), 2: (ancho - lado, alto - lado)}
+    for id_, (x, y) in posiciones.items():
+        marcador = cv2.aruco.generateImageMarker(diccionario, id_, lado)
+        interior[y:y + lado, x:x + lado] = cv2.cvtColor(marcador, cv2.COLOR_GRAY2BGR)
+
+    margen = lado // 3
+    hoja = cv2.copyMakeBorder(interior, margen, margen, margen, margen, cv2.BORDER_CONSTANT, value=COLOR_PAPEL)
+    esquinas = np.float32([[margen, margen], [margen + ancho, margen],
+                           [margen + ancho, margen + alto], [margen, margen + alto]])
+    return hoja, esquinas
+
+
+def dimensiones_megapixeles(megapixeles: float) -> Tuple[int, int]:
+    """(ancho, alto) 4:3 con aproximadamente esos megapíxeles."""
+    ancho = int(round(np.sqrt(megapixeles * 1e6 * 4 / 3)))
+    return ancho, int(round(ancho * 3 / 4))
+
+
+def fotografiar(hoja: np.ndarray, esquinas_hoja: np.ndarray, megapixeles: float, rng: np.random.Generator,
+                perspectiva: float = 0.06, desenfoque: float = 0.0, ruido: float = 3.0,
+                ganancia_rgb: Tuple[float, float, float] = (1.0, 1.0, 1.0),
+                gradiente: float = 0.0, ocupacion: float = 0.8) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Proyectar la hoja en una foto con perspectiva, desenfoque, iluminación y ruido.
+
+    Args:
+        perspectiva: Desplazamiento máximo de cada esquina, en fracción del ancho de la hoja en la foto
+        desenfoque: Sigma del desenfoque gaussiano en px de la foto (0 = nítida)
+        ruido: Sigma del ruido gaussiano en niveles de gris
+        ganancia_rgb: Color de la luz (ganancia por canal R, G, B)
+        gradiente: Variación de intensidad de lado a lado (0.3 = ±15%)
+        ocupacion: Fracción del ancho de la foto que ocupa la hoja
+
+    Returns:
+        (foto BGR uint8, esquinas exteriores de los marcadores en la foto)
+    """
+    ancho, alto = dimensiones_megapixeles(megapixeles)
+    alto_hoja, ancho_hoja = hoja.shape[:2]
+    escala = min(ocupacion * ancho / ancho_hoja, ocupacion * alto / alto_hoja)
+    w, h = ancho_hoja * escala, alto_hoja * escala
+    x0, y0 = (ancho - w) / 2, (alto - h) / 2
+    destino = np.float32([[x0, y0], [x0 + w, y0], [x0 + w, y0 + h], [x0, y0 + h]])
+    destino += rng.uniform(-perspectiva, perspectiva, size=(4, 2)).astype(np.float32) * w
+    origen = np.float32([[0, 0], [ancho_hoja, 0], [ancho_hoja, alto_hoja], [0, alto_hoja]])
+    H = cv2.getPerspectiveTransform(origen, destino)
+
+    foto = cv2.warpPerspective(hoja, H, (ancho, alto), flags=cv2.INTER_LINEAR, borderValue=COLOR_FONDO)
+    esquinas = cv2.perspectiveTransform(esquinas_hoja.reshape(-1, 1, 2), H).reshape(-1, 2)
+
+    if desenfoque > 0:
+        cv2.GaussianBlur(foto, (0, 0), desenfoque, dst=foto)
+
+    # Iluminación (BGR) y ruido por franjas para no crear copias float de la foto completa
+    ganancia_bgr = np.array(ganancia_rgb[::-1], dtype=np.float32)
+    angulo = rng.uniform(0, 2 * np.pi)
+    dx, dy = np.cos(angulo) / ancho, np.sin(angulo) / alto
+    columnas = (np.arange(ancho, dtype=np.float32) - ancho / 2) * dx
+    for y_ini in range(0, alto, FILAS_FRANJA):
+        y_fin = min(alto, y_ini + FILAS_FRANJA)
+        filas = (np.arange(y_ini, y_fin, dtype=np.float32) - alto / 2) * dy
+        factor = 1.0 + gradiente * (filas[:, None] + columnas[None, :])
+        franja = foto[y_ini:y_fin].astype(np.float32)
+        franja *= factor[..., None] * ganancia_bgr
+        if ruido > 0:
+            franja += rng.standard_normal(franja.shape, dtype=np.float32) * ruido
+        np.clip(franja, 0, 255, out=franja)
+        foto[y_ini:y_fin] = franja.astype(np.uint8)
+
+    return foto, esquinas.astype(np.float32)
+
+
+def colores_aleatorios(rng: np.random.Generator) -> Callable[[str, int, float], Tuple[int, int, int]]:
+    """Colores de parche aleatorios (suficientemente saturados para el muestreo)."""
+    def color(parametro: str, indice: int, valor: float) -> Tuple[int, int, int]:
+        return tuple(int(c) for c in rng.integers(30, 226, size=3))
+    return color
+
+
+def generar_escena_tabla(megapixeles: float, rng: np.random.Generator,
+                         colores: Optional[Callable[[str, int, float], Tuple[int, int, int]]] = None,
+                         ruta_referencia: str = 'referencia2.jpg', **degradaciones) -> EscenaSintetica:
+    """Foto sintética de la tabla de colores con los 4 marcadores."""
+    contenido, bbox_tabla, parches = construir_tabla(colores or colores_aleatorios(rng), ruta_referencia)
+    hoja, esquinas_hoja = componer_hoja(contenido)
+    foto, esquinas = fotografiar(hoja, esquinas_hoja, megapixeles, rng, **degradaciones)
+    return EscenaSintetica(imagen=foto, esquinas=esquinas,
+                           tamano_contenido=(contenido.shape[1], contenido.shape[0]),
+                           bbox_tabla=bbox_tabla, parches=parches)
+
+
+def generar_escena_probeta(megapixeles: float, rng: np.random.Generator, rgb: Tuple[int, int, int],
+                           **degradaciones) -> EscenaSintetica:
+    """Foto sintética de una probeta con líquido del color dado y los 4 marcadores."""
+    contenido, area_liquido = construir_probeta(rgb)
+    hoja, esquinas_hoja = componer_hoja(contenido)
+    foto, esquinas = fotografiar(hoja, esquinas_hoja, megapixeles, rng, **degradaciones)
+    return EscenaSintetica(imagen=foto, esquinas=esquinas,
+                           tamano_contenido=(contenido.shape[1], contenido.shape[0]),
+                           area_liquido=area_liquido)
+
+
+def codificar_jpeg(img: np.ndarray, calidad: int = 90) -> bytes:
+    """Codificar como JPEG (lo que subiría el móvil)."""
+    ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, calidad])
+    if not ok:
+        raise ValueError("No se pudo codificar la escena")
+    return buffer.tobytes()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+🎯 Evaluación velocidad / precisión del pipeline sobre el dataset sintético
+Recorre las muestras de dataset_sintetico.py con una o varias configuraciones del
+pipeline (ajustes de TablaAPIDetector y de ExtractorProporcional) y, para cada una,
+informa de la tasa de detección, el error del color de los parches, el error del valor
+final frente al valor real y la latencia total y por etapa.
+
+Cada muestra recorre el mismo camino que el flujo del frontend: detección y
+rectificación de la tabla, extracción de colores, calibración compacta, rectificación
+de la probeta, color medio del área y clasificación (las mismas funciones que usa
+/analizar_probeta).
+
+Uso:
+    python evaluar_pipeline.py --dataset dataset_sintetico --salida evaluacion.json
+    python evaluar_pipeline.py --dataset dataset_sintetico --configuraciones configs.json
+
+configs.json: {"nombre": {"detector": {...kwargs}, "extractor": {...atributos}, "iluminacion": bool}, ...}
+
+Con normalización de iluminación (por defecto) los errores de color de parches y
+líquido se miden sobre los colores normalizados, que aproximan los impresos.
+"""
+
+import os
+import json
+import shutil
+import argparse
+import logging
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+import metricas
+from a2_detectar_aruco import TablaAPIDetector
+from b3_extractor import ExtractorProporcional
+from calibracion_compacta import CalibracionCompacta
+from iluminacion import EstimadorIluminacion, normalizar_colores
+from bench_pipeline import ColectorEtapas
+
+CONFIGURACIONES_POR_DEFECTO = {
+    'serie': {},
+    'sin_reintentos': {'detector': {'reintentos_paralelos': False, 'permitir_recuperacion': False}},
+    'sin_filtro_calidad': {'detector': {'filtrar_calidad': False}, 'extractor': {'filtrar_calidad': False}},
+    'muestreo_ligero': {'extractor': {'puntos_por_rectangulo': 3}},
+    'muestreo_denso': {'extractor': {'puntos_por_rectangulo': 9, 'radio_sampling': 0.4}},
+    'sin_normalizacion': {'iluminacion': False},
+    'de76': {'metrica': 'de76'},
+    'de94': {'metrica': 'de94'},
+    'ciede2000': {'metrica': 'ciede2000'}
+}
+
+
+class EvaluadorPipeline:
+    """Ejecuta el pipeline completo de una configuración sobre las muestras del dataset."""
+
+    def __init__(self, dataset: str, manifiesto: Dict, configuracion: Dict, directorio_trabajo: str,
+                 ruta_referencia: str = 'referencia2.jpg'):
+        """
+        Args:
+            dataset: Directorio con las fotos y el manifiesto
+            manifiesto: Contenido de manifiesto.json
+            configuracion: {'detector': kwargs de TablaAPIDetector, 'extractor': atributos de ExtractorProporcional,
+                'iluminacion': False para no normalizar, 'metrica': diferencia de color de la clasificación}
+            directorio_trabajo: Carpeta temporal para la tabla rectificada y los artefactos
+        """
+        self.dataset = dataset
+        self.manifiesto = manifiesto
+        self.ruta_referencia = ruta_referencia
+        self.directorio_trabajo = directorio_trabajo
+        self.ajustes_extractor = dict(configuracion.get('extractor', {}))
+        self.normalizar = configuracion.get('iluminacion', True)
+        self.metrica = configuracion.get('metrica', 'rgb')
+        self.estimador_iluminacion = EstimadorIluminacion()
+        ajustes_detector = configuracion.get('detector', {})
+        self.detector_tabla = TablaAPIDetector(*manifiesto['tamano_tabla'], **ajustes_detector)
+        self.detector_probeta = TablaAPIDetector(*manifiesto['tamano_probeta'], **ajustes_detector)
+        self.parches = {(p['parametro'], float(p['valor'])): p['rgb'] for p in manifiesto['parches']}
+
+    def _crear_extractor(self, ruta_tabla: str) -> ExtractorProporcional:
+        filtrar_calidad = self.ajustes_extractor.get('filtrar_calidad', True)
+        extractor = ExtractorProporcional(tabla_rectificada_path=ruta_tabla, referencia_path=self.ruta_referencia,
+                                          filtrar_calidad=filtrar_calidad)
+        for atributo, valor in self.ajustes_extractor.items():
+            setattr(extractor, atributo, valor)
+        return extractor
+
+    def evaluar_muestra(self, muestra: Dict, api) -> Dict:
+        """Pipeline completo de una muestra; devuelve la fase alcanzada y los errores."""
+        resultado = {'id': muestra['id'], 'parametro': muestra['parametro'], 'fase': 'tabla'}
+
+        tabla = self.detector_tabla.procesar_imagen(os.path.join(self.dataset, muestra['tabla']['archivo']))
+        if not tabla['exito']:
+            return resultado
+
+        resultado['fase'] = 'extraccion'
+        ruta_tabla = os.path.join(self.directorio_trabajo, 'tabla_rectificada.jpg')
+        cv2.imwrite(ruta_tabla, tabla['imagen_rectificada'])
+        extraccion = self._crear_extractor(ruta_tabla).procesar_extraccion_completa(
+            tuple(self.manifiesto['bbox_tabla']), self.directorio_trabajo)
+        if not extraccion['exito']:
+            return resultado
+
+        iluminacion_tabla = None
+        if self.normalizar:
+            iluminacion_tabla = self.estimador_iluminacion.estimar(tabla['imagen_rectificada'], 'tabla')
+        colores = extraccion['colores_extraidos']
+        if iluminacion_tabla is not None:
+            colores = normalizar_colores(colores, iluminacion_tabla)
+        errores_parches = [float(np.linalg.norm(np.subtract(c.color_rgb, self.parches[(c.parametro, float(c.valor))])))
+                           for c in colores if (c.parametro, float(c.valor)) in self.parches]
+        resultado['error_color_parches'] = float(np.mean(errores_parches)) if errores_parches else None
+        calibracion = CalibracionCompacta.desde_colores(extraccion['colores_extraidos'], iluminacion_tabla)
+
+        resultado['fase'] = 'probeta'
+        probeta = self.detector_probeta.procesar_imagen(os.path.join(self.dataset, muestra['probeta']['archivo']))
+        if not probeta['exito']:
+            return resultado
+
+        resultado['fase'] = 'clasificacion'
+        x, y, w, h = muestra['probeta']['area_muestra']
+        mean_bgr = cv2.mean(probeta['imagen_rectificada'][y:y + h, x:x + w])
+        color_rgb = (int(round(mean_bgr[2])), int(round(mean_bgr[1])), int(round(mean_bgr[0])))
+        if calibracion.normalizada:
+            iluminacion_probeta = self.estimador_iluminacion.estimar(probeta['imagen_rectificada'], 'probeta')
+            color_rgb, _ = api.normalizar_color_probeta(color_rgb, iluminacion_probeta, calibracion)
+        resultado['error_color_liquido'] = float(np.linalg.norm(np.subtract(color_rgb, muestra['rgb_liquido'])))
+
+        tipo_calibracion = api.resolver_tipo_calibracion(muestra['tipo_test'], calibracion.tipos())
+        if tipo_calibracion is None:
+            return resultado
+        analisis = api.clasificar_color(calibracion, tipo_calibracion, muestra['tipo_test'], color_rgb,
+                                        self.metrica)
+        if analisis is None:
+            return resultado
+
+        resultado['fase'] = 'completa'
+        resultado['valor_real'] = muestra['valor_real']
+        resultado['valor_final'] = analisis['valor_final']
+        resultado['error_valor'] = abs(analisis['valor_final'] - muestra['valor_real'])
+        return resultado
+
+
+def _percentil(datos: List[float], q: float):
+    return round(float(np.percentile(datos, q)), 4) if datos else None
+
+
+def _media(datos: List[float]):
+    return round(float(np.mean(datos)), 4) if datos else None
+
+
+def resumir_configuracion(resultados: List[Dict], latencias: List[tuple], rangos: Dict[str, float]) -> Dict:
+    """Tasas por fase, errores y latencias de una configuración."""
+    n = len(resultados)
+    orden = ['tabla', 'extraccion', 'probeta', 'clasificacion', 'completa']
+
+    def superan(fase):
+        return sum(orden.index(r['fase']) > orden.index(fase) for r in resultados) / n if n else 0.0
+
+    completas = [r for r in resultados if r['fase'] == 'completa']
+    errores = [r['error_valor'] for r in completas]
+    relativos = [r['error_valor'] / rangos[r['parametro']] for r in completas]
+    por_parametro = defaultdict(list)
+    for r in completas:
+        por_parametro[r['parametro']].append(r['error_valor'])
+    parches = [r['error_color_parches'] for r in resultados if r.get('error_color_parches') is not None]
+    liquido = [r['error_color_liquido'] for r in resultados if 'error_color_liquido' in r]
+    totales = [t for t, _ in latencias]
+    etapas = sorted({e for _, et in latencias for e in et})
+
+    return {
+        'muestras': n,
+        'tasa_deteccion_tabla': round(superan('tabla'), 4),
+        'tasa_extraccion': round(superan('extraccion'), 4),
+        'tasa_deteccion_probeta': round(superan('probeta'), 4),
+        'tasa_completas': round(len(completas) / n, 4) if n else 0.0,
+        'error_valor': {'media': _media(errores), 'mediana': _percentil(errores, 50), 'p95': _percentil(errores, 95)},
+        'error_relativo_rango': {'media': _media(relativos), 'p95': _percentil(relativos, 95)},
+        'error_valor_por_parametro': {p: _media(v) for p, v in sorted(por_parametro.items())},
+        'error_color_parches_rgb': {'media': _media(parches), 'p95': _percentil(parches, 95)},
+        'error_color_liquido_rgb': {'media': _media(liquido), 'p95': _percentil(liquido, 95)},
+        'latencia_ms': {'media': _media(totales), 'mediana': _percentil(totales, 50), 'p95': _percentil(totales, 95)},
+        'etapas_ms': {e: round(float(np.median([et.get(e, 0.0) for _, et in latencias])), 2) for e in etapas}
+    }
+
+
+def main():
+    """Función principal de la evaluación."""
+    parser = argparse.ArgumentParser(description="Evaluación velocidad / precisión sobre el dataset sintético")
+    parser.add_argument('--dataset', default='dataset_sintetico', help="Directorio generado por dataset_sintetico.py")
+    parser.add_argument('--configuraciones', default=None, help="JSON con las configuraciones a comparar")
+    parser.add_argument('--solo', nargs='+', default=None, help="Evaluar solo estas configuraciones")
+    parser.add_argument('--referencia', default='referencia2.jpg')
+    parser.add_argument('--salida', default='evaluacion_pipeline.json')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.dataset, 'manifiesto.json'), encoding='utf-8') as f:
+        manifiesto = json.load(f)
+    configuraciones = CONFIGURACIONES_POR_DEFECTO
+    if args.configuraciones:
+        with open(args.configuraciones, encoding='utf-8') as f:
+            configuraciones = json.load(f)
+    if args.solo:
+        configuraciones = {k: v for k, v in configuraciones.items() if k in args.solo}
+
+    # Los logs INFO por muestra distorsionan los tiempos
+    logging.disable(logging.INFO)
+    import pipeline_probetas as api
+
+    colector = ColectorEtapas()
+    metricas.registrar_oyente(colector)
+    parametros_config = ExtractorProporcional(referencia_path=args.referencia).parametros_config
+    rangos = {p: float(max(c['valores']) - min(c['valores'])) for p, c in parametros_config.items()}
+
+    directorio = tempfile.mkdtemp(prefix='evaluacion_probetas_')
+    informe = {}
+    try:
+        for nombre, configuracion in configuraciones.items():
+            evaluador = EvaluadorPipeline(args.dataset, manifiesto, configuracion, directorio, args.referencia)
+            resultados, latencias = [], []
+            for muestra in manifiesto['muestras']:
+                r, total, etapas = colector.medir(lambda: evaluador.evaluar_muestra(muestra, api))
+                resultados.append(r)
+                latencias.append((total, etapas))
+            informe[nombre] = {'configuracion': configuracion,
+                               'resumen': resumir_configuracion(resultados, latencias, rangos),
+                               'muestras': resultados}
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    print(f"\n{'configuración':<20} {'detección':>9} {'completas':>9} {'err. medio':>10} {'err. rel.':>9} "
+          f"{'ΔRGB parches':>12} {'ms media':>9} {'ms p95':>9}")
+    for nombre, datos in informe.items():
+        r = datos['resumen']
+        error = r['error_valor']['media']
+        relativo = r['error_relativo_rango']['media']
+        parches = r['error_color_parches_rgb']['media']
+        print(f"{nombre:<20} {r['tasa_deteccion_tabla']:>9.0%} {r['tasa_completas']:>9.0%} "
+              f"{error if error is not None else float('nan'):>10.3f} "
+              f"{relativo if relativo is not None else float('nan'):>9.1%} "
+              f"{parches if parches is not None else float('nan'):>12.1f} "
+              f"{r['latencia_ms']['media']:>9.1f} {r['latencia_ms']['p95']:>9.1f}")
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'fecha': datetime.now().isoformat(timespec='seconds'),
+                   'dataset': os.path.abspath(args.dataset), 'megapixeles': manifiesto['megapixeles'],
+                   'configuraciones': informe}, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+📸 Fusión de ráfagas: varias fotos de la misma escena en una imagen rectificada
+Cada frame se rectifica con la homografía ArUco, se descartan los desalineados y se
+fusionan con media o mediana por píxel para reducir ruido del sensor y artefactos JPEG.
+"""
+
+import cv2
+import numpy as np
+import logging
+from typing import Dict, List, Optional
+
+from a2_detectar_aruco import TablaAPIDetector
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+METODOS_FUSION = ('mediana', 'media')
+
+
+class FusionadorRafaga:
+    """
+    Acumulador de frames rectificados.
+
+    Los frames a resolución completa se procesan de uno en uno y solo se conserva su
+    versión rectificada (target_width x target_height): la media usa un acumulador
+    float32 y la mediana una pila acotada por max_frames.
+    """
+
+    def __init__(self, detector: TablaAPIDetector, metodo: str = 'mediana',
+                 max_frames: int = 8, desplazamiento_max_px: float = 2.0):
+        """
+        Inicializar fusionador.
+
+        Args:
+            detector: Detector usado para rectificar cada frame
+            metodo: 'mediana' o 'media'
+            max_frames: Número máximo de frames aceptados
+            desplazamiento_max_px: Desalineación máxima respecto al primer frame aceptado
+        """
+        if metodo not in METODOS_FUSION:
+            raise ValueError(f"Método de fusión desconocido: {metodo}")
+        self.detector = detector
+        self.metodo = metodo
+        self.max_frames = max_frames
+        self.desplazamiento_max_px = desplazamiento_max_px
+
+        self.referencia_gray = None
+        self.acumulador = None
+        self.pila: List[np.ndarray] = []
+        self.aceptados = 0
+        self.rechazados: List[Dict] = []
+        self.imagen_marcadores = None
+
+    def registrar_rechazo(self, indice: int, motivo: str) -> bool:
+        """Anotar un frame descartado."""
+        logger.info(f"📸 Frame {indice} descartado: {motivo}")
+        self.rechazados.append({'frame': indice, 'motivo': motivo})
+        return False
+
+    def agregar(self, img: np.ndarray, indice: int = 0) -> bool:
+        """
+        Rectificar y acumular un frame.
+
+        Returns:
+            True si el frame se ha aceptado
+        """
+        if self.aceptados >= self.max_frames:
+            return self.registrar_rechazo(indice, "límite de frames alcanzado")
+
+        if self.detector.filtrar_calidad:
+            calidad = self.detector.evaluador_calidad.evaluar(img)
+            if not calidad['apta']:
+                return self.registrar_rechazo(indice, calidad['mensaje'])
+
+        marcadores, exito, mensaje = self.detector.detectar_marcadores(img)
+        if not exito:
+            return self.registrar_rechazo(indice, mensaje.split('\n')[0])
+
+        rectificada, _ = self.detector.rectificar_tabla(img, self.detector.extraer_puntos_esquinas(marcadores))
+        if rectificada is None:
+            return self.registrar_rechazo(indice, "error en rectificación")
+
+        gray = cv2.cvtColor(rectificada, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        if self.referencia_gray is None:
+            self.referencia_gray = gray
+            # Imagen de marcadores solo del primer frame aceptado
+            corners = [marcadores[id_]['corners'].reshape(1, -1, 2) for id_ in sorted(marcadores.keys())]
+            ids = np.array([[id_] for id_ in sorted(marcadores.keys())])
+            self.imagen_marcadores = cv2.aruco.drawDetectedMarkers(img.copy(), corners, ids)
+        else:
+            (dx, dy), _ = cv2.phaseCorrelate(self.referencia_gray, gray)
+            desplazamiento = float(np.hypot(dx, dy))
+            if desplazamiento > self.desplazamiento_max_px:
+                return self.registrar_rechazo(indice, f"desalineado {desplazamiento:.1f} px")
+
+        if self.metodo == 'media':
+            if self.acumulador is None:
+                self.acumulador = np.zeros(rectificada.shape, dtype=np.float32)
+            cv2.accumulate(rectificada, self.acumulador)
+        else:
+            self.pila.append(rectificada)
+
+        self.aceptados += 1
+        return True
+
+    def resultado(self) -> Optional[np.ndarray]:
+        """Imagen rectificada fusionada (None si no se aceptó ningún frame)."""
+        if self.aceptados == 0:
+            return None
+        if self.metodo == 'media':
+            return np.clip(self.acumulador / self.aceptados + 0.5, 0, 255).astype(np.uint8)
+        # Con un número par de frames la mediana es la media de dos: redondear, no truncar
+        return np.rint(np.median(np.stack(self.pila), axis=0)).astype(np.uint8)
+
+    def estadisticas(self) -> Dict:
+        """Resumen de frames aceptados y rechazados."""
+        return {
+            'metodo': self.metodo,
+            'aceptados': self.aceptados,
+            'rechazados': len(self.rechazados),
+            'motivos_rechazo': self.rechazados
+        }
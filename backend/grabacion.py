@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+🎙️ Grabación de tráfico real para pruebas de regresión
+Guarda una muestra de las peticiones del flujo (imágenes, bbox, área, tipo_test), la
+respuesta resumida y los tiempos por etapa en archivos zip locales, para reproducirlas
+contra una versión nueva con reproducir_grabacion.py.
+
+- El muestreo se decide por usuario (hash del user_code): se graba el flujo completo de
+  un técnico, así extraer_colores y analizar_probeta se pueden reproducir juntos.
+- Anonimización: el user_code se sustituye por un seudónimo con sal, y de las imágenes se
+  eliminan sin recomprimir los metadatos: en JPEG los segmentos APPn y COM (Exif/GPS, XMP,
+  IPTC, ICC, MPF) y todo lo que va tras el EOI (imágenes añadidas de profundidad, mapas de
+  ganancia...), conservando solo la orientación; en PNG los bloques auxiliares de texto,
+  eXIf, iCCP y tIME; en WebP los bloques EXIF, XMP e ICCP. Las imágenes en otros formatos
+  o con una estructura que no se sabe recorrer no se graban.
+- Las imágenes de la respuesta se resumen (dimensiones, color medio y hash).
+- Un zip por proceso; al llegar al tamaño máximo del directorio se deja de grabar.
+"""
+
+import os
+import json
+import base64
+import hashlib
+import zipfile
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from flask import request
+
+import metricas
+from ingesta import LONGITUD_MIN_IMAGEN
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ENDPOINTS_GRABADOS = ('detectar_aruco', 'extraer_colores', 'rectificar_probeta', 'analizar_probeta')
+
+# Segmentos JPEG que se conservan de entre los APPn/COM: APP0 (JFIF) y APP14 (Adobe, transformación
+# de color). El resto (APP1 Exif/XMP, APP2 ICC/MPF, APP13 IPTC, COM...) se descarta
+SEGMENTOS_JPEG_CONSERVADOS = {0xE0, 0xEE}
+TAG_ORIENTACION = 0x0112
+
+FIRMA_PNG = b'\x89PNG\r\n\x1a\n'
+# Bloques PNG que se conservan: los críticos y los auxiliares de color sin texto libre
+BLOQUES_PNG_CONSERVADOS = {b'IHDR', b'PLTE', b'IDAT', b'IEND', b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'sBIT'}
+
+# Bloques WebP que se conservan (se descartan EXIF, XMP e ICCP) y bits de VP8X que los anuncian
+BLOQUES_WEBP_CONSERVADOS = {b'VP8 ', b'VP8L', b'VP8X', b'ALPH', b'ANIM', b'ANMF'}
+FLAGS_VP8X_METADATOS = 0x20 | 0x08 | 0x04  # ICC, Exif, XMP
+
+GRABACIONES = metricas.contador('probetas_grabaciones_total', 'Peticiones grabadas para reproducción', ('resultado',))
+
+
+def _orientacion_exif(segmento: bytes) -> Optional[int]:
+    """Valor de Orientation del IFD0 de un segmento APP1 Exif (None si no hay)."""
+    cuerpo = segmento[4:]
+    if not cuerpo.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = cuerpo[6:]
+    orden = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+    if orden is None or len(tiff) < 8:
+        return None
+    ifd = int.from_bytes(tiff[4:8], orden)
+    if ifd + 2 > len(tiff):
+        return None
+    for k in range(int.from_bytes(tiff[ifd:ifd + 2], orden)):
+        entrada = ifd + 2 + 12 * k
+        if entrada + 12 > len(tiff):
+            break
+        if int.from_bytes(tiff[entrada:entrada + 2], orden) == TAG_ORIENTACION:
+            return int.from_bytes(tiff[entrada + 8:entrada + 10], orden)
+    return None
+
+
+def _app1_orientacion(valor: int) -> bytes:
+    """Segmento APP1 Exif mínimo con solo la orientación."""
+    tiff = (b'MM\x00\x2a' + (8).to_bytes(4, 'big') + (1).to_bytes(2, 'big')
+            + TAG_ORIENTACION.to_bytes(2, 'big') + (3).to_bytes(2, 'big') + (1).to_bytes(4, 'big')
+            + valor.to_bytes(2, 'big') + b'\x00\x00' + (0).to_bytes(4, 'big'))
+    cuerpo = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + (len(cuerpo) + 2).to_bytes(2, 'big') + cuerpo
+
+
+def _fin_datos_comprimidos(datos: bytes, i: int) -> Optional[int]:
+    """Posición del primer marcador tras los datos comprimidos de un scan (None si no termina)."""
+    while True:
+        i = datos.find(b'\xff', i)
+        if i < 0 or i + 1 >= len(datos):
+            return None
+        siguiente = datos[i + 1]
+        if siguiente == 0xFF:  # Relleno antes del marcador
+            i += 1
+        elif siguiente == 0x00 or 0xD0 <= siguiente <= 0xD7:  # Byte 0xFF escapado o RSTn
+            i += 2
+        else:
+            return i
+
+
+def limpiar_metadatos_jpeg(datos: bytes) -> Optional[bytes]:
+    """
+    Quitar metadatos de un JPEG sin tocar los datos de imagen.
+
+    Se recorren todos los scans (JPEG progresivos incluidos) y se corta en el primer EOI:
+    lo que va detrás (imágenes MPF, de profundidad o mapas de ganancia con su propio Exif)
+    no se copia. La orientación Exif se conserva (cv2.imdecode la aplica). Si la estructura
+    no es la esperada se devuelve None para no guardar un archivo que no se ha podido limpiar.
+    """
+    if datos[:3] != b'\xff\xd8\xff':
+        return None
+    salida = bytearray(datos[:2])
+    i = 2
+    while i + 2 <= len(datos):
+        if datos[i] != 0xFF:
+            return None
+        marcador = datos[i + 1]
+        if marcador == 0xFF:  # Relleno
+            i += 1
+            continue
+        if marcador == 0xD9:  # EOI
+            salida += b'\xff\xd9'
+            return bytes(salida)
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD7:  # Sin longitud
+            salida += datos[i:i + 2]
+            i += 2
+            continue
+        if i + 4 > len(datos):
+            return None
+        longitud = int.from_bytes(datos[i + 2:i + 4], 'big')
+        fin = i + 2 + longitud
+        if longitud < 2 or fin > len(datos):
+            return None
+        if marcador == 0xDA:  # SOS: cabecera y datos comprimidos hasta el siguiente marcador
+            fin = _fin_datos_comprimidos(datos, fin)
+            if fin is None:
+                return None
+            salida += datos[i:fin]
+        elif (0xE0 <= marcador <= 0xEF or marcador == 0xFE) and marcador not in SEGMENTOS_JPEG_CONSERVADOS:
+            orientacion = _orientacion_exif(datos[i:fin]) if marcador == 0xE1 else None
+            if orientacion not in (None, 1):
+                salida += _app1_orientacion(orientacion)
+        else:
+            salida += datos[i:fin]
+        i = fin
+    return None
+
+
+def limpiar_metadatos_png(datos: bytes) -> Optional[bytes]:
+    """Quitar de un PNG los bloques auxiliares con metadatos y lo que haya tras IEND (None si no se puede)."""
+    if datos[:8] != FIRMA_PNG:
+        return None
+    salida = bytearray(FIRMA_PNG)
+    i = 8
+    while i + 12 <= len(datos):
+        longitud = int.from_bytes(datos[i:i + 4], 'big')
+        tipo = datos[i + 4:i + 8]
+        fin = i + 12 + longitud  # longitud, tipo, datos y CRC
+        if fin > len(datos):
+            return None
+        if tipo in BLOQUES_PNG_CONSERVADOS:
+            salida += datos[i:fin]
+        if tipo == b'IEND':
+            return bytes(salida)
+        i = fin
+    return None
+
+
+def limpiar_metadatos_webp(datos: bytes) -> Optional[bytes]:
+    """Quitar de un WebP los bloques EXIF, XMP e ICCP y sus bits en VP8X (None si no se puede)."""
+    if datos[:4] != b'RIFF' or datos[8:12] != b'WEBP':
+        return None
+    fin_riff = 8 + int.from_bytes(datos[4:8], 'little')
+    if fin_riff > len(datos):
+        return None
+    cuerpo = bytearray()
+    imagen = False
+    i = 12
+    while i + 8 <= fin_riff:
+        tipo = datos[i:i + 4]
+        longitud = int.from_bytes(datos[i + 4:i + 8], 'little')
+        if i + 8 + longitud > fin_riff:
+            return None
+        fin = min(fin_riff, i + 8 + longitud + (longitud & 1))  # Bloques alineados a 2 bytes
+        if tipo == b'VP8X':
+            if longitud < 10:
+                return None
+            bloque = bytearray(datos[i:fin])
+            bloque[8] &= ~FLAGS_VP8X_METADATOS & 0xFF
+            cuerpo += bloque
+        elif tipo in BLOQUES_WEBP_CONSERVADOS:
+            cuerpo += datos[i:fin]
+            imagen = imagen or tipo in (b'VP8 ', b'VP8L', b'ANMF')
+        i = fin
+    if not imagen:
+        return None
+    return b'RIFF' + (4 + len(cuerpo)).to_bytes(4, 'little') + b'WEBP' + bytes(cuerpo)
+
+
+def limpiar_metadatos(datos: bytes) -> Optional[Tuple[bytes, str]]:
+    """
+    (imagen sin metadatos, extensión) según los bytes mágicos; None si el formato no es
+    JPEG, PNG ni WebP o su estructura no se ha podido recorrer.
+    """
+    if datos[:3] == b'\xff\xd8\xff':
+        limpios, extension = limpiar_metadatos_jpeg(datos), '.jpg'
+    elif datos[:8] == FIRMA_PNG:
+        limpios, extension = limpiar_metadatos_png(datos), '.png'
+    elif datos[:4] == b'RIFF' and datos[8:12] == b'WEBP':
+        limpios, extension = limpiar_metadatos_webp(datos), '.webp'
+    else:
+        return None
+    return (limpios, extension) if limpios is not None else None
+
+
+def resumen_imagen(imagen_b64: str) -> Dict:
+    """Dimensiones, color RGB medio y hash de una imagen base64 de la respuesta."""
+    datos = base64.b64decode(imagen_b64.split(',')[-1])
+    resumen = {'sha256': hashlib.sha256(datos).hexdigest()[:16]}
+    img = cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_COLOR)
+    if img is not None:
+        b, g, r, _ = cv2.mean(img)
+        resumen.update({'ancho': int(img.shape[1]), 'alto': int(img.shape[0]),
+                        'rgb_medio': [round(r, 2), round(g, 2), round(b, 2)]})
+    return {'imagen': resumen}
+
+
+def resumir_respuesta(valor):
+    """Respuesta JSON con las imágenes sustituidas por su resumen."""
+    if isinstance(valor, str) and len(valor) > LONGITUD_MIN_IMAGEN:
+        return resumen_imagen(valor)
+    if isinstance(valor, dict):
+        return {k: resumir_respuesta(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [resumir_respuesta(v) for v in valor]
+    return valor
+
+
+# Campos que cambian entre ejecuciones sin que cambie el resultado
+CAMPOS_IGNORADOS = {'tiempo_ms', 'expira_en'}
+
+
+def comparar_respuestas(grabada, nueva, tolerancia_valor: float = 1e-6, tolerancia_rgb: float = 2.0,
+                        ruta: str = '') -> List[Dict]:
+    """Diferencias entre dos respuestas resumidas: [{'campo', 'grabado', 'nuevo'}]."""
+    if isinstance(grabada, dict) and 'imagen' in grabada and isinstance(nueva, dict) and 'imagen' in nueva:
+        a, b = grabada['imagen'], nueva['imagen']
+        if (a.get('ancho'), a.get('alto')) != (b.get('ancho'), b.get('alto')):
+            return [{'campo': f'{ruta}.dimensiones', 'grabado': [a.get('ancho'), a.get('alto')],
+                     'nuevo': [b.get('ancho'), b.get('alto')]}]
+        if a.get('rgb_medio') and b.get('rgb_medio') and \
+                max(abs(x - y) for x, y in zip(a['rgb_medio'], b['rgb_medio'])) > tolerancia_rgb:
+            return [{'campo': f'{ruta}.rgb_medio', 'grabado': a['rgb_medio'], 'nuevo': b['rgb_medio']}]
+        return []
+    if isinstance(grabada, dict) and isinstance(nueva, dict):
+        diferencias = []
+        for clave in sorted(set(grabada) | set(nueva)):
+            if clave in CAMPOS_IGNORADOS:
+                continue
+            if clave not in grabada or clave not in nueva:
+                diferencias.append({'campo': f'{ruta}.{clave}', 'grabado': grabada.get(clave), 'nuevo': nueva.get(clave)})
+                continue
+            diferencias += comparar_respuestas(grabada[clave], nueva[clave], tolerancia_valor, tolerancia_rgb,
+                                               f'{ruta}.{clave}')
+        return diferencias
+    if isinstance(grabada, list) and isinstance(nueva, list) and len(grabada) == len(nueva):
+        diferencias = []
+        for i, (a, b) in enumerate(zip(grabada, nueva)):
+            diferencias += comparar_respuestas(a, b, tolerancia_valor, tolerancia_rgb, f'{ruta}[{i}]')
+        return diferencias
+    numeros = (int, float)
+    if isinstance(grabada, numeros) and isinstance(nueva, numeros) \
+            and not isinstance(grabada, bool) and not isinstance(nueva, bool):
+        if abs(grabada - nueva) <= tolerancia_valor * max(1.0, abs(grabada)):
+            return []
+    elif grabada == nueva:
+        return []
+    return [{'campo': ruta or '.', 'grabado': grabada, 'nuevo': nueva}]
+
+
+class Grabador:
+    """Grabación muestreada de peticiones y respuestas en zip locales."""
+
+    def __init__(self, directorio: str, muestreo: float = 0.0, max_mb: float = 500.0,
+                 sal: Optional[str] = None, endpoints: Tuple[str, ...] = ENDPOINTS_GRABADOS):
+        """
+        Args:
+            directorio: Carpeta de los archivos de grabación
+            muestreo: Fracción de usuarios grabados (0 desactiva)
+            max_mb: Tamaño máximo del directorio; al alcanzarlo se deja de grabar
+            sal: Sal de los seudónimos (por defecto se genera y guarda en el directorio)
+            endpoints: Endpoints grabados
+        """
+        self.directorio = directorio
+        self.muestreo = muestreo
+        self.max_bytes = int(max_mb * 2**20)
+        self.endpoints = set(endpoints)
+        self._sal = sal.encode() if sal else None
+        self._lock = threading.Lock()
+        self._archivo = None
+        self._contador = 0
+        self._limite_avisado = False
+
+    @property
+    def activo(self) -> bool:
+        return self.muestreo > 0
+
+    def _obtener_sal(self) -> bytes:
+        """Sal compartida por los workers y estable entre reinicios (archivo .sal del directorio)."""
+        if self._sal is None:
+            ruta = os.path.join(self.directorio, '.sal')
+            try:
+                with open(ruta, 'xb') as f:
+                    f.write(os.urandom(16).hex().encode())
+            except FileExistsError:
+                pass
+            with open(ruta, 'rb') as f:
+                self._sal = f.read().strip()
+        return self._sal
+
+    def seudonimo(self, user_code: str) -> str:
+        return 'anon_' + hashlib.blake2b(user_code.encode(), key=self._obtener_sal(), digest_size=6).hexdigest()
+
+    def seleccionado(self, user_code: str) -> bool:
+        """Decisión estable por usuario: todas sus peticiones o ninguna."""
+        if self.muestreo >= 1:
+            return True
+        resumen = hashlib.blake2b(user_code.encode(), key=self._obtener_sal(), digest_size=8).digest()
+        return int.from_bytes(resumen, 'big') / 2**64 < self.muestreo
+
+    def _bytes_usados(self) -> int:
+        return sum(entrada.stat().st_size for entrada in os.scandir(self.directorio)
+                   if entrada.name.endswith('.zip'))
+
+    def grabar(self, respuesta, traza=None):
+        """Grabar la petición actual de Flask y su respuesta si entra en la muestra."""
+        if not self.activo or request.method != 'POST' or request.endpoint not in self.endpoints:
+            return
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'user_code' not in data:
+            return
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            user_code = str(data['user_code'])
+            if not self.seleccionado(user_code):
+                return
+            self._guardar(data, user_code, respuesta, traza)
+        except Exception as e:
+            GRABACIONES.inc(resultado='error')
+            logger.warning(f"No se pudo grabar la petición a {request.path}: {e}")
+
+    def _separar_imagenes(self, data: Dict, id_registro: str) -> Tuple[Dict, Dict, Dict[str, bytes]]:
+        """(parámetros sin imágenes, referencias a las imágenes, archivos a escribir)."""
+        parametros, imagenes, archivos = {}, {}, {}
+
+        def guardar_imagen(valor: str, nombre: str) -> Dict:
+            prefijo, _, contenido = valor.rpartition(',')
+            limpia = limpiar_metadatos(base64.b64decode(contenido))
+            if limpia is None:
+                raise ValueError(f"Imagen en {nombre} sin metadatos eliminables (formato o estructura); no se graba")
+            datos, extension = limpia
+            archivo = f"{id_registro}_{nombre}{extension}"
+            archivos[archivo] = datos
+            return {'archivo': archivo, 'prefijo': prefijo + ',' if prefijo else ''}
+
+        for clave, valor in data.items():
+            if clave == 'user_code':
+                continue
+            if isinstance(valor, str) and len(valor) > LONGITUD_MIN_IMAGEN:
+                imagenes[clave] = guardar_imagen(valor, clave)
+            elif isinstance(valor, list) and valor and all(isinstance(v, str) and len(v) > LONGITUD_MIN_IMAGEN
+                                                            for v in valor):
+                imagenes[clave] = [guardar_imagen(v, f"{clave}_{k}") for k, v in enumerate(valor)]
+            else:
+                parametros[clave] = valor
+        return parametros, imagenes, archivos
+
+    def _guardar(self, data: Dict, user_code: str, respuesta, traza):
+        with self._lock:
+            self._contador += 1
+            contador = self._contador
+        id_registro = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_{contador:06d}"
+        parametros, imagenes, archivos = self._separar_imagenes(data, id_registro)
+        registro = {
+            'id': id_registro,
+            'fecha': datetime.now().isoformat(timespec='milliseconds'),
+            'endpoint': request.endpoint,
+            'ruta': request.path,
+            'usuario': self.seudonimo(user_code),
+            'parametros': parametros,
+            'imagenes': imagenes,
+            'codigo': respuesta.status_code,
+            'respuesta': resumir_respuesta(respuesta.get_json(silent=True)),
+            'duracion_ms': round(traza.duracion() * 1000, 2) if traza is not None else None,
+            'etapas_ms': {n: round(d * 1000, 2) for n, (d, _) in traza.agregados().items()} if traza is not None else {}
+        }
+        contenido = json.dumps(registro, ensure_ascii=False).encode()
+        tamano = len(contenido) + sum(len(d) for d in archivos.values())
+
+        with self._lock:
+            if self._bytes_usados() + tamano > self.max_bytes:
+                GRABACIONES.inc(resultado='limite')
+                if not self._limite_avisado:
+                    logger.warning(f"🎙️ Grabación detenida: {self.directorio} alcanzó {self.max_bytes / 2**20:.0f} MB")
+                    self._limite_avisado = True
+                return
+            if self._archivo is None:
+                self._archivo = os.path.join(self.directorio,
+                                             f"grabacion_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.zip")
+            # Abrir y cerrar en cada registro: el zip queda válido aunque el worker muera
+            with zipfile.ZipFile(self._archivo, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+                for nombre, datos in archivos.items():
+                    zf.writestr(nombre, datos, compress_type=zipfile.ZIP_STORED)
+                zf.writestr(f"{id_registro}.json", contenido)
+        GRABACIONES.inc(resultado='grabada')
+
+
+def leer_registros(rutas: List[str]) -> List[Tuple[Dict, Dict[str, bytes]]]:
+    """Registros de los zip (o directorios de zip) ordenados por id: [(registro, archivos)]."""
+    zips = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            zips += sorted(os.path.join(ruta, n) for n in os.listdir(ruta) if n.endswith('.zip'))
+        else:
+            zips.append(ruta)
+    registros = []
+    for ruta in zips:
+        with zipfile.ZipFile(ruta) as zf:
+            for nombre in zf.namelist():
+                if not nombre.endswith('.json'):
+                    continue
+                registro = json.loads(zf.read(nombre))
+                referencias = []
+                for ref in registro['imagenes'].values():
+                    referencias += ref if isinstance(ref, list) else [ref]
+                registros.append((registro, {r['archivo']: zf.read(r['archivo']) for r in referencias}))
+    registros.sort(key=lambda r: r[0]['fecha'])
+    return registros
+
+
+def reconstruir_payload(registro: Dict, archivos: Dict[str, bytes]) -> Dict:
+    """Cuerpo JSON de la petición grabada (con el seudónimo como user_code)."""
+    def data_url(ref: Dict) -> str:
+        return ref['prefijo'] + base64.b64encode(archivos[ref['archivo']]).decode()
+
+    payload = dict(registro['parametros'])
+    payload['user_code'] = registro['usuario']
+    for clave, ref in registro['imagenes'].items():
+        payload[clave] = [data_url(r) for r in ref] if isinstance(ref, list) else data_url(ref)
+    return payload
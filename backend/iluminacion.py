@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+💡 Normalización de iluminación con los marcadores ArUco como referencia neutra
+Las imágenes rectificadas (tabla y probeta) llevan los 4 marcadores en las esquinas:
+el borde de cada marcador es negro y sus bits a 1 son el blanco del papel. Se detectan
+en la imagen rectificada (con un margen blanco añadido, porque tocan el borde), se
+muestrea el centro de cada celda y la mediana de las celdas negras y blancas de todos
+los marcadores da los neutros de la foto.
+
+Con ellos, cada canal se lleva por una transformación afín a negro = 0 y blanco = 255
+(balance de blancos + exposición + nivel de negro): los colores de la tabla y el del
+líquido dejan de depender de la luz de cada foto y se pueden comparar entre fotos
+tomadas en momentos distintos.
+"""
+
+import logging
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import metricas
+from metricas import etapa
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Celdas por lado de un marcador 4x4 con borde de 1 celda
+CELDAS_MARCADOR = 6
+PX_CELDA = 8
+MARGEN_DETECCION = 12
+
+# Contraste mínimo blanco - negro (por canal) para fiarse de los neutros
+CONTRASTE_MIN = 40.0
+
+# Blanco a partir del cual el canal está saturado y su ganancia real no se puede medir
+BLANCO_SATURADO = 250.0
+
+# Deriva entre los neutros de la calibración y los de la probeta a partir de la cual la
+# normalización deja de ser fiable: desviación cromática (log del cociente de cromaticidades)
+# y cambio de exposición (log del cociente de luminancias del blanco)
+DERIVA_CROMATICA_MAX = 0.25
+DERIVA_EXPOSICION_MAX = 1.1
+
+NORMALIZACIONES = metricas.contador('probetas_normalizacion_iluminacion_total',
+                                    'Estimaciones de neutros por imagen rectificada', ('imagen', 'resultado'))
+
+
+@dataclass
+class Iluminacion:
+    """Neutros (RGB medio de las celdas negras y blancas de los marcadores) de una foto."""
+    negro: Tuple[float, float, float]
+    blanco: Tuple[float, float, float]
+    marcadores: int
+
+    def normalizar(self, rgb: np.ndarray) -> np.ndarray:
+        """Colores RGB (..., 3) a la escala normalizada (float, sin recortar)."""
+        negro = np.asarray(self.negro, dtype=np.float64)
+        blanco = np.asarray(self.blanco, dtype=np.float64)
+        return (np.asarray(rgb, dtype=np.float64) - negro) * (255.0 / (blanco - negro))
+
+    def normalizar_rgb(self, rgb: Tuple[int, int, int]) -> Tuple[int, int, int]:
+        """Un color RGB normalizado y recortado a 0-255."""
+        r, g, b = np.clip(np.round(self.normalizar(rgb)), 0, 255).astype(int)
+        return (int(r), int(g), int(b))
+
+    def deriva(self, otra: 'Iluminacion') -> Dict[str, float]:
+        """Cambio de color de la luz y de exposición entre esta foto y otra."""
+        blanco = np.asarray(self.blanco, dtype=np.float64)
+        blanco_otra = np.asarray(otra.blanco, dtype=np.float64)
+        cromatica = np.log((blanco_otra / blanco_otra.mean()) / (blanco / blanco.mean()))
+        return {
+            'cromatica': round(float(np.abs(cromatica).max()), 4),
+            'exposicion': round(float(abs(np.log(blanco_otra.mean() / blanco.mean()))), 4)
+        }
+
+    def a_dict(self) -> Dict:
+        return {'negro': [round(float(c), 2) for c in self.negro],
+                'blanco': [round(float(c), 2) for c in self.blanco],
+                'marcadores': self.marcadores}
+
+    @classmethod
+    def desde_dict(cls, datos: Dict) -> 'Iluminacion':
+        return cls(tuple(datos['negro']), tuple(datos['blanco']), int(datos['marcadores']))
+
+    def huella(self) -> str:
+        return repr(sorted(self.a_dict().items()))
+
+
+def deriva_excesiva(deriva: Dict[str, float]) -> bool:
+    """La luz cambió tanto que la normalización ya no garantiza colores comparables."""
+    return deriva['cromatica'] > DERIVA_CROMATICA_MAX or deriva['exposicion'] > DERIVA_EXPOSICION_MAX
+
+
+class EstimadorIluminacion:
+    """Neutros de una imagen rectificada a partir de sus marcadores ArUco."""
+
+    def __init__(self):
+        self.aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+        self.detector = cv2.aruco.ArucoDetector(self.aruco_dict, cv2.aruco.DetectorParameters())
+        self.ids_esperados = (0, 1, 2, 3)
+        lado = CELDAS_MARCADOR * PX_CELDA
+        self.destino = np.float32([[0, 0], [lado, 0], [lado, lado], [0, lado]])
+        # Patrón de celdas de cada ID (True = blanco), borde incluido
+        self.patrones = {id_: cv2.aruco.generateImageMarker(self.aruco_dict, id_, CELDAS_MARCADOR) > 127
+                         for id_ in self.ids_esperados}
+
+    def _muestrear_celdas(self, img: np.ndarray, esquinas: np.ndarray) -> np.ndarray:
+        """Color BGR medio del centro de cada celda (6 x 6 x 3)."""
+        lado = CELDAS_MARCADOR * PX_CELDA
+        M = cv2.getPerspectiveTransform(esquinas.astype(np.float32), self.destino)
+        canonico = cv2.warpPerspective(img, M, (lado, lado), flags=cv2.INTER_AREA)
+        # Mitad central de cada celda: evita las transiciones entre celdas
+        inicio, fin = PX_CELDA // 4, PX_CELDA - PX_CELDA // 4
+        celdas = canonico.reshape(CELDAS_MARCADOR, PX_CELDA, CELDAS_MARCADOR, PX_CELDA, 3)
+        return celdas[:, inicio:fin, :, inicio:fin].mean(axis=(1, 3))
+
+    def estimar(self, img: np.ndarray, imagen: str = 'rectificada') -> Optional[Iluminacion]:
+        """
+        Neutros de una imagen rectificada (BGR).
+
+        Args:
+            img: Imagen rectificada con los marcadores en las esquinas
+            imagen: Etiqueta de la métrica ('tabla', 'probeta')
+
+        Returns:
+            Iluminacion, o None si no hay marcadores legibles o el contraste no basta
+        """
+        with etapa('neutros_iluminacion'):
+            ampliada = cv2.copyMakeBorder(img, MARGEN_DETECCION, MARGEN_DETECCION, MARGEN_DETECCION,
+                                          MARGEN_DETECCION, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+            corners, ids, _ = self.detector.detectMarkers(ampliada)
+            negros: List[np.ndarray] = []
+            blancos: List[np.ndarray] = []
+            vistos = set()
+            for esquinas, id_ in zip(corners, ids.flatten() if ids is not None else []):
+                id_ = int(id_)
+                if id_ not in self.patrones or id_ in vistos:
+                    continue
+                vistos.add(id_)
+                celdas = self._muestrear_celdas(ampliada, esquinas.reshape(4, 2))
+                patron = self.patrones[id_]
+                negros.append(celdas[~patron])
+                blancos.append(celdas[patron])
+
+        if not vistos:
+            NORMALIZACIONES.inc(imagen=imagen, resultado='sin_marcadores')
+            return None
+        # Mediana de todas las celdas: robusta a una celda con reflejo o sombra
+        negro_bgr = np.median(np.concatenate(negros), axis=0)
+        blanco_bgr = np.median(np.concatenate(blancos), axis=0)
+        if np.min(blanco_bgr - negro_bgr) < CONTRASTE_MIN:
+            NORMALIZACIONES.inc(imagen=imagen, resultado='sin_contraste')
+            logger.warning(f"💡 Neutros con poco contraste en {imagen}: negro {negro_bgr.round(1)} blanco {blanco_bgr.round(1)}")
+            return None
+        if np.max(blanco_bgr) >= BLANCO_SATURADO:
+            # Se normaliza igual, pero el canal saturado queda sobreestimado
+            NORMALIZACIONES.inc(imagen=imagen, resultado='saturada')
+            logger.warning(f"💡 Blanco saturado en {imagen}: {blanco_bgr[::-1].round(1)} (RGB); foto sobreexpuesta")
+        else:
+            NORMALIZACIONES.inc(imagen=imagen, resultado='ok')
+        return Iluminacion(tuple(float(c) for c in negro_bgr[::-1]), tuple(float(c) for c in blanco_bgr[::-1]),
+                           len(vistos))
+
+
+def normalizar_colores(colores: List, iluminacion: Iluminacion) -> List:
+    """ColorInfo de la extracción con rgb, bgr y lab normalizados (copias)."""
+    if not colores:
+        return []
+    rgb = np.array([c.color_rgb for c in colores], dtype=np.float64)
+    normalizados = np.clip(np.round(iluminacion.normalizar(rgb)), 0, 255).astype(np.uint8)
+    bgr = np.ascontiguousarray(normalizados[:, ::-1]).reshape(-1, 1, 3)
+    lab = cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB).reshape(-1, 3)
+    return [replace(c, color_rgb=tuple(int(v) for v in n), color_bgr=tuple(int(v) for v in n[::-1]),
+                    color_lab=tuple(float(v) for v in l))
+            for c, n, l in zip(colores, normalizados, lab)]
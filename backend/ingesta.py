@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+🛡️ Guardia de ingesta de imágenes
+Antes de decodificar nada se lee solo la cabecera de cada imagen (decodificando el
+principio del base64): formato por los bytes mágicos y dimensiones por la cabecera
+JPEG (SOFn), PNG (IHDR), WebP (VP8/VP8L/VP8X) o BMP. Con eso:
+
+- se rechazan formatos desconocidos y fotos por encima del máximo de megapíxeles;
+- los JPEG grandes se decodifican reducidos (IMREAD_REDUCED_COLOR_2/4/8, la reducción
+  la hace libjpeg al decodificar, sin pasar por la imagen completa);
+- cada petición reserva su memoria estimada de un presupuesto por proceso y espera si
+  otras peticiones grandes lo tienen ocupado (varias fotos de 48 MP a la vez no tumban
+  el worker). Las listas de imágenes (ráfagas) se decodifican de una en una: cuentan la
+  mayor de ellas más lo que se conserva de cada frame.
+"""
+
+import base64
+import binascii
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import metricas
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Cadenas más largas que esto en el JSON se consideran imágenes base64
+LONGITUD_MIN_IMAGEN = 1000
+
+# Copias de trabajo por imagen decodificada (BGR, gris, rectificada, imagen de marcadores...)
+FACTOR_TRABAJO = 4
+
+FLAGS_REDUCCION = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                   4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Marcadores SOFn de JPEG (todos los C0-CF salvo DHT, JPG y DAC)
+MARCADORES_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+LIMITES_MEMORIA = (1e6, 4e6, 1.6e7, 3.2e7, 6.4e7, 1.28e8, 2.56e8, 5.12e8, 1.024e9, 2.048e9)
+
+INGESTA = metricas.contador('probetas_ingesta_imagenes_total', 'Imágenes revisadas antes de decodificar', ('resultado',))
+MEMORIA_PETICION = metricas.histograma('probetas_memoria_estimada_bytes', 'Memoria estimada reservada por petición',
+                                       limites=LIMITES_MEMORIA)
+
+
+class ImagenRechazada(Exception):
+    """Imagen que no se decodifica (formato desconocido, demasiado grande o sin memoria)."""
+
+    def __init__(self, mensaje: str, codigo: int = 413):
+        super().__init__(mensaje)
+        self.codigo = codigo
+
+
+@dataclass
+class Sonda:
+    """Formato y dimensiones leídos de la cabecera."""
+    formato: str
+    ancho: int
+    alto: int
+
+    @property
+    def megapixeles(self) -> float:
+        return self.ancho * self.alto / 1e6
+
+
+def _sondear_jpeg(datos: bytes) -> Tuple[Optional[Sonda], bool]:
+    i = 2
+    while i + 4 <= len(datos):
+        if datos[i] != 0xFF:
+            return None, False
+        marcador = datos[i + 1]
+        if marcador == 0xFF:  # Relleno
+            i += 1
+            continue
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD7:  # Sin longitud
+            i += 2
+            continue
+        if marcador in MARCADORES_SOF:
+            if i + 9 > len(datos):
+                return None, True
+            alto = int.from_bytes(datos[i + 5:i + 7], 'big')
+            ancho = int.from_bytes(datos[i + 7:i + 9], 'big')
+            return Sonda('jpeg', ancho, alto), False
+        if marcador == 0xDA:  # Datos de imagen sin SOF antes: inválido
+            return None, False
+        i += 2 + int.from_bytes(datos[i + 2:i + 4], 'big')
+    return None, True
+
+
+def _sondear_webp(datos: bytes) -> Tuple[Optional[Sonda], bool]:
+    if len(datos) < 30:
+        return None, True
+    bloque = datos[12:16]
+    if bloque == b'VP8X':
+        return Sonda('webp', int.from_bytes(datos[24:27], 'little') + 1, int.from_bytes(datos[27:30], 'little') + 1), False
+    if bloque == b'VP8 ':
+        return Sonda('webp', int.from_bytes(datos[26:28], 'little') & 0x3FFF,
+                     int.from_bytes(datos[28:30], 'little') & 0x3FFF), False
+    if bloque == b'VP8L':
+        bits = int.from_bytes(datos[21:25], 'little')
+        return Sonda('webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1), False
+    return None, False
+
+
+def sondear(datos: bytes) -> Tuple[Optional[Sonda], bool]:
+    """
+    Formato y dimensiones a partir de los primeros bytes.
+
+    Returns:
+        (sonda o None si el formato no se reconoce, True si faltan bytes para decidir)
+    """
+    if datos[:3] == b'\xff\xd8\xff':
+        return _sondear_jpeg(datos)
+    if datos[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(datos) < 24:
+            return None, True
+        return Sonda('png', int.from_bytes(datos[16:20], 'big'), int.from_bytes(datos[20:24], 'big')), False
+    if datos[:4] == b'RIFF' and datos[8:12] == b'WEBP':
+        return _sondear_webp(datos)
+    if datos[:2] == b'BM':
+        if len(datos) < 26:
+            return None, True
+        return Sonda('bmp', abs(int.from_bytes(datos[18:22], 'little', signed=True)),
+                     abs(int.from_bytes(datos[22:26], 'little', signed=True))), False
+    return None, len(datos) < 12
+
+
+def sondear_base64(cadena: str, bloque: int = 65536) -> Optional[Sonda]:
+    """Sondear una imagen base64 (con o sin prefijo data:) decodificando solo su principio."""
+    inicio = cadena.find(',') + 1
+    while True:
+        fin = min(len(cadena), inicio + bloque)
+        trozo = cadena[inicio:fin]
+        if fin < len(cadena):
+            trozo = trozo[:len(trozo) // 4 * 4]
+        try:
+            datos = base64.b64decode(trozo)
+        except (binascii.Error, ValueError):
+            return None
+        sonda, incompleto = sondear(datos)
+        if not incompleto or fin >= len(cadena):
+            return sonda
+        bloque *= 4
+
+
+class GuardiaIngesta:
+    """Límites de tamaño, reducción al decodificar y presupuesto de memoria por proceso."""
+
+    def __init__(self, max_megapixeles: float = 64.0, megapixeles_reduccion: float = 16.0,
+                 presupuesto_bytes: int = 1024 * 2**20, espera_s: float = 15.0, bytes_frame_rafaga: int = 0):
+        """
+        Args:
+            max_megapixeles: Por encima se rechaza la imagen (413)
+            megapixeles_reduccion: Los JPEG por encima se decodifican reducidos a 1/2, 1/4 o 1/8
+            presupuesto_bytes: Memoria estimada máxima de las peticiones en curso del proceso
+            espera_s: Tiempo máximo esperando presupuesto antes de responder 503
+            bytes_frame_rafaga: Memoria que se conserva por frame de una lista de imágenes
+                (versión rectificada en la pila de fusión)
+        """
+        self.max_megapixeles = max_megapixeles
+        self.megapixeles_reduccion = megapixeles_reduccion
+        self.presupuesto_bytes = presupuesto_bytes
+        self.espera_s = espera_s
+        self.bytes_frame_rafaga = bytes_frame_rafaga
+        self.en_uso = 0
+        self._condicion = threading.Condition()
+
+    def plan(self, sonda: Optional[Sonda]) -> Tuple[int, int]:
+        """(factor de reducción, bytes estimados) para una imagen; lanza ImagenRechazada."""
+        if sonda is None:
+            INGESTA.inc(resultado='formato_desconocido')
+            raise ImagenRechazada('Formato de imagen no reconocido (se admite JPEG, PNG, WebP o BMP)', 415)
+        if sonda.megapixeles > self.max_megapixeles:
+            INGESTA.inc(resultado='demasiado_grande')
+            raise ImagenRechazada(f'Imagen de {sonda.ancho}x{sonda.alto} ({sonda.megapixeles:.0f} MP): '
+                                  f'el máximo es {self.max_megapixeles:g} MP')
+        factor = 1
+        if sonda.formato == 'jpeg':
+            while factor < 8 and sonda.megapixeles / factor**2 > self.megapixeles_reduccion:
+                factor *= 2
+        return factor, (sonda.ancho // factor) * (sonda.alto // factor) * 3 * FACTOR_TRABAJO
+
+    def revisar(self, data: Optional[Dict], bytes_cuerpo: int = 0) -> int:
+        """
+        Sondear todas las imágenes base64 de una petición JSON.
+
+        Returns:
+            Memoria estimada de la petición (0 si no trae imágenes)
+        """
+        if not isinstance(data, dict):
+            return 0
+        sueltas, listas = [], []
+        for valor in data.values():
+            if isinstance(valor, str) and len(valor) > LONGITUD_MIN_IMAGEN:
+                sueltas.append(valor)
+            elif isinstance(valor, list):
+                lista = [v for v in valor if isinstance(v, str) and len(v) > LONGITUD_MIN_IMAGEN]
+                if lista:
+                    listas.append(lista)
+        if not sueltas and not listas:
+            return 0
+
+        # Cuerpo recibido + base64 decodificado ya ocupan memoria aparte de los píxeles
+        total = 2 * bytes_cuerpo
+        for cadena in sueltas:
+            total += self._estimar(cadena)
+        # Los frames de una ráfaga se decodifican de uno en uno: solo el mayor a la vez, más lo
+        # que se conserva de cada uno hasta la fusión
+        for lista in listas:
+            total += max(self._estimar(cadena) for cadena in lista) + len(lista) * self.bytes_frame_rafaga
+        if total > self.presupuesto_bytes:
+            INGESTA.inc(resultado='sin_presupuesto')
+            raise ImagenRechazada(f'La petición necesita ~{total / 2**20:.0f} MB para decodificar sus imágenes; '
+                                  f'el máximo es {self.presupuesto_bytes / 2**20:.0f} MB')
+        return total
+
+    def _estimar(self, cadena: str) -> int:
+        factor, estimados = self.plan(sondear_base64(cadena))
+        INGESTA.inc(resultado='reducida' if factor > 1 else 'aceptada')
+        return estimados
+
+    def reservar(self, cantidad: int) -> bool:
+        """Esperar hasta que haya presupuesto para la petición (False si se agota la espera)."""
+        with self._condicion:
+            if not self._condicion.wait_for(lambda: self.en_uso + cantidad <= self.presupuesto_bytes,
+                                            timeout=self.espera_s):
+                INGESTA.inc(resultado='espera_agotada')
+                return False
+            self.en_uso += cantidad
+        MEMORIA_PETICION.observar(cantidad)
+        return True
+
+    def liberar(self, cantidad: int):
+        with self._condicion:
+            self.en_uso = max(0, self.en_uso - cantidad)
+            self._condicion.notify_all()
+
+    def decodificar(self, datos: bytes) -> Optional[np.ndarray]:
+        """imdecode con la reducción que corresponda a las dimensiones de la cabecera."""
+        sonda, _ = sondear(datos)
+        factor, _ = self.plan(sonda)
+        if factor > 1:
+            logger.info(f"🛡️ {sonda.ancho}x{sonda.alto} decodificada a 1/{factor}")
+        return cv2.imdecode(np.frombuffer(datos, np.uint8), FLAGS_REDUCCION[factor])
@@ -3,21 +3,44 @@
 API Flask para análisis de probetas con OpenCV
 """
 
-from flask import Flask, request, jsonify
-from typing import Tuple
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
+from functools import wraps
 import cv2
-import numpy as np
 import base64
+import hashlib
 import os
 from datetime import datetime, timedelta
 import json
+import time
+import threading
 import logging
 
 # Importar tus scripts adaptados
-from a2_detectar_aruco import TablaAPIDetector
-from b3_extractor import ExtractorProporcional
+from a2_detectar_aruco import TablaAPIDetector, cargar_perfil_parametros
 from c2_analizar import CalibradorManual, SelectorManualProbeta
+from seguimiento_marcadores import SeguidorMarcadores
+from fusion_rafaga import FusionadorRafaga, METODOS_FUSION
+from cache_resultados import CacheResultados, VuelosUnicos
+from pipeline import EtapaFallida
+from pipeline_probetas import crear_pipeline, TAMANO_TABLA, TAMANO_PROBETA
+import metricas
+import trazas
+from perfilado import Perfilador
+from grabacion import Grabador
+from ingesta import GuardiaIngesta, ImagenRechazada
+from memoria_worker import VigilanteMemoria, rss_actual
+from almacen_calibraciones import AlmacenCalibraciones
+from iluminacion import deriva_excesiva
+from diferencia_color import METRICAS
+from plantillas_kits import DIRECTORIO_PLANTILLAS, KIT_POR_DEFECTO, KitDesconocido, RegistroPlantillas
+from metricas import etapa
+
+# WebSocket opcional para la guía de captura en vivo
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 import tempfile
 
@@ -33,40 +56,294 @@ app = Flask(__name__)
 # ✅ CORS CORREGIDO - PERMITE TODO
 CORS(app)
 
+sock = Sock(app) if Sock is not None else None
+if sock is None:
+    logger.warning("flask-sock no instalado: /stream_aruco deshabilitado")
+
+@app.before_request
+def before_request():
+    g.inicio_peticion = time.perf_counter()
+    g.memoria_worker = vigilante_memoria.inicio()
+    trazas.iniciar()
+    
+    # Guardia de ingesta: cabeceras de las imágenes antes de decodificar nada
+    if request.method == 'POST' and request.is_json:
+        try:
+            with etapa('ingesta'):
+                memoria = guardia_ingesta.revisar(request.get_json(silent=True), request.content_length or 0)
+        except ImagenRechazada as e:
+            logger.warning(f"Imagen rechazada en {request.path}: {e}")
+            return jsonify({'exito': False, 'mensaje': str(e)}), e.codigo
+        if memoria:
+            if not guardia_ingesta.reservar(memoria):
+                return jsonify({'exito': False, 'mensaje': 'Servidor ocupado procesando otras imágenes; reintenta en unos segundos'}), 503
+            g.memoria_reservada = memoria
+
+@app.teardown_request
+def teardown_request(_error):
+    memoria = g.pop('memoria_reservada', 0)
+    if memoria:
+        guardia_ingesta.liberar(memoria)
+    vigilante_memoria.fin(request.endpoint or 'desconocido', g.pop('memoria_worker', None),
+                          request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'))
+
+@app.errorhandler(413)
+def peticion_demasiado_grande(_error):
+    return jsonify({
+        'exito': False,
+        'mensaje': f"Petición de más de {app.config['MAX_CONTENT_LENGTH'] / 2**20:.0f} MB"
+    }), 413
+
 @app.after_request
 def after_request(response):
+    registrar_metricas_peticion(response)
+    traza = trazas.terminar()
+    if traza is not None:
+        response.headers['Server-Timing'] = traza.server_timing()
+        response.headers['Timing-Allow-Origin'] = '*'
+        response.headers['Access-Control-Expose-Headers'] = 'Server-Timing'
+        escritor_trazas.escribir(traza, endpoint=request.endpoint, metodo=request.method,
+                                 codigo=response.status_code, bytes_entrada=request.content_length,
+                                 bytes_salida=response.content_length)
+    grabador.grabar(response, traza)
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Idempotency-Key')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
-# Almacenamiento temporal de calibraciones (en memoria)
+# Calibraciones activas en memoria (con copia en el almacén persistente)
 calibraciones_activas = {}
 
+# Los hilos de gunicorn (gthread) comparten calibraciones_activas y rigs_activos
+lock_estado = threading.Lock()
+
+# Modo rig fijo: última detección válida por (usuario, paso) para reutilizar su homografía
+rigs_activos = {}
+
 # Tiempo de expiración de calibración: 2 horas
 EXPIRACION_CALIBRACION = timedelta(hours=2)
 
+# Calibraciones normalizadas por iluminación: válidas más tiempo, con comprobación de deriva
+# de la luz pasadas las 2 horas
+EXPIRACION_CALIBRACION_NORMALIZADA = timedelta(hours=float(os.environ.get('EXPIRACION_NORMALIZADA_H', '24')))
+
+# Presupuesto de la cascada de reintentos ArUco (ms)
+PRESUPUESTO_REINTENTOS_ARUCO_MS = float(os.environ.get('ARUCO_PRESUPUESTO_MS', '1500'))
+
+# Máximo de frames aceptados por ráfaga
+MAX_FRAMES_RAFAGA = 8
+
+# Guía en vivo: cada sesión ocupa un hilo del worker mientras dura, así que se limitan las
+# simultáneas (el resto de hilos quedan para los endpoints HTTP) y se cierran las inactivas.
+# Capacidad por instancia = workers × STREAM_MAX_SESIONES (2 × 2 con el Procfile); para más
+# sesiones hay que subir a la vez --threads y STREAM_MAX_SESIONES
+MAX_SESIONES_STREAM = int(os.environ.get('STREAM_MAX_SESIONES', '2'))
+INACTIVIDAD_STREAM_S = float(os.environ.get('STREAM_INACTIVIDAD_S', '30'))
+sesiones_stream = threading.BoundedSemaphore(MAX_SESIONES_STREAM)
+
+# Perfil de DetectorParameters generado offline con autotune_aruco.py (si existe)
+PERFIL_ARUCO = cargar_perfil_parametros(os.environ.get('ARUCO_PERFIL', 'perfil_aruco.json'))
+
+# Plantillas de las tablas de cada kit (construir_plantillas.py); se cargan al pedir su kit_id
+registro_plantillas = RegistroPlantillas(os.environ.get('PLANTILLAS_DIR', DIRECTORIO_PLANTILLAS))
+
+# Instantáneas de calibraciones en SQLite: sobreviven a reinicios y se comparten entre workers
+almacen_calibraciones = AlmacenCalibraciones(os.environ.get('CALIBRACIONES_DB', os.path.join(TEMP_DIR, 'calibraciones_probetas.sqlite3')))
+calibraciones_activas.update(almacen_calibraciones.cargar_vigentes(datetime.now()))
+
+# Caché de resultados por contenido para reenvíos y dobles pulsaciones
+cache_resultados = CacheResultados(
+    max_bytes=int(float(os.environ.get('CACHE_RESULTADOS_MB', '64')) * 2**20),
+    max_entradas=int(os.environ.get('CACHE_RESULTADOS_ENTRADAS', '256'))
+)
+
+# Peticiones idénticas concurrentes (doble pulsación, reintento de red): un solo cálculo
+vuelos_unicos = VuelosUnicos(ttl_s=float(os.environ.get('IDEMPOTENCIA_TTL_S', '30')),
+                             max_bytes=int(float(os.environ.get('IDEMPOTENCIA_MB', '16')) * 2**20))
+
+# Métricas por endpoint (las etapas internas y motivos de fallo se definen en metricas.py)
+PETICIONES = metricas.contador('probetas_peticiones_total', 'Peticiones HTTP por endpoint y código', ('endpoint', 'codigo'))
+LATENCIA_PETICION = metricas.histograma('probetas_peticion_segundos', 'Latencia de las peticiones por endpoint', ('endpoint',))
+PAYLOAD_ENTRADA = metricas.histograma('probetas_payload_entrada_bytes', 'Tamaño del cuerpo recibido',
+                                      ('endpoint',), metricas.LIMITES_BYTES)
+PAYLOAD_SALIDA = metricas.histograma('probetas_payload_salida_bytes', 'Tamaño del cuerpo enviado',
+                                     ('endpoint',), metricas.LIMITES_BYTES)
+ANALISIS_CALIBRACION_EXTENDIDA = metricas.contador('probetas_analisis_calibracion_extendida_total',
+                                                   'Análisis con una calibración normalizada de más de 2 horas')
+RECHAZOS_DERIVA = metricas.contador('probetas_rechazos_deriva_iluminacion_total',
+                                    'Análisis rechazados por cambio de luz respecto a una calibración de más de 2 horas')
+metricas.medidor('probetas_calibraciones_activas', 'Calibraciones en memoria', lambda: len(calibraciones_activas))
+metricas.medidor('probetas_rigs_activos', 'Detecciones guardadas para modo rig fijo', lambda: len(rigs_activos))
+metricas.medidor('probetas_cache_aciertos_total', 'Aciertos de la caché de resultados',
+                 lambda: cache_resultados.aciertos, tipo='counter')
+metricas.medidor('probetas_cache_fallos_total', 'Fallos de la caché de resultados',
+                 lambda: cache_resultados.fallos, tipo='counter')
+metricas.medidor('probetas_cache_tasa_aciertos', 'Aciertos / consultas de la caché de resultados',
+                 lambda: cache_resultados.estadisticas()['tasa_aciertos'])
+metricas.medidor('probetas_cache_bytes', 'Memoria aproximada de la caché de resultados',
+                 lambda: cache_resultados.bytes_usados)
+metricas.medidor('probetas_idempotencia_bytes', 'Memoria aproximada de las respuestas conservadas para duplicados',
+                 lambda: vuelos_unicos.bytes_usados)
+metricas.medidor('probetas_duplicados_compartidos_total', 'Peticiones duplicadas servidas sin recalcular',
+                 lambda: vuelos_unicos.compartidos + vuelos_unicos.repetidos, tipo='counter')
+
+# Trazas JSONL muestreadas para análisis offline (desactivadas si no hay archivo)
+escritor_trazas = trazas.EscritorTrazas(os.environ.get('TRAZAS_ARCHIVO'),
+                                        float(os.environ.get('TRAZAS_MUESTREO', '0.1')))
+
+# Perfilado bajo demanda (cabecera X-Perfilar con PERFILADO_TOKEN o muestreo); sin configurar no añade nada
+perfilador = Perfilador(os.environ.get('PERFILADO_DIR', os.path.join(TEMP_DIR, 'perfiles_probetas')),
+                        token=os.environ.get('PERFILADO_TOKEN'),
+                        muestreo=float(os.environ.get('PERFILADO_MUESTREO', '0')))
+
+# Grabación anonimizada de una muestra de usuarios para reproducir con reproducir_grabacion.py
+grabador = Grabador(os.environ.get('GRABACION_DIR', os.path.join(TEMP_DIR, 'grabaciones_probetas')),
+                    muestreo=float(os.environ.get('GRABACION_MUESTREO', '0')),
+                    max_mb=float(os.environ.get('GRABACION_MAX_MB', '500')),
+                    sal=os.environ.get('GRABACION_SAL'))
+
+# Ingesta: tamaño máximo del cuerpo, megapíxeles y presupuesto de memoria de las decodificaciones en curso
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_PETICION_MB', '64')) * 2**20)
+guardia_ingesta = GuardiaIngesta(
+    max_megapixeles=float(os.environ.get('MAX_MEGAPIXELES', '64')),
+    megapixeles_reduccion=float(os.environ.get('MEGAPIXELES_REDUCCION', '16')),
+    presupuesto_bytes=int(float(os.environ.get('PRESUPUESTO_MEMORIA_MB', '1024')) * 2**20),
+    espera_s=float(os.environ.get('ESPERA_MEMORIA_S', '15')),
+    # Por frame de ráfaga: rectificada en la pila de la mediana y su copia en np.stack
+    bytes_frame_rafaga=max(ancho * alto for ancho, alto in (TAMANO_TABLA, TAMANO_PROBETA)) * 3 * 2
+)
+metricas.medidor('probetas_memoria_reservada_bytes', 'Memoria estimada reservada por las peticiones en curso',
+                 lambda: guardia_ingesta.en_uso)
+metricas.medidor('probetas_memoria_presupuesto_bytes', 'Presupuesto de memoria de las peticiones en curso',
+                 lambda: guardia_ingesta.presupuesto_bytes)
+
+# RSS del worker: pico por endpoint, malloc_trim en reposo y reciclaje ordenado por encima de RSS_MAX_MB
+vigilante_memoria = VigilanteMemoria(
+    rss_max_bytes=int(float(os.environ.get('RSS_MAX_MB', '0')) * 2**20),
+    recorte_min_bytes=int(float(os.environ.get('RECORTE_MIN_MB', '32')) * 2**20)
+)
+metricas.medidor('probetas_rss_bytes', 'RSS actual del worker', rss_actual)
+
+
+def registrar_metricas_peticion(response):
+    """Cuenta la petición y observa su latencia y tamaños"""
+    endpoint = request.endpoint or 'desconocido'
+    PETICIONES.inc(endpoint=endpoint, codigo=response.status_code)
+    inicio = g.get('inicio_peticion')
+    if inicio is not None:
+        LATENCIA_PETICION.observar(time.perf_counter() - inicio, endpoint=endpoint)
+    if request.content_length:
+        PAYLOAD_ENTRADA.observar(request.content_length, endpoint=endpoint)
+    if response.content_length is not None:
+        PAYLOAD_SALIDA.observar(response.content_length, endpoint=endpoint)
+
 def limpiar_calibraciones_expiradas():
     """Elimina calibraciones que expiraron"""
     ahora = datetime.now()
-    usuarios_expirados = [
-        user for user, data in calibraciones_activas.items()
-        if data['expires'] < ahora
-    ]
+    with lock_estado:
+        usuarios_expirados = [
+            user for user, data in list(calibraciones_activas.items())
+            if data['expires'] < ahora
+        ]
+        for user in usuarios_expirados:
+            calibraciones_activas.pop(user, None)
     for user in usuarios_expirados:
-        del calibraciones_activas[user]
         logger.info(f"Calibración expirada eliminada: {user}")
 
+def activar_calibracion(user_code, calibracion):
+    """Guarda la calibración del usuario con su expiración (más larga si está normalizada)"""
+    limpiar_calibraciones_expiradas()
+    ahora = datetime.now()
+    expiracion = EXPIRACION_CALIBRACION_NORMALIZADA if calibracion.normalizada else EXPIRACION_CALIBRACION
+    with lock_estado:
+        calibraciones_activas[user_code] = {
+            'calibracion': calibracion,
+            'timestamp': ahora,
+            'expires': ahora + expiracion
+        }
+    almacen_calibraciones.borrar_expiradas(ahora)
+    almacen_calibraciones.guardar(user_code, calibracion, ahora, ahora + expiracion)
+    return expiracion
+
+def obtener_calibracion(user_code):
+    """Calibración vigente del usuario; la del almacén si es más reciente (otro worker) o no hay en memoria"""
+    limpiar_calibraciones_expiradas()
+    actual = calibraciones_activas.get(user_code)
+    guardada = almacen_calibraciones.obtener(user_code, datetime.now(),
+                                             actual['timestamp'] if actual is not None else None)
+    if guardada is not None:
+        with lock_estado:
+            calibraciones_activas[user_code] = guardada
+        logger.info(f"[{user_code}] Calibración recuperada del almacén")
+        return guardada
+    return actual
+
+def obtener_rig(user_code, paso):
+    """Devuelve la última detección del usuario para el paso dado si no ha expirado"""
+    clave = (user_code, paso)
+    rig = rigs_activos.get(clave)
+    if rig is None:
+        return None
+    if rig['expires'] < datetime.now():
+        with lock_estado:
+            rigs_activos.pop(clave, None)
+        return None
+    return rig['rig']
+
+def guardar_rig(user_code, paso, rig):
+    """Guarda la detección para reutilizarla en la siguiente foto del mismo soporte"""
+    ahora = datetime.now()
+    with lock_estado:
+        for clave in [c for c, r in list(rigs_activos.items()) if r['expires'] < ahora]:
+            rigs_activos.pop(clave, None)
+        rigs_activos[(user_code, paso)] = {'rig': rig, 'expires': ahora + EXPIRACION_CALIBRACION}
+
+def deduplicar(vista):
+    """Comparte la respuesta entre peticiones duplicadas en curso o recientes.
+    La clave es la cabecera Idempotency-Key del usuario o, si no viene, un hash del cuerpo;
+    reutilizar una Idempotency-Key con otro cuerpo responde 422."""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        huella_cuerpo = hashlib.blake2b(request.path.encode() + request.get_data(), digest_size=16).hexdigest()
+        clave_idempotencia = request.headers.get('Idempotency-Key')
+        if clave_idempotencia:
+            datos = request.get_json(silent=True)
+            user_code = datos.get('user_code') if isinstance(datos, dict) else None
+            clave = f"{request.path}:{user_code}:{clave_idempotencia}"
+        else:
+            clave = huella_cuerpo
+        
+        def calcular():
+            respuesta = app.make_response(vista(*args, **kwargs))
+            cabeceras = [(k, v) for k, v in respuesta.headers if k not in ('Content-Type', 'Content-Length')]
+            return respuesta.get_data(), respuesta.status_code, respuesta.mimetype, cabeceras, huella_cuerpo
+        
+        # Los errores del servidor no se conservan: un reintento posterior vuelve a calcular
+        (cuerpo, estado, mimetype, cabeceras, huella_original), origen = vuelos_unicos.ejecutar(
+            clave, calcular, conservar=lambda r: r[1] < 500)
+        if huella_original != huella_cuerpo:
+            logger.warning(f"Idempotency-Key reutilizada con otro cuerpo en {request.path}")
+            return jsonify({'exito': False,
+                            'mensaje': 'Idempotency-Key ya usada con otra petición'}), 422
+        if origen != 'calculado':
+            logger.info(f"Petición duplicada en {request.path}: respuesta {origen}")
+        return Response(cuerpo, status=estado, mimetype=mimetype, headers=cabeceras)
+    return envoltura
+
 def base64_to_image(base64_string):
     """Convierte string base64 a imagen OpenCV"""
     try:
         if ',' in base64_string:
             base64_string = base64_string.split(',')[1]
         
-        img_data = base64.b64decode(base64_string)
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with etapa('decodificar_base64'):
+            img_data = base64.b64decode(base64_string)
+        with etapa('imdecode'):
+            img = guardia_ingesta.decodificar(img_data)
         return img
+    except ImagenRechazada as e:
+        logger.warning(f"Imagen rechazada: {e}")
+        return None
     except Exception as e:
         logger.error(f"Error convirtiendo base64 a imagen: {e}")
         return None
@@ -74,13 +351,70 @@ def base64_to_image(base64_string):
 def image_to_base64(img):
     """Convierte imagen OpenCV a string base64"""
     try:
-        _, buffer = cv2.imencode('.jpg', img)
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
+        with etapa('imencode'):
+            _, buffer = cv2.imencode('.jpg', img)
+        with etapa('codificar_base64'):
+            img_base64 = base64.b64encode(buffer).decode('utf-8')
         return f"data:image/jpeg;base64,{img_base64}"
     except Exception as e:
         logger.error(f"Error convirtiendo imagen a base64: {e}")
         return None
 
+def crear_detector(tamano):
+    """Detector ArUco con el perfil y el presupuesto de reintentos del servidor"""
+    return TablaAPIDetector(target_width=tamano[0], target_height=tamano[1],
+                            presupuesto_reintentos_ms=PRESUPUESTO_REINTENTOS_ARUCO_MS,
+                            perfil_parametros=PERFIL_ARUCO)
+
+# Preflight: un solo detector para todas las peticiones; la detección en miniatura y los
+# evaluadores de calidad no guardan estado por petición, así se crean una vez por worker
+detector_preflight = TablaAPIDetector()
+
+# Grafo de etapas A2 → B3 → C2: los intermedios se guardan en la caché de resultados por huella
+# de sus entradas, así que un reenvío o un reanálisis solo recalcula lo que ha cambiado
+pipeline = crear_pipeline(cache_resultados, decodificar=base64_to_image, codificar=image_to_base64,
+                          crear_detector=crear_detector, registro_plantillas=registro_plantillas)
+
+def respuesta_fallo(error):
+    """Respuesta JSON de una etapa del pipeline que no ha podido completarse"""
+    return jsonify({'exito': False, 'mensaje': error.mensaje, **error.datos}), error.codigo
+
+def responder_rafaga(user_code, imagenes, detector, metodo, mensaje_ok):
+    """Rectifica y fusiona una ráfaga decodificando los frames de uno en uno"""
+    if metodo not in METODOS_FUSION:
+        return jsonify({'exito': False, 'mensaje': f'Método de fusión inválido: {metodo}'}), 400
+    # Se rechaza antes de decodificar nada: el trabajo y la memoria quedan acotados por MAX_FRAMES_RAFAGA
+    if len(imagenes) > MAX_FRAMES_RAFAGA:
+        return jsonify({'exito': False,
+                        'mensaje': f'Demasiados frames en la ráfaga: {len(imagenes)} (máximo {MAX_FRAMES_RAFAGA})'}), 400
+    
+    fusionador = FusionadorRafaga(detector, metodo=metodo, max_frames=MAX_FRAMES_RAFAGA)
+    for i in range(len(imagenes)):
+        img = base64_to_image(imagenes[i])
+        if img is None:
+            fusionador.registrar_rechazo(i, 'imagen no decodificable')
+            continue
+        fusionador.agregar(img, i)
+        del img
+    
+    estadisticas = fusionador.estadisticas()
+    fusionada = fusionador.resultado()
+    if fusionada is None:
+        return jsonify({
+            'exito': False,
+            'mensaje': 'Ningún frame de la ráfaga es válido',
+            'rafaga': estadisticas
+        })
+    
+    logger.info(f"[{user_code}] Ráfaga fusionada ({metodo}): {estadisticas['aceptados']}/{len(imagenes)} frames")
+    return jsonify({
+        'exito': True,
+        'mensaje': f"{mensaje_ok} (fusión de {estadisticas['aceptados']} frames)",
+        'imagen_rectificada': image_to_base64(fusionada),
+        'imagen_marcadores': image_to_base64(fusionador.imagen_marcadores),
+        'rafaga': estadisticas
+    })
+
 @app.route('/')
 def home():
     """Endpoint de prueba"""
@@ -88,56 +422,102 @@ def home():
         'status': 'ok',
         'message': 'API Analizador de Probetas funcionando',
         'version': '1.0',
-        'calibraciones_activas': len(calibraciones_activas)
+        'calibraciones_activas': len(calibraciones_activas),
+        'cache': cache_resultados.estadisticas(),
+        'idempotencia': vuelos_unicos.estadisticas(),
+        'memoria': vigilante_memoria.estadisticas(),
+        'almacen_calibraciones': almacen_calibraciones.estadisticas(),
+        'plantillas': registro_plantillas.estadisticas()
     })
 
+@app.route('/kits')
+def kits():
+    """Kits de test con plantilla: parámetros y valores de cada tabla"""
+    disponibles = []
+    for kit_id in registro_plantillas.disponibles():
+        try:
+            disponibles.append(registro_plantillas.obtener(kit_id).resumen())
+        except KitDesconocido as e:
+            logger.warning(f"Kit {kit_id} omitido: {e}")
+    return jsonify({'exito': True, 'por_defecto': KIT_POR_DEFECTO, 'kits': disponibles})
+
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/preflight_aruco', methods=['POST'])
+def preflight_aruco():
+    """Comprobación previa sobre miniatura: ¿merece la pena subir la foto completa?"""
+    try:
+        data = request.get_json()
+
+        if not data or 'imagen' not in data:
+            return jsonify({'exito': False, 'mensaje': 'Faltan datos requeridos'}), 400
+
+        user_code = data.get('user_code', 'anonimo')
+
+        img = base64_to_image(data['imagen'])
+        if img is None:
+            return jsonify({'exito': False, 'mensaje': 'Error al procesar imagen'}), 400
+
+        resultado = detector_preflight.preflight(img)
+
+        logger.info(f"[{user_code}] Preflight: enviar={resultado['enviar']} "
+                    f"marcadores={resultado['marcadores_encontrados']} ({resultado['tiempo_ms']:.1f} ms)")
+
+        return jsonify({'exito': True, **resultado})
+
+    except Exception as e:
+        logger.error(f"Error en preflight_aruco: {e}")
+        return jsonify({'exito': False, 'mensaje': f'Error del servidor: {str(e)}'}), 500
+
 # ... (resto del código igual)
 @app.route('/detectar_aruco', methods=['POST'])
+@deduplicar
+@perfilador.envolver
 def detectar_aruco():
     """PASO A2: Detectar ArUco y rectificar tabla"""
     try:
         data = request.get_json()
         
-        if not data or 'imagen' not in data or 'user_code' not in data:
+        if not data or ('imagen' not in data and 'imagenes' not in data) or 'user_code' not in data:
             return jsonify({'exito': False, 'mensaje': 'Faltan datos requeridos'}), 400
         
         user_code = data['user_code']
+        modo_fijo = bool(data.get('modo_fijo', False))
         logger.info(f"[{user_code}] Iniciando detección ArUco")
         
-        img = base64_to_image(data['imagen'])
-        if img is None:
-            return jsonify({'exito': False, 'mensaje': 'Error al procesar imagen'}), 400
-        
-        temp_path = os.path.join(TEMP_DIR, f'{user_code}_tabla.jpg')
-        cv2.imwrite(temp_path, img)
-        
-        detector = TablaAPIDetector(target_width=800, target_height=533)
-        resultado = detector.procesar_imagen(temp_path)
-        
-        os.remove(temp_path)
-        
-        if not resultado['exito']:
-            return jsonify({
-                'exito': False,
-                'mensaje': resultado['mensaje'],
-                'imagen_marcadores': image_to_base64(resultado['imagen_marcadores']) if resultado['imagen_marcadores'] is not None else None
-            })
-        
-        response = {
-            'exito': True,
-            'mensaje': 'Tabla rectificada correctamente',
-            'imagen_rectificada': image_to_base64(resultado['imagen_rectificada']),
-            'imagen_marcadores': image_to_base64(resultado['imagen_marcadores'])
-        }
-        
-        logger.info(f"[{user_code}] ArUco detectado exitosamente")
-        return jsonify(response)
+        # Modo ráfaga: varias fotos de la misma escena fusionadas en una tabla rectificada
+        if isinstance(data.get('imagenes'), list):
+            return responder_rafaga(user_code, data['imagenes'], crear_detector(TAMANO_TABLA),
+                                    data.get('fusion', 'mediana'), 'Tabla rectificada correctamente')
+        
+        try:
+            ejecucion = pipeline.ejecutar({
+                'foto_b64': data['imagen'],
+                'tamano': TAMANO_TABLA,
+                'rig_previo': obtener_rig(user_code, 'tabla') if modo_fijo else None
+            }, ['respuesta_deteccion', 'rig'])
+        except EtapaFallida as e:
+            return respuesta_fallo(e)
+        
+        if modo_fijo:
+            guardar_rig(user_code, 'tabla', ejecucion['rig'])
+        
+        if ejecucion.calculadas:
+            logger.info(f"[{user_code}] ArUco detectado exitosamente")
+        else:
+            logger.info(f"[{user_code}] ArUco servido desde caché")
+        return jsonify({'exito': True, 'mensaje': 'Tabla rectificada correctamente', **ejecucion['respuesta_deteccion']})
         
     except Exception as e:
         logger.error(f"Error en detectar_aruco: {e}")
         return jsonify({'exito': False, 'mensaje': f'Error del servidor: {str(e)}'}), 500
 
 @app.route('/extraer_colores', methods=['POST'])
+@deduplicar
+@perfilador.envolver
 def extraer_colores():
     """PASO B3: Extraer colores de tabla rectificada"""
     try:
@@ -152,53 +532,35 @@ def extraer_colores():
             logger.error(f"bbox_tabla inválido: {bbox_tabla}")
             return jsonify({'exito': False, 'mensaje': 'bbox_tabla no recibido o inválido'}), 400
         bbox_tabla = tuple(bbox_tabla)
+        kit = data.get('kit', KIT_POR_DEFECTO)
         
-        logger.info(f"[{user_code}] Iniciando extracción de colores")
-        
-        img_tabla = base64_to_image(data['imagen_rectificada'])
-        if img_tabla is None:
-            return jsonify({'exito': False, 'mensaje': 'Error al procesar imagen'}), 400
-        
-        temp_tabla = os.path.join(TEMP_DIR, f'{user_code}_tabla_rect.jpg')
-        cv2.imwrite(temp_tabla, img_tabla)
-        
-        extractor = ExtractorProporcional(
-            tabla_rectificada_path=temp_tabla,
-            referencia_path='referencia2.jpg'
-        )
-        
-        resultado = extractor.procesar_extraccion_completa(bbox_tabla, directorio_salida=TEMP_DIR)
+        logger.info(f"[{user_code}] Iniciando extracción de colores (kit {kit})")
         
-        os.remove(temp_tabla)
+        # La calibración sale del pipeline también en un acierto de caché: se activa para este usuario
+        try:
+            ejecucion = pipeline.ejecutar({
+                'tabla_b64': data['imagen_rectificada'],
+                'bbox_tabla': bbox_tabla,
+                'kit': kit
+            }, ['calibracion', 'calidad_tabla', 'imagen_debug_b64'])
+        except EtapaFallida as e:
+            return respuesta_fallo(e)
         
-        if not resultado['exito']:
-            return jsonify({'exito': False, 'mensaje': resultado['mensaje']})
+        calibracion = ejecucion['calibracion']
+        expiracion = activar_calibracion(user_code, calibracion)
         
-        limpiar_calibraciones_expiradas()
-        
-        ahora = datetime.now()
-        calibraciones_activas[user_code] = {
-            'colores': resultado['colores_extraidos'],
-            'timestamp': ahora,
-            'expires': ahora + EXPIRACION_CALIBRACION,
-            'estadisticas': resultado['estadisticas']
-        }
-        
-        img_debug = None
-        for archivo in resultado['archivos_generados']:
-            if 'debug' in archivo:
-                img_debug = cv2.imread(archivo)
-                os.remove(archivo)
-                break
-        
-        logger.info(f"[{user_code}] Colores extraídos: {len(resultado['colores_extraidos'])}")
+        logger.info(f"[{user_code}] Colores extraídos: {len(calibracion)}"
+                    f"{'' if ejecucion.calculadas else ' (desde caché)'}")
         
         return jsonify({
             'exito': True,
-            'mensaje': f"Extraídos {len(resultado['colores_extraidos'])} colores",
-            'colores_extraidos': len(resultado['colores_extraidos']),
-            'imagen_debug': image_to_base64(img_debug) if img_debug is not None else None,
-            'expira_en': EXPIRACION_CALIBRACION.total_seconds()
+            'mensaje': f"Extraídos {len(calibracion)} colores",
+            'colores_extraidos': len(calibracion),
+            'kit': kit,
+            'imagen_debug': ejecucion['imagen_debug_b64'],
+            'expira_en': expiracion.total_seconds(),
+            'calidad': ejecucion['calidad_tabla'],
+            'iluminacion': calibracion.iluminacion.a_dict() if calibracion.normalizada else None
         })
         
     except Exception as e:
@@ -208,46 +570,41 @@ def extraer_colores():
         return jsonify({'exito': False, 'mensaje': f'Error del servidor: {str(e)}'}), 500
 
 @app.route('/rectificar_probeta', methods=['POST'])
+@deduplicar
+@perfilador.envolver
 def rectificar_probeta():
     """PASO C2: Rectificar imagen de probeta usando ArUco"""
     try:
         data = request.get_json()
-        if 'imagen_probeta' not in data or 'user_code' not in data:
+        if ('imagen_probeta' not in data and 'imagenes_probeta' not in data) or 'user_code' not in data:
             return jsonify({'exito': False, 'mensaje': 'Faltan datos'}), 400
 
         user_code = data['user_code']
+        modo_fijo = bool(data.get('modo_fijo', False))
         logger.info(f"[{user_code}] Rectificando probeta con ArUco")
 
-        img = base64_to_image(data['imagen_probeta'])
-        if img is None:
-            return jsonify({'exito': False, 'mensaje': 'Error procesando imagen'}), 400
+        # Modo ráfaga
+        if isinstance(data.get('imagenes_probeta'), list):
+            return responder_rafaga(user_code, data['imagenes_probeta'], crear_detector(TAMANO_PROBETA),
+                                    data.get('fusion', 'mediana'), 'Probeta rectificada correctamente')
 
-        # Guardar temporalmente
-        temp_path = os.path.join(TEMP_DIR, f'{user_code}_probeta.jpg')
-        cv2.imwrite(temp_path, img)
-        
-        # Usar detector ArUco (mismas dimensiones que tabla o ajustadas)
-        detector = TablaAPIDetector(target_width=800, target_height=513)
-        resultado = detector.procesar_imagen(temp_path)
-        
-        os.remove(temp_path)
-        
-        if not resultado['exito']:
-            return jsonify({
-                'exito': False,
-                'mensaje': resultado['mensaje'],
-                'imagen_marcadores': image_to_base64(resultado['imagen_marcadores']) if resultado['imagen_marcadores'] is not None else None
-            })
-        
-        response = {
-            'exito': True,
-            'mensaje': 'Probeta rectificada correctamente',
-            'imagen_rectificada': image_to_base64(resultado['imagen_rectificada']),
-            'imagen_marcadores': image_to_base64(resultado['imagen_marcadores'])
-        }
-        
-        logger.info(f"[{user_code}] Probeta rectificada con ArUco exitosamente")
-        return jsonify(response)
+        try:
+            ejecucion = pipeline.ejecutar({
+                'foto_b64': data['imagen_probeta'],
+                'tamano': TAMANO_PROBETA,
+                'rig_previo': obtener_rig(user_code, 'probeta') if modo_fijo else None
+            }, ['respuesta_deteccion', 'rig'])
+        except EtapaFallida as e:
+            return respuesta_fallo(e)
+        
+        if modo_fijo:
+            guardar_rig(user_code, 'probeta', ejecucion['rig'])
+        
+        if ejecucion.calculadas:
+            logger.info(f"[{user_code}] Probeta rectificada con ArUco exitosamente")
+        else:
+            logger.info(f"[{user_code}] Probeta servida desde caché")
+        return jsonify({'exito': True, 'mensaje': 'Probeta rectificada correctamente', **ejecucion['respuesta_deteccion']})
 
     except Exception as e:
         import traceback
@@ -265,124 +622,70 @@ def analizar_probeta():
         user_code = data['user_code']
         tipo_test = data['tipo_test']
         area_seleccionada = tuple(data['area_seleccionada'])
+        metrica = data.get('metrica', 'rgb')
+        if metrica not in METRICAS:
+            return jsonify({'exito': False, 'mensaje': f'Métrica de color inválida: {metrica}'}), 400
         
-        logger.info(f"[{user_code}] Analizando probeta tipo: {tipo_test}")
+        logger.info(f"[{user_code}] Analizando probeta tipo: {tipo_test} (métrica {metrica})")
         
-        limpiar_calibraciones_expiradas()
-        
-        if user_code not in calibraciones_activas:
+        calibracion_activa = obtener_calibracion(user_code)
+        if calibracion_activa is None:
             return jsonify({
                 'exito': False,
                 'mensaje': 'Calibración expirada o no encontrada. Vuelve a calibrar la tabla.'
             }), 400
         
-        img_probeta = base64_to_image(data['imagen_probeta'])
-        if img_probeta is None:
-            return jsonify({'exito': False, 'mensaje': 'Error al procesar imagen de probeta'}), 400
-        
-        colores_calibracion = calibraciones_activas[user_code]['colores']
-        
-        # Crear diccionario de colores organizados por tipo
-        valores_por_tipo = {}
-        for color_obj in colores_calibracion:
-            tipo_param = color_obj.parametro
-            valor = color_obj.valor
-            color_rgb = color_obj.color_rgb
-            
-            if tipo_param not in valores_por_tipo:
-                valores_por_tipo[tipo_param] = {}
-            valores_por_tipo[tipo_param][valor] = color_rgb
-        
-        # ✅ MAPEO CORREGIDO: frontend → nombre exacto en Excel
-        mapeo_tipos = {
-            'pH': 'pH',
-            'high_ph': 'High_Range_pH',
-            'ammonia': 'Ammonia',
-            'nitrite': 'Nitrite',
-            'nitrate': 'Nitrate'
-        }
-        
-        tipo_calibracion = mapeo_tipos.get(tipo_test)
-        
-        # ✅ Búsqueda flexible si no encuentra exacto
-        if not tipo_calibracion or tipo_calibracion not in valores_por_tipo:
-            # Buscar variaciones (case-insensitive, con/sin espacios)
-            for key in valores_por_tipo.keys():
-                if tipo_test.lower().replace('_', ' ') in key.lower().replace('_', ' '):
-                    tipo_calibracion = key
-                    break
-        
-        if not tipo_calibracion or tipo_calibracion not in valores_por_tipo:
-            logger.error(f"Tipos disponibles: {list(valores_por_tipo.keys())}")
-            return jsonify({
-                'exito': False,
-                'mensaje': f'No hay datos de calibración para {tipo_test}. Tipos disponibles: {list(valores_por_tipo.keys())}'
-            }), 400
-        
-        # Extraer color promedio del área seleccionada
-        x, y, w, h = area_seleccionada
-        
-        img_h, img_w = img_probeta.shape[:2]
-        if x < 0 or y < 0 or x + w > img_w or y + h > img_h or w < 5 or h < 5:
-            return jsonify({
-                'exito': False,
-                'mensaje': f'Área seleccionada inválida: ({x},{y},{w},{h}) en imagen {img_w}x{img_h}'
-            }), 400
-        
-        region = img_probeta[y:y+h, x:x+w]
-        mean_bgr = cv2.mean(region)
-        color_promedio_rgb = (int(round(mean_bgr[2])), int(round(mean_bgr[1])), int(round(mean_bgr[0])))
-        
-        logger.info(f"[{user_code}] Color promedio detectado: RGB{color_promedio_rgb}")
-        
-        # Encontrar valores cercanos
-        valores_cercanos = []
-        for valor, color_ref in valores_por_tipo[tipo_calibracion].items():
-            distancia = calcular_distancia_color(color_promedio_rgb, color_ref)
-            valores_cercanos.append({
-                'parametro': f'{tipo_test} {float(valor)}',
-                'valor': float(valor),
-                'color_rgb': [int(color_ref[0]), int(color_ref[1]), int(color_ref[2])],
-                'distancia': float(distancia)
-            })
-        
-        valores_cercanos.sort(key=lambda x: x['distancia'])
-        
-        if not valores_cercanos:
-            return jsonify({
-                'exito': False,
-                'mensaje': 'No se encontraron valores de referencia'
-            }), 400
-        
-        # Interpolación simple
-        valor_final = valores_cercanos[0]['valor']
-        interpolado = False
-        
-        if len(valores_cercanos) >= 2:
-            v1 = valores_cercanos[0]
-            v2 = valores_cercanos[1]
-            
-            if v1['distancia'] > 10:
-                peso1 = 1 / (v1['distancia'] + 0.1)
-                peso2 = 1 / (v2['distancia'] + 0.1)
-                peso_total = peso1 + peso2
-                valor_final = (v1['valor'] * peso1 + v2['valor'] * peso2) / peso_total
-                interpolado = True
-        
-        distancia_minima = valores_cercanos[0]['distancia']
-        confianza = max(0.1, min(1.0, 1 - (distancia_minima / 100)))
+        # Con la misma foto solo se recalculan las etapas cuyas entradas cambian (área, tipo de test, métrica)
+        try:
+            ejecucion = pipeline.ejecutar({
+                'probeta_b64': data['imagen_probeta'],
+                'area': area_seleccionada,
+                'tipo_test': tipo_test,
+                'metrica': metrica,
+                'calibracion': calibracion_activa['calibracion']
+            }, ['color_rgb', 'color_clasificacion', 'info_iluminacion', 'analisis'])
+        except EtapaFallida as e:
+            return respuesta_fallo(e)
+        
+        # Pasadas las 2 horas solo se reutiliza la calibración si la luz no ha cambiado demasiado
+        info_iluminacion = ejecucion['info_iluminacion']
+        deriva = info_iluminacion.get('deriva')
+        edad = datetime.now() - calibracion_activa['timestamp']
+        if edad > EXPIRACION_CALIBRACION:
+            if deriva is None or deriva_excesiva(deriva):
+                RECHAZOS_DERIVA.inc()
+                logger.info(f"[{user_code}] Calibración de hace {edad.total_seconds() / 3600:.1f} h rechazada "
+                            f"por deriva de iluminación: {deriva}")
+                return jsonify({
+                    'exito': False,
+                    'mensaje': 'La iluminación ha cambiado demasiado desde la calibración. Vuelve a calibrar la tabla.',
+                    'iluminacion': info_iluminacion
+                }), 400
+            ANALISIS_CALIBRACION_EXTENDIDA.inc()
+        elif deriva is not None and deriva_excesiva(deriva):
+            logger.warning(f"[{user_code}] Iluminación muy distinta a la de la tabla: {deriva}")
+        
+        almacen_calibraciones.registrar_uso(calibracion_activa)
+        color_promedio_rgb = ejecucion['color_rgb']
+        analisis = ejecucion['analisis']
+        color_clasificacion = ejecucion['color_clasificacion']
+        logger.info(f"[{user_code}] Color promedio detectado: RGB{color_promedio_rgb}"
+                    f"{f' (normalizado RGB{color_clasificacion})' if info_iluminacion['normalizada'] else ''}")
         
         response = {
             'exito': True,
-            'valor_final': float(valor_final),
-            'parametro_cercano': valores_cercanos[0]['parametro'],
-            'confianza': float(confianza),
-            'interpolado': interpolado,
+            'valor_final': analisis['valor_final'],
+            'parametro_cercano': analisis['parametro_cercano'],
+            'confianza': analisis['confianza'],
+            'interpolado': analisis['interpolado'],
+            'metrica': analisis['metrica'],
             'color_rgb': color_promedio_rgb,
-            'valores_cercanos': valores_cercanos[:3]
+            'color_normalizado': color_clasificacion if info_iluminacion['normalizada'] else None,
+            'iluminacion': info_iluminacion,
+            'valores_cercanos': analisis['valores_cercanos'][:3]
         }
         
-        logger.info(f"[{user_code}] Análisis completado: {valor_final:.2f} (confianza: {confianza:.2f})")
+        logger.info(f"[{user_code}] Análisis completado: {analisis['valor_final']:.2f} (confianza: {analisis['confianza']:.2f})")
         return jsonify(response)
         
     except Exception as e:
@@ -391,12 +694,6 @@ def analizar_probeta():
         logger.error(f"Error en analizar_probeta:\n{error_completo}")
         return jsonify({'exito': False, 'mensaje': f'Error del servidor: {str(e)}'}), 500
 
-def calcular_distancia_color(color1: Tuple[int, int, int], color2: Tuple[int, int, int]) -> float:
-    """Calcular distancia euclidiana entre colores RGB."""
-    r1, g1, b1 = color1
-    r2, g2, b2 = color2
-    return float(np.sqrt((r1-r2)**2 + (g1-g2)**2 + (b1-b2)**2))
-
 @app.route('/verificar_calibracion', methods=['POST'])
 def verificar_calibracion():
     """Verifica si un usuario tiene calibración activa"""
@@ -407,16 +704,15 @@ def verificar_calibracion():
         if not user_code:
             return jsonify({'exito': False, 'mensaje': 'Falta user_code'}), 400
         
-        limpiar_calibraciones_expiradas()
-        
-        if user_code in calibraciones_activas:
-            cal = calibraciones_activas[user_code]
+        cal = obtener_calibracion(user_code)
+        if cal is not None:
             segundos_restantes = (cal['expires'] - datetime.now()).total_seconds()
             
             return jsonify({
                 'activa': True,
                 'expira_en_segundos': int(segundos_restantes),
-                'colores_extraidos': len(cal['colores'])
+                'colores_extraidos': len(cal['calibracion']),
+                'normalizada': cal['calibracion'].normalizada
             })
         else:
             return jsonify({'activa': False})
@@ -425,6 +721,56 @@ def verificar_calibracion():
         logger.error(f"Error en verificar_calibracion: {e}")
         return jsonify({'exito': False, 'mensaje': str(e)}), 500
 
+if sock is not None:
+    @sock.route('/stream_aruco')
+    def stream_aruco(ws):
+        """Guía de captura en vivo: frames de baja resolución por WebSocket.
+        
+        Cada mensaje es un JPEG binario o un JSON {"frame": dataURL}; la respuesta es
+        el estado de los marcadores y la señal 'capturar'.
+        """
+        if not sesiones_stream.acquire(blocking=False):
+            logger.warning(f"Guía en vivo rechazada: {MAX_SESIONES_STREAM} sesiones abiertas en este worker")
+            ws.send(json.dumps({'exito': False, 'mensaje': 'Demasiadas sesiones de guía en vivo; inténtalo más tarde'}))
+            ws.close(reason=1013)
+            return
+        try:
+            guiar_stream(ws)
+        finally:
+            sesiones_stream.release()
+
+    def guiar_stream(ws):
+        """Bucle de una sesión de guía en vivo; termina al cerrar el cliente o tras INACTIVIDAD_STREAM_S sin frames"""
+        detector = TablaAPIDetector(filtrar_calidad=False, reintentos_paralelos=False,
+                                    perfil_parametros=PERFIL_ARUCO)
+        seguidor = SeguidorMarcadores(detector, deteccion_cada=int(os.environ.get('STREAM_DETECCION_CADA', '10')))
+        logger.info("Sesión de guía en vivo iniciada")
+        
+        while True:
+            mensaje = ws.receive(timeout=INACTIVIDAD_STREAM_S)
+            if mensaje is None:
+                if ws.connected:
+                    logger.info(f"Sesión de guía en vivo inactiva {INACTIVIDAD_STREAM_S:.0f} s: se cierra")
+                    ws.close(reason=1000)
+                break
+            try:
+                if isinstance(mensaje, str):
+                    frame = base64_to_image(json.loads(mensaje).get('frame', ''))
+                else:
+                    frame = guardia_ingesta.decodificar(mensaje)
+                
+                if frame is None:
+                    ws.send(json.dumps({'exito': False, 'mensaje': 'Frame inválido'}))
+                    continue
+                
+                ws.send(json.dumps({'exito': True, **seguidor.procesar_frame(frame)}))
+            except Exception as e:
+                logger.error(f"Error en stream_aruco: {e}")
+                ws.send(json.dumps({'exito': False, 'mensaje': f'Error del servidor: {str(e)}'}))
+        
+        logger.info(f"Sesión de guía en vivo cerrada: {seguidor.frames_procesados} frames, "
+                    f"{seguidor.detecciones_completas} detecciones completas")
+
 if __name__ == '__main__':
 
     app.run(debug=True, host='0.0.0.0', port=5000)
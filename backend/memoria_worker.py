@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+🧠 Vigilancia de memoria del worker
+Mide el RSS del proceso al empezar y terminar cada petición y:
+
+- registra el pico por endpoint (exacto cuando la petición se ejecutó sola: se reinicia
+  VmHWM con /proc/self/clear_refs; con peticiones solapadas se usa el RSS final como cota);
+- con el worker ocioso y el RSS por encima del de arranque, devuelve al sistema la memoria
+  libre del heap con malloc_trim (los buffers grandes de NumPy/OpenCV lo fragmentan);
+- si aun así el RSS supera el umbral, recicla el worker de gunicorn con SIGTERM: deja de
+  aceptar peticiones, termina las que tiene en curso y el arbiter arranca uno nuevo.
+
+Las lecturas de /proc y malloc_trim son de Linux/glibc; en otros sistemas solo se
+exportan las métricas disponibles y no se recicla.
+"""
+
+import os
+import sys
+import time
+import ctypes
+import signal
+import threading
+import logging
+from typing import Dict, Optional
+
+import metricas
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TAMANO_PAGINA = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+LIMITES_INCREMENTO = (1e6, 4e6, 1.6e7, 3.2e7, 6.4e7, 1.28e8, 2.56e8, 5.12e8, 1.024e9)
+
+INCREMENTO_RSS = metricas.histograma('probetas_rss_incremento_bytes', 'Crecimiento del RSS del worker durante la petición',
+                                     ('endpoint',), LIMITES_INCREMENTO)
+PICO_ENDPOINT = metricas.medidor('probetas_rss_pico_bytes', 'RSS máximo del worker observado por endpoint',
+                                 etiquetas=('endpoint',))
+RECORTADO = metricas.contador('probetas_memoria_recortada_bytes_total', 'Memoria devuelta al sistema con malloc_trim')
+RECICLAJES = metricas.contador('probetas_reciclajes_worker_total', 'Workers reciclados por superar el umbral de RSS')
+
+
+def rss_actual() -> Optional[int]:
+    """RSS del proceso en bytes (None si no se puede leer)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * TAMANO_PAGINA
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def rss_pico() -> Optional[int]:
+    """VmHWM: RSS máximo desde el arranque o desde el último reinicio del pico."""
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reiniciar_pico() -> bool:
+    """Reiniciar VmHWM al RSS actual (Linux >= 4.0)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _cargar_malloc_trim():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return ctypes.CDLL('libc.so.6').malloc_trim
+    except (OSError, AttributeError):
+        return None
+
+
+class VigilanteMemoria:
+    """RSS por petición, recorte del heap y reciclaje del worker por umbral."""
+
+    def __init__(self, rss_max_bytes: int = 0, recorte_min_bytes: int = 32 * 2**20,
+                 intervalo_recorte_s: float = 5.0):
+        """
+        Args:
+            rss_max_bytes: RSS a partir del cual se recicla el worker (0 desactiva)
+            recorte_min_bytes: Crecimiento sobre el RSS de arranque que dispara malloc_trim
+            intervalo_recorte_s: Tiempo mínimo entre dos malloc_trim
+        """
+        self.rss_max_bytes = rss_max_bytes
+        self.recorte_min_bytes = recorte_min_bytes
+        self.intervalo_recorte_s = intervalo_recorte_s
+        self.rss_arranque = rss_actual()
+        self.en_curso = 0
+        self.reciclando = False
+        self.picos: Dict[str, int] = {}
+        self._solapada = False
+        self._pico_reiniciado = False
+        self._ultimo_recorte = 0.0
+        self._malloc_trim = _cargar_malloc_trim()
+        self._lock = threading.Lock()
+
+    def inicio(self) -> Dict:
+        """Al empezar una petición; devuelve el estado que se pasa a fin()."""
+        with self._lock:
+            self.en_curso += 1
+            if self.en_curso == 1:
+                self._solapada = False
+                self._pico_reiniciado = reiniciar_pico()
+            else:
+                self._solapada = True
+        return {'rss_inicio': rss_actual()}
+
+    def fin(self, endpoint: str, estado: Optional[Dict], en_gunicorn: bool):
+        """Al terminar la petición (después de enviar la respuesta)."""
+        rss = rss_actual()
+        with self._lock:
+            self.en_curso -= 1
+            exacto = not self._solapada and self._pico_reiniciado
+            ocioso = self.en_curso == 0
+        if rss is None or estado is None:
+            return
+
+        pico = max(rss_pico() or rss, rss) if exacto else rss
+        if estado.get('rss_inicio') is not None:
+            INCREMENTO_RSS.observar(max(0, pico - estado['rss_inicio']), endpoint=endpoint)
+        with self._lock:
+            if pico > self.picos.get(endpoint, 0):
+                self.picos[endpoint] = pico
+                PICO_ENDPOINT.set(pico, endpoint=endpoint)
+
+        if ocioso and self.rss_arranque is not None and rss - self.rss_arranque > self.recorte_min_bytes:
+            rss = self.recortar(rss)
+        if self.rss_max_bytes and rss > self.rss_max_bytes:
+            self.reciclar(rss, en_gunicorn)
+
+    def recortar(self, rss: int) -> int:
+        """malloc_trim(0) como mucho cada intervalo_recorte_s; devuelve el RSS resultante."""
+        ahora = time.monotonic()
+        if self._malloc_trim is None or ahora - self._ultimo_recorte < self.intervalo_recorte_s:
+            return rss
+        self._ultimo_recorte = ahora
+        self._malloc_trim(0)
+        despues = rss_actual() or rss
+        if despues < rss:
+            RECORTADO.inc(rss - despues)
+            logger.info(f"🧠 malloc_trim: RSS {rss / 2**20:.0f} → {despues / 2**20:.0f} MB")
+        return despues
+
+    def reciclar(self, rss: int, en_gunicorn: bool):
+        """Pedir a gunicorn una salida ordenada del worker (una sola vez)."""
+        with self._lock:
+            if self.reciclando:
+                return
+            self.reciclando = en_gunicorn
+        if not en_gunicorn:
+            logger.warning(f"🧠 RSS {rss / 2**20:.0f} MB supera {self.rss_max_bytes / 2**20:.0f} MB "
+                           f"(sin gunicorn no se recicla)")
+            return
+        RECICLAJES.inc()
+        logger.warning(f"🧠 RSS {rss / 2**20:.0f} MB supera {self.rss_max_bytes / 2**20:.0f} MB: "
+                       f"reciclando worker {os.getpid()} tras las peticiones en curso")
+        # El worker de gunicorn trata SIGTERM como salida ordenada: termina lo que tiene en curso
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def estadisticas(self) -> Dict:
+        rss = rss_actual()
+        return {
+            'pid': os.getpid(),
+            'rss_mb': round(rss / 2**20, 1) if rss is not None else None,
+            'rss_arranque_mb': round(self.rss_arranque / 2**20, 1) if self.rss_arranque is not None else None,
+            'rss_max_mb': round(self.rss_max_bytes / 2**20, 1) if self.rss_max_bytes else None,
+            'picos_mb': {e: round(p / 2**20, 1) for e, p in sorted(self.picos.items())},
+            'reciclando': self.reciclando
+        }
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+📈 Métricas en formato de texto de Prometheus
+Contadores, medidores e histogramas en memoria del proceso, sin dependencias externas.
+Cada observación es un incremento bajo un lock, así que pueden quedarse activas en
+producción. Las etapas internas (decodificación, detectMarkers, warp, muestreo...) se
+miden con el gestor de contexto etapa(), que además avisa a los oyentes registrados.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Límites de los histogramas
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LIMITES_BYTES = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_etiquetas(nombres: Tuple[str, ...], valores: Tuple, extra: str = '') -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+def _formatear_numero(valor: float) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class _Metrica:
+    """Base común: nombre, ayuda, nombres de etiquetas y valores por combinación de etiquetas."""
+
+    tipo = 'untyped'
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.valores: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas: Dict) -> Tuple:
+        return tuple(etiquetas.get(n, '') for n in self.etiquetas)
+
+    def _lineas(self) -> List[str]:
+        raise NotImplementedError
+
+    def exportar(self) -> str:
+        cabecera = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+        return '\n'.join(cabecera + self._lineas())
+
+
+class Contador(_Metrica):
+    """Valor monótono creciente."""
+
+    tipo = 'counter'
+
+    def inc(self, cantidad: float = 1.0, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self.valores[clave] = self.valores.get(clave, 0.0) + cantidad
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            items = list(self.valores.items())
+        return [f'{self.nombre}{_formatear_etiquetas(self.etiquetas, k)} {_formatear_numero(v)}' for k, v in items]
+
+
+class Medidor(_Metrica):
+    """Valor instantáneo; con funcion se calcula en el momento de exportar."""
+
+    tipo = 'gauge'
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 funcion: Optional[Callable[[], float]] = None, tipo: Optional[str] = None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+        if tipo:
+            self.tipo = tipo
+
+    def set(self, valor: float, **etiquetas):
+        with self._lock:
+            self.valores[self._clave(etiquetas)] = valor
+
+    def _lineas(self) -> List[str]:
+        if self.funcion is not None:
+            try:
+                return [f'{self.nombre} {_formatear_numero(self.funcion())}']
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self.valores.items())
+        return [f'{self.nombre}{_formatear_etiquetas(self.etiquetas, k)} {_formatear_numero(v)}' for k, v in items]
+
+
+class Histograma(_Metrica):
+    """Distribución por cubos acumulados, más suma y número de observaciones."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 limites: Tuple[float, ...] = LIMITES_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(limites)
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        indice = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self.valores.get(clave)
+            if serie is None:
+                # [cubos no acumulados (+Inf al final), suma, cuenta]
+                serie = self.valores[clave] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self.valores.items()]
+        lineas = []
+        for clave, (cubos, suma, cuenta) in items:
+            acumulado = 0
+            for limite, n in zip(self.limites + (float('inf'),), cubos):
+                acumulado += n
+                le = f'le="{_formatear_numero(limite)}"'
+                lineas.append(f'{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, clave, le)} {acumulado}')
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {cuenta}')
+        return lineas
+
+
+class Registro:
+    """Conjunto de métricas exportadas juntas en /metrics."""
+
+    def __init__(self):
+        self.metricas: Dict[str, _Metrica] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        """Registrar una métrica (si ya existe una con ese nombre se devuelve la existente)."""
+        with self._lock:
+            return self.metricas.setdefault(metrica.nombre, metrica)
+
+    def exportar(self) -> str:
+        """Texto en formato de exposición de Prometheus 0.0.4."""
+        with self._lock:
+            metricas = list(self.metricas.values())
+        return '\n'.join(m.exportar() for m in metricas) + '\n'
+
+
+REGISTRO = Registro()
+
+
+def contador(nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Contador:
+    return REGISTRO.registrar(Contador(nombre, ayuda, etiquetas))
+
+
+def medidor(nombre: str, ayuda: str, funcion: Optional[Callable[[], float]] = None,
+            etiquetas: Tuple[str, ...] = (), tipo: Optional[str] = None) -> Medidor:
+    return REGISTRO.registrar(Medidor(nombre, ayuda, etiquetas, funcion, tipo))
+
+
+def histograma(nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+               limites: Tuple[float, ...] = LIMITES_SEGUNDOS) -> Histograma:
+    return REGISTRO.registrar(Histograma(nombre, ayuda, etiquetas, limites))
+
+
+def exportar() -> str:
+    return REGISTRO.exportar()
+
+
+# Métricas compartidas por los módulos del pipeline
+ETAPAS = histograma('probetas_etapa_segundos', 'Duración de las etapas internas del pipeline', ('etapa',))
+FALLOS_DETECCION = contador('probetas_fallos_deteccion_total', 'Detecciones ArUco fallidas por motivo', ('motivo',))
+
+# Oyentes de etapas: fn(nombre, inicio_perf_counter, duracion_s)
+_oyentes: List[Callable[[str, float, float], None]] = []
+
+
+def registrar_oyente(oyente: Callable[[str, float, float], None]):
+    """Recibir cada etapa terminada (p. ej. para trazas por petición)."""
+    if oyente not in _oyentes:
+        _oyentes.append(oyente)
+
+
+@contextmanager
+def etapa(nombre: str):
+    """Medir una etapa interna del pipeline."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        ETAPAS.observar(duracion, etapa=nombre)
+        for oyente in _oyentes:
+            oyente(nombre, inicio, duracion)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+🔬 Perfilado bajo demanda de peticiones individuales
+Ejecuta el handler bajo cProfile cuando la petición trae la cabecera de administración
+(X-Perfilar con el token configurado) o cae en la fracción de muestreo, y guarda el
+.pstats junto a un resumen de texto y un JSON con los parámetros y las dimensiones de
+las imágenes recibidas. Sin token ni muestreo configurados el decorador devuelve la
+vista original: coste cero.
+
+Para inspeccionar un perfil:
+    python -m pstats perfiles/<archivo>.pstats
+"""
+
+import io
+import os
+import json
+import time
+import hmac
+import random
+import pstats
+import cProfile
+import threading
+import logging
+from datetime import datetime
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import request, make_response
+
+from ingesta import LONGITUD_MIN_IMAGEN, sondear_base64
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CABECERA_PERFILADO = 'X-Perfilar'
+
+
+def _resumir_parametros(data: Optional[Dict]) -> Dict:
+    """Parámetros de la petición sin los base64 (solo su tamaño)."""
+    if not isinstance(data, dict):
+        return {}
+    resumen = {}
+    for clave, valor in data.items():
+        if isinstance(valor, str) and len(valor) > LONGITUD_MIN_IMAGEN:
+            resumen[clave] = f"<base64 {len(valor)} caracteres>"
+        elif isinstance(valor, list) and any(isinstance(v, str) and len(v) > LONGITUD_MIN_IMAGEN for v in valor):
+            resumen[clave] = f"<{len(valor)} imágenes base64>"
+        else:
+            resumen[clave] = valor
+    return resumen
+
+
+def _dimensiones_imagenes(data: Optional[Dict]) -> Dict:
+    """Ancho y alto de cada imagen base64 de la petición (listas de ráfaga incluidas), leídos
+    solo de la cabecera: perfilar no añade ninguna decodificación completa."""
+    dimensiones = {}
+    if not isinstance(data, dict):
+        return dimensiones
+    for clave, valor in data.items():
+        if isinstance(valor, str) and len(valor) > LONGITUD_MIN_IMAGEN:
+            sonda = sondear_base64(valor)
+            if sonda is not None:
+                dimensiones[clave] = [sonda.ancho, sonda.alto]
+        elif isinstance(valor, list):
+            sondas = [sondear_base64(v) if isinstance(v, str) and len(v) > LONGITUD_MIN_IMAGEN else None
+                      for v in valor]
+            if any(s is not None for s in sondas):
+                dimensiones[clave] = [[s.ancho, s.alto] if s is not None else None for s in sondas]
+    return dimensiones
+
+
+class Perfilador:
+    """Decorador de vistas Flask con perfilado bajo demanda."""
+
+    def __init__(self, directorio: str, token: Optional[str] = None, muestreo: float = 0.0,
+                 lineas_resumen: int = 40):
+        """
+        Inicializar perfilador.
+
+        Args:
+            directorio: Carpeta donde se guardan los perfiles
+            token: Valor esperado en la cabecera X-Perfilar (None desactiva la cabecera)
+            muestreo: Fracción de peticiones perfiladas sin cabecera
+            lineas_resumen: Funciones incluidas en el resumen de texto
+        """
+        self.directorio = directorio
+        self.token = token or None
+        self.muestreo = muestreo
+        self.lineas_resumen = lineas_resumen
+        # Un perfil a la vez: cProfile no admite dos perfiladores activos en Python 3.12+
+        self._lock = threading.Lock()
+
+    @property
+    def activo(self) -> bool:
+        return self.token is not None or self.muestreo > 0
+
+    def _motivo(self) -> Optional[str]:
+        cabecera = request.headers.get(CABECERA_PERFILADO)
+        if cabecera and self.token is not None and hmac.compare_digest(cabecera, self.token):
+            return 'cabecera'
+        if self.muestreo > 0 and random.random() < self.muestreo:
+            return 'muestreo'
+        return None
+
+    def envolver(self, vista):
+        """Decorar una vista; sin configuración se devuelve tal cual."""
+        if not self.activo:
+            return vista
+
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            motivo = self._motivo()
+            if motivo is None or not self._lock.acquire(blocking=False):
+                return vista(*args, **kwargs)
+            try:
+                perfil = cProfile.Profile()
+                inicio = time.perf_counter()
+                perfil.enable()
+                try:
+                    respuesta = vista(*args, **kwargs)
+                finally:
+                    perfil.disable()
+                duracion_ms = (time.perf_counter() - inicio) * 1000
+            finally:
+                self._lock.release()
+
+            nombre = self._guardar(perfil, vista.__name__, motivo, duracion_ms)
+            if nombre is not None and motivo == 'cabecera':
+                respuesta = _con_cabecera(respuesta, 'X-Perfil', nombre)
+            return respuesta
+        return envoltura
+
+    def _guardar(self, perfil: cProfile.Profile, endpoint: str, motivo: str, duracion_ms: float) -> Optional[str]:
+        """Escribir .pstats, resumen .txt y metadatos .json; devuelve el nombre base."""
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            nombre = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{endpoint}"
+            base = os.path.join(self.directorio, nombre)
+            perfil.dump_stats(base + '.pstats')
+
+            texto = io.StringIO()
+            pstats.Stats(perfil, stream=texto).sort_stats('cumulative').print_stats(self.lineas_resumen)
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(texto.getvalue())
+
+            data = request.get_json(silent=True)
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump({
+                    'endpoint': endpoint,
+                    'fecha': datetime.now().isoformat(timespec='seconds'),
+                    'motivo': motivo,
+                    'duracion_ms': round(duracion_ms, 2),
+                    'bytes_entrada': request.content_length,
+                    'parametros': _resumir_parametros(data),
+                    'dimensiones': _dimensiones_imagenes(data)
+                }, f, indent=2, ensure_ascii=False, default=str)
+
+            logger.info(f"🔬 Perfil de {endpoint} guardado en {base}.pstats ({duracion_ms:.0f} ms, {motivo})")
+            return nombre
+        except Exception as e:
+            logger.error(f"No se pudo guardar el perfil de {endpoint}: {e}")
+            return None
+
+
+def _con_cabecera(respuesta, nombre: str, valor: str):
+    """Añadir una cabecera a lo que devuelve una vista (Response o tupla)."""
+    respuesta = make_response(respuesta)
+    respuesta.headers[nombre] = valor
+    return respuesta
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+🧩 Motor de pipeline por etapas con resultados intermedios en caché
+Cada etapa declara las entradas que consume y las salidas que produce, y el motor
+resuelve bajo demanda solo las etapas necesarias para los valores pedidos.
+
+La huella de una etapa se calcula a partir de las huellas de sus entradas sin calcular
+nada: las entradas iniciales se hashean y las intermedias heredan la huella de la etapa
+que las produce. Si la caché tiene las salidas de una etapa, ni siquiera se resuelven sus
+entradas; reanalizar la misma probeta con otra área solo recalcula el color medio y la
+clasificación, y con otro tipo de test solo la clasificación.
+
+Un valor intermedio también se puede pasar como entrada (reanudar desde una etapa): si
+'probeta' viene dada, la etapa que la decodifica no se ejecuta.
+"""
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import metricas
+from cache_resultados import CacheResultados
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ETAPAS_PIPELINE = metricas.contador('probetas_pipeline_etapas_total',
+                                    'Etapas del pipeline resueltas, calculadas o servidas desde caché',
+                                    ('etapa', 'origen'))
+
+
+class EtapaFallida(Exception):
+    """Una etapa no puede producir sus salidas; no se guarda nada en caché."""
+
+    def __init__(self, mensaje: str, codigo: int = 400, **datos):
+        """
+        Args:
+            mensaje: Mensaje para el usuario
+            codigo: Código HTTP con el que responder
+            **datos: Campos adicionales de la respuesta (calidad, imagen de marcadores...)
+        """
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.codigo = codigo
+        self.datos = datos
+
+
+def _actualizar_huella(h, valor: Any):
+    if valor is None:
+        h.update(b'N')
+    elif isinstance(valor, str):
+        datos = valor.encode()
+        h.update(b's%d:' % len(datos))
+        h.update(datos)
+    elif isinstance(valor, bytes):
+        h.update(b'b%d:' % len(valor))
+        h.update(valor)
+    elif isinstance(valor, (bool, int, float, np.generic)):
+        h.update(f'n{valor!r};'.encode())
+    elif isinstance(valor, np.ndarray):
+        h.update(f'a{valor.dtype.str}{valor.shape};'.encode())
+        h.update(np.ascontiguousarray(valor).data)
+    elif isinstance(valor, dict):
+        h.update(b'd%d:' % len(valor))
+        for clave in sorted(valor, key=str):
+            _actualizar_huella(h, clave)
+            _actualizar_huella(h, valor[clave])
+    elif isinstance(valor, (list, tuple)):
+        h.update(b'l%d:' % len(valor))
+        for elemento in valor:
+            _actualizar_huella(h, elemento)
+    elif callable(getattr(valor, 'huella', None)):
+        h.update(f'h{valor.huella()};'.encode())
+    else:
+        raise TypeError(f"No se puede calcular la huella de {type(valor).__name__}")
+
+
+def huella_valor(valor: Any) -> str:
+    """blake2b del contenido de un valor (cadenas, bytes, números, arrays, dicts, listas u
+    objetos con método huella())."""
+    h = hashlib.blake2b(digest_size=16)
+    _actualizar_huella(h, valor)
+    return h.hexdigest()
+
+
+class Etapa:
+    """Función de un grafo de pipeline con entradas y salidas con nombre."""
+
+    def __init__(self, nombre: str, funcion: Callable[..., Dict[str, Any]],
+                 entradas: Tuple[str, ...], salidas: Tuple[str, ...],
+                 cachear: bool = True, version: int = 1):
+        """
+        Args:
+            nombre: Nombre único de la etapa (métricas y clave de caché)
+            funcion: Recibe las entradas como argumentos con nombre y devuelve un dict con
+                las salidas; lanza EtapaFallida si no puede producirlas
+            entradas: Valores que consume
+            salidas: Valores que produce
+            cachear: False para salidas grandes y baratas de recalcular (fotos decodificadas)
+            version: Cambiarla invalida las entradas de caché de la etapa
+        """
+        self.nombre = nombre
+        self.funcion = funcion
+        self.entradas = tuple(entradas)
+        self.salidas = tuple(salidas)
+        self.cachear = cachear
+        self.version = version
+
+
+@dataclass
+class Ejecucion:
+    """Valores resueltos de una ejecución y de dónde salió cada etapa."""
+    valores: Dict[str, Any]
+    calculadas: List[str] = field(default_factory=list)
+    reutilizadas: List[str] = field(default_factory=list)
+
+    def __getitem__(self, nombre: str) -> Any:
+        return self.valores[nombre]
+
+
+class Pipeline:
+    """Grafo de etapas que se resuelve bajo demanda con caché por huella de entradas."""
+
+    def __init__(self, etapas: Iterable[Etapa], cache: Optional[CacheResultados] = None):
+        """
+        Args:
+            etapas: Etapas del grafo; cada valor lo produce una sola etapa
+            cache: Caché LRU acotada para las salidas (None: sin caché, p. ej. en los CLI)
+        """
+        self.etapas: Dict[str, Etapa] = {}
+        self.productores: Dict[str, Etapa] = {}
+        for etapa in etapas:
+            if etapa.nombre in self.etapas:
+                raise ValueError(f"Etapa duplicada: {etapa.nombre}")
+            self.etapas[etapa.nombre] = etapa
+            for salida in etapa.salidas:
+                if salida in self.productores:
+                    raise ValueError(f"'{salida}' lo producen {self.productores[salida].nombre} y {etapa.nombre}")
+                self.productores[salida] = etapa
+        self.cache = cache
+        self._comprobar_ciclos()
+
+    def _comprobar_ciclos(self):
+        visitadas, en_camino = set(), set()
+
+        def visitar(etapa: Etapa):
+            if etapa.nombre in en_camino:
+                raise ValueError(f"Ciclo en el pipeline en la etapa {etapa.nombre}")
+            if etapa.nombre in visitadas:
+                return
+            en_camino.add(etapa.nombre)
+            for entrada in etapa.entradas:
+                if entrada in self.productores:
+                    visitar(self.productores[entrada])
+            en_camino.discard(etapa.nombre)
+            visitadas.add(etapa.nombre)
+
+        for etapa in self.etapas.values():
+            visitar(etapa)
+
+    def ejecutar(self, entradas: Dict[str, Any], objetivos: Iterable[str]) -> Ejecucion:
+        """
+        Resolver los valores pedidos.
+
+        Args:
+            entradas: Valores iniciales (o intermedios, para reanudar desde una etapa)
+            objetivos: Nombres de los valores a devolver
+
+        Returns:
+            Ejecucion con las entradas, los objetivos y los intermedios que hizo falta calcular
+
+        Raises:
+            EtapaFallida: Si alguna etapa necesaria falla
+        """
+        ejecucion = Ejecucion(dict(entradas))
+        huellas: Dict[str, str] = {}
+        for objetivo in objetivos:
+            self._valor(objetivo, ejecucion, huellas)
+        return ejecucion
+
+    def _huella(self, nombre: str, ejecucion: Ejecucion, huellas: Dict[str, str]) -> str:
+        if nombre not in huellas:
+            if nombre in ejecucion.valores:
+                huellas[nombre] = huella_valor(ejecucion.valores[nombre])
+            else:
+                huellas[nombre] = f"{self._huella_etapa(self._productor(nombre), ejecucion, huellas)}:{nombre}"
+        return huellas[nombre]
+
+    def _huella_etapa(self, etapa: Etapa, ejecucion: Ejecucion, huellas: Dict[str, str]) -> str:
+        h = hashlib.blake2b(f'{etapa.nombre}@{etapa.version}'.encode(), digest_size=16)
+        for entrada in etapa.entradas:
+            h.update(f'|{entrada}={self._huella(entrada, ejecucion, huellas)}'.encode())
+        return h.hexdigest()
+
+    def _productor(self, nombre: str) -> Etapa:
+        etapa = self.productores.get(nombre)
+        if etapa is None:
+            raise ValueError(f"Falta la entrada '{nombre}' y ninguna etapa la produce")
+        return etapa
+
+    def _valor(self, nombre: str, ejecucion: Ejecucion, huellas: Dict[str, str]) -> Any:
+        if nombre not in ejecucion.valores:
+            self._ejecutar_etapa(self._productor(nombre), ejecucion, huellas)
+        return ejecucion.valores[nombre]
+
+    def _ejecutar_etapa(self, etapa: Etapa, ejecucion: Ejecucion, huellas: Dict[str, str]):
+        usar_cache = etapa.cachear and self.cache is not None
+        if usar_cache:
+            clave = 'pipeline:' + self._huella_etapa(etapa, ejecucion, huellas)
+            salidas = self.cache.obtener(clave)
+            if salidas is not None:
+                ETAPAS_PIPELINE.inc(etapa=etapa.nombre, origen='cache')
+                ejecucion.reutilizadas.append(etapa.nombre)
+                ejecucion.valores.update(salidas)
+                return
+
+        argumentos = {entrada: self._valor(entrada, ejecucion, huellas) for entrada in etapa.entradas}
+        salidas = etapa.funcion(**argumentos)
+        faltan = [s for s in etapa.salidas if s not in salidas]
+        if faltan:
+            raise ValueError(f"La etapa {etapa.nombre} no devolvió {faltan}")
+        salidas = {s: salidas[s] for s in etapa.salidas}
+
+        ETAPAS_PIPELINE.inc(etapa=etapa.nombre, origen='calculada')
+        ejecucion.calculadas.append(etapa.nombre)
+        if usar_cache:
+            self.cache.guardar(clave, salidas)
+        ejecucion.valores.update(salidas)
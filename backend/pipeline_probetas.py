@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+🧪 Grafo de etapas del análisis de probetas
+A2 (detección ArUco y rectificación), B3 (extracción de colores y calibración) y C2
+(color medio del área y clasificación) sobre el motor de pipeline.Pipeline:
+
+    foto_b64 → foto → deteccion → respuesta_deteccion, rig      (+ tamano, rig_previo)
+    kit → plantilla
+    tabla_b64 → tabla → extraccion → calibracion, calidad_tabla  (+ bbox_tabla, plantilla, iluminacion_tabla)
+                                   → imagen_debug_b64
+                      → iluminacion_tabla
+    probeta_b64 → probeta → color_rgb → color_clasificacion, info_iluminacion → analisis
+                          → iluminacion_probeta         (+ area, tipo_test, metrica, calibracion)
+
+Los neutros de cada imagen rectificada (iluminacion.py) normalizan los colores de la
+calibración y el del líquido; si la probeta no tiene neutros legibles se usan los de la tabla.
+
+La disposición de la tabla (parámetros, valores y parches) sale de la plantilla precompilada
+del kit (plantillas_kits.py): ninguna petición analiza una imagen de referencia.
+
+La foto de cámara decodificada, la detección (que lleva la foto original) y la extracción
+(con la imagen de debug sin codificar) no se guardan en caché: lo que se reutiliza es lo
+que sale de ellas. Lo usan los handlers de main.py, con la caché de resultados compartida, y
+los main() de a2_detectar_aruco, b3_extractor y c2_analizar, sin caché.
+"""
+
+import base64
+import binascii
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from a2_detectar_aruco import TablaAPIDetector
+from b3_extractor import ExtractorProporcional
+from calibracion_compacta import CalibracionCompacta
+from diferencia_color import ESCALAS, distancias
+from iluminacion import EstimadorIluminacion, Iluminacion
+from plantillas_kits import KitDesconocido, RegistroPlantillas
+from cache_resultados import CacheResultados
+from metricas import etapa
+from pipeline import Etapa, EtapaFallida, Pipeline
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Dimensiones de las imágenes rectificadas
+TAMANO_TABLA = (800, 533)
+TAMANO_PROBETA = (800, 513)
+
+# ✅ MAPEO CORREGIDO: frontend → nombre exacto en Excel
+MAPEO_TIPOS = {
+    'pH': 'pH',
+    'high_ph': 'High_Range_pH',
+    'ammonia': 'Ammonia',
+    'nitrite': 'Nitrite',
+    'nitrate': 'Nitrate'
+}
+
+
+def resolver_tipo_calibracion(tipo_test: str, tipos_disponibles: List[str]) -> Optional[str]:
+    """Parámetro de la calibración que corresponde al tipo de test del frontend (None si no hay)"""
+    tipo_calibracion = MAPEO_TIPOS.get(tipo_test)
+
+    # Nombre exacto sin distinguir mayúsculas ('ph' → 'pH', no 'High_Range_pH')
+    if not tipo_calibracion or tipo_calibracion not in tipos_disponibles:
+        for key in tipos_disponibles:
+            if tipo_test.lower() == key.lower():
+                tipo_calibracion = key
+                break
+
+    # ✅ Búsqueda flexible si no encuentra exacto
+    if not tipo_calibracion or tipo_calibracion not in tipos_disponibles:
+        # Buscar variaciones (case-insensitive, con/sin espacios)
+        for key in tipos_disponibles:
+            if tipo_test.lower().replace('_', ' ') in key.lower().replace('_', ' '):
+                tipo_calibracion = key
+                break
+
+    if not tipo_calibracion or tipo_calibracion not in tipos_disponibles:
+        return None
+    return tipo_calibracion
+
+
+def clasificar_color(calibracion: CalibracionCompacta, tipo_calibracion: str, tipo_test: str,
+                     color_rgb: Tuple[int, int, int], metrica: str = 'rgb') -> Optional[Dict]:
+    """Valores de referencia ordenados por distancia e interpolación entre los dos más cercanos"""
+    valores_ref, colores_ref = calibracion.valores_y_rgb(tipo_calibracion)
+    if len(valores_ref) == 0:
+        return None
+
+    # Distancias a todas las referencias del parámetro en una sola operación
+    lab_ref = calibracion.lab_cie(tipo_calibracion) if metrica != 'rgb' else None
+    distancias_ref = distancias(color_rgb, colores_ref, lab_ref, metrica)
+    orden = np.argsort(distancias_ref, kind='stable')
+    valores_cercanos = [{
+        'parametro': f'{tipo_test} {float(valores_ref[i])}',
+        'valor': float(valores_ref[i]),
+        'color_rgb': [int(c) for c in colores_ref[i]],
+        'distancia': float(distancias_ref[i])
+    } for i in orden]
+
+    # Interpolación simple
+    umbral_interpolacion, distancia_sin_confianza = ESCALAS[metrica]
+    valor_final = valores_cercanos[0]['valor']
+    interpolado = False
+
+    if len(valores_cercanos) >= 2:
+        v1 = valores_cercanos[0]
+        v2 = valores_cercanos[1]
+
+        if v1['distancia'] > umbral_interpolacion:
+            peso1 = 1 / (v1['distancia'] + 0.1)
+            peso2 = 1 / (v2['distancia'] + 0.1)
+            peso_total = peso1 + peso2
+            valor_final = (v1['valor'] * peso1 + v2['valor'] * peso2) / peso_total
+            interpolado = True
+
+    distancia_minima = valores_cercanos[0]['distancia']
+    confianza = max(0.1, min(1.0, 1 - (distancia_minima / distancia_sin_confianza)))
+
+    return {
+        'valor_final': float(valor_final),
+        'parametro_cercano': valores_cercanos[0]['parametro'],
+        'confianza': float(confianza),
+        'interpolado': interpolado,
+        'metrica': metrica,
+        'valores_cercanos': valores_cercanos
+    }
+
+
+def normalizar_color_probeta(color_rgb: Tuple[int, int, int], iluminacion_probeta: Optional[Iluminacion],
+                             calibracion: CalibracionCompacta) -> Tuple[Tuple[int, int, int], Dict]:
+    """Color del líquido en la escala de la calibración y de dónde salieron los neutros."""
+    iluminacion_tabla = calibracion.iluminacion
+    if iluminacion_tabla is None:
+        return color_rgb, {'normalizada': False}
+    if iluminacion_probeta is None:
+        # Sin neutros en la foto de la probeta: se supone la misma luz que en la tabla
+        return iluminacion_tabla.normalizar_rgb(color_rgb), {'normalizada': True, 'neutros': 'tabla', 'deriva': None}
+    return iluminacion_probeta.normalizar_rgb(color_rgb), {'normalizada': True, 'neutros': 'probeta',
+                                                           'deriva': iluminacion_tabla.deriva(iluminacion_probeta)}
+
+
+def decodificar_base64(cadena: str) -> Optional[np.ndarray]:
+    """Imagen BGR a partir de base64 (con o sin prefijo data:)."""
+    try:
+        datos = base64.b64decode(cadena[cadena.find(',') + 1:])
+    except (binascii.Error, ValueError):
+        return None
+    return cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_COLOR)
+
+
+def codificar_base64(img: np.ndarray) -> Optional[str]:
+    """JPEG en data URL."""
+    ok, buffer = cv2.imencode('.jpg', img)
+    if not ok:
+        return None
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+
+
+def crear_pipeline(cache: Optional[CacheResultados] = None,
+                   decodificar: Callable[[str], Optional[np.ndarray]] = decodificar_base64,
+                   codificar: Callable[[np.ndarray], Optional[str]] = codificar_base64,
+                   crear_detector: Optional[Callable[[Tuple[int, int]], TablaAPIDetector]] = None,
+                   registro_plantillas: Optional[RegistroPlantillas] = None) -> Pipeline:
+    """
+    Construir el grafo A2 → B3 → C2.
+
+    Args:
+        cache: Caché de las salidas intermedias (None: sin caché)
+        decodificar: base64 → imagen BGR (None si no se puede decodificar)
+        codificar: Imagen BGR → data URL
+        crear_detector: (ancho, alto) → TablaAPIDetector; por defecto uno con la configuración estándar
+        registro_plantillas: Plantillas de los kits; por defecto las de plantillas/
+    """
+    if registro_plantillas is None:
+        registro_plantillas = RegistroPlantillas()
+    if crear_detector is None:
+        def crear_detector(tamano):
+            return TablaAPIDetector(target_width=tamano[0], target_height=tamano[1])
+
+    def decodificar_en(entrada: str, salida: str, mensaje: str, cachear: bool) -> Etapa:
+        def funcion(**argumentos):
+            img = decodificar(argumentos[entrada])
+            if img is None:
+                raise EtapaFallida(mensaje)
+            return {salida: img}
+        return Etapa(f'decodificar_{salida}', funcion, (entrada,), (salida,), cachear=cachear)
+
+    def neutros_en(entrada: str, salida: str, imagen: str) -> Etapa:
+        def funcion(**argumentos):
+            return {salida: EstimadorIluminacion().estimar(argumentos[entrada], imagen)}
+        return Etapa(f'neutros_{imagen}', funcion, (entrada,), (salida,))
+
+    # --- A2: detección ArUco y rectificación (tabla o probeta según tamano) ---
+    def detectar(foto, tamano, rig_previo):
+        return {'deteccion': crear_detector(tuple(tamano)).procesar_array(foto, rig_previo)}
+
+    def codificar_deteccion(deteccion):
+        if not deteccion['exito']:
+            marcadores = deteccion['imagen_marcadores']
+            raise EtapaFallida(deteccion['mensaje'], 200,
+                               imagen_marcadores=codificar(marcadores) if marcadores is not None else None,
+                               calidad=deteccion['calidad'])
+        return {
+            'respuesta_deteccion': {
+                'imagen_rectificada': codificar(deteccion['imagen_rectificada']),
+                'imagen_marcadores': codificar(deteccion['imagen_marcadores']),
+                'calidad': deteccion['calidad'],
+                'recuperado': deteccion['recuperado'],
+                'error_recuperacion_px': deteccion['error_recuperacion_px'],
+                'pasada_deteccion': deteccion['pasada_deteccion']
+            },
+            'rig': deteccion['rig']
+        }
+
+    # --- B3: extracción de colores y calibración ---
+    def cargar_plantilla(kit):
+        try:
+            return {'plantilla': registro_plantillas.obtener(kit)}
+        except KitDesconocido as e:
+            raise EtapaFallida(str(e))
+
+    def extraer(tabla, bbox_tabla, plantilla):
+        geometria = plantilla.referencia_analizada()
+        extractor = ExtractorProporcional(parametros_config=plantilla.parametros_config())
+        resultado = extractor.extraer_colores(tabla, tuple(bbox_tabla), geometria['bbox'], geometria['rectangulos'])
+        if not resultado['exito']:
+            raise EtapaFallida(resultado['mensaje'], 200, calidad=resultado['calidad'])
+        return {'extraccion': resultado}
+
+    def calibrar(extraccion, iluminacion_tabla):
+        return {
+            'calibracion': CalibracionCompacta.desde_colores(extraccion['colores_extraidos'], iluminacion_tabla),
+            'calidad_tabla': extraccion['calidad']
+        }
+
+    def codificar_debug(extraccion):
+        return {'imagen_debug_b64': codificar(extraccion['imagen_debug'])}
+
+    # --- C2: color medio del área y clasificación ---
+    def color_medio(probeta, area):
+        x, y, w, h = area
+        img_h, img_w = probeta.shape[:2]
+        if x < 0 or y < 0 or x + w > img_w or y + h > img_h or w < 5 or h < 5:
+            raise EtapaFallida(f'Área seleccionada inválida: ({x},{y},{w},{h}) en imagen {img_w}x{img_h}')
+        mean_bgr = cv2.mean(probeta[y:y+h, x:x+w])
+        return {'color_rgb': (int(round(mean_bgr[2])), int(round(mean_bgr[1])), int(round(mean_bgr[0])))}
+
+    def normalizar_color(color_rgb, iluminacion_probeta, calibracion):
+        color, info = normalizar_color_probeta(color_rgb, iluminacion_probeta, calibracion)
+        return {'color_clasificacion': color, 'info_iluminacion': info}
+
+    def clasificar(calibracion, tipo_test, color_clasificacion, metrica):
+        tipos_disponibles = calibracion.tipos()
+        tipo_calibracion = resolver_tipo_calibracion(tipo_test, tipos_disponibles)
+        if tipo_calibracion is None:
+            logger.error(f"Tipos disponibles: {tipos_disponibles}")
+            raise EtapaFallida(f'No hay datos de calibración para {tipo_test}. Tipos disponibles: {tipos_disponibles}')
+        with etapa('clasificacion'):
+            analisis = clasificar_color(calibracion, tipo_calibracion, tipo_test, color_clasificacion, metrica)
+        if analisis is None:
+            raise EtapaFallida('No se encontraron valores de referencia')
+        return {'analisis': analisis}
+
+    return Pipeline([
+        decodificar_en('foto_b64', 'foto', 'Error al procesar imagen', cachear=False),
+        Etapa('detectar', detectar, ('foto', 'tamano', 'rig_previo'), ('deteccion',), cachear=False),
+        Etapa('codificar_deteccion', codificar_deteccion, ('deteccion',), ('respuesta_deteccion', 'rig')),
+        Etapa('cargar_plantilla', cargar_plantilla, ('kit',), ('plantilla',), cachear=False),
+        decodificar_en('tabla_b64', 'tabla', 'Error al procesar imagen', cachear=True),
+        Etapa('extraer_colores', extraer, ('tabla', 'bbox_tabla', 'plantilla'), ('extraccion',),
+              cachear=False),
+        neutros_en('tabla', 'iluminacion_tabla', 'tabla'),
+        Etapa('calibrar', calibrar, ('extraccion', 'iluminacion_tabla'), ('calibracion', 'calidad_tabla')),
+        Etapa('codificar_debug', codificar_debug, ('extraccion',), ('imagen_debug_b64',)),
+        decodificar_en('probeta_b64', 'probeta', 'Error al procesar imagen de probeta', cachear=True),
+        Etapa('color_medio', color_medio, ('probeta', 'area'), ('color_rgb',)),
+        neutros_en('probeta', 'iluminacion_probeta', 'probeta'),
+        Etapa('normalizar_color', normalizar_color, ('color_rgb', 'iluminacion_probeta', 'calibracion'),
+              ('color_clasificacion', 'info_iluminacion')),
+        Etapa('clasificar', clasificar, ('calibracion', 'tipo_test', 'color_clasificacion', 'metrica'),
+              ('analisis',))
+    ], cache)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+🗂️ Plantillas precompiladas de tablas de colores por kit
+Cada kit de test (marca/modelo de tabla) tiene un JSON en plantillas/<kit_id>.json con los
+parámetros en orden de columna, sus valores y el rectángulo de cada parche en coordenadas
+normalizadas (0-1) respecto a la tabla. Se genera una sola vez desde una imagen de
+referencia en B&N con construir_plantillas.py; en las peticiones no se procesa ninguna
+imagen de referencia: la plantilla se lee del disco la primera vez que se pide su kit_id
+y queda en memoria.
+
+Formato del archivo:
+
+    {"version": 1, "kit_id": "api_freshwater", "nombre": "...",
+     "tamano_referencia": [ancho, alto],
+     "parametros": [{"parametro": "pH", "nombre_completo": "pH", "valores": [...],
+                     "rectangulos": [[x, y, w, h], ...]}, ...]}
+
+tamano_referencia es el tamaño en píxeles de la tabla en la imagen original: con él los
+rectángulos se reconstruyen exactos y el mapeo a la foto da los mismos píxeles que con la
+imagen de referencia.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metricas
+from b3_extractor import ExtractorProporcional
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VERSION_PLANTILLA = 1
+DIRECTORIO_PLANTILLAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plantillas')
+KIT_POR_DEFECTO = 'api_freshwater'
+
+# Decimales de las coordenadas normalizadas (sobra para reconstruir píxeles exactos)
+DECIMALES = 6
+
+PATRON_KIT_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+PLANTILLAS_SERVIDAS = metricas.contador('probetas_plantillas_kit_total',
+                                        'Plantillas de kit servidas por origen (disco la primera vez, luego memoria)',
+                                        ('kit', 'origen'))
+
+
+class KitDesconocido(Exception):
+    """No hay plantilla para el kit_id pedido (o el archivo no es válido)."""
+
+
+@dataclass
+class PlantillaKit:
+    """Disposición de una tabla de colores: parámetros por columna, valores y parches normalizados."""
+    kit_id: str
+    nombre: str
+    tamano_referencia: Tuple[int, int]
+    parametros: List[Dict]
+    _geometria: Optional[Dict] = field(default=None, repr=False, compare=False)
+
+    def parametros_config(self) -> Dict[str, Dict]:
+        """Configuración en el formato de ExtractorProporcional.parametros_config."""
+        return {p['parametro']: {'valores': list(p['valores']), 'posicion_columna': i,
+                                 'nombre_completo': p['nombre_completo']}
+                for i, p in enumerate(self.parametros)}
+
+    def referencia_analizada(self) -> Dict:
+        """
+        bbox y rectángulos por parámetro en píxeles de la tabla de referencia, como los que
+        salían de analizar referencia2.jpg (calculados una vez por plantilla).
+        """
+        if self._geometria is None:
+            ancho, alto = self.tamano_referencia
+            escala = np.array([ancho, alto, ancho, alto], dtype=np.float64)
+            self._geometria = {
+                'bbox': (0, 0, ancho, alto),
+                'rectangulos': {p['parametro']: [tuple(int(v) for v in np.round(np.array(r) * escala))
+                                                 for r in p['rectangulos']]
+                                for p in self.parametros}
+            }
+        return self._geometria
+
+    def total_parches(self) -> int:
+        return sum(len(p['rectangulos']) for p in self.parametros)
+
+    def a_dict(self) -> Dict:
+        return {'version': VERSION_PLANTILLA, 'kit_id': self.kit_id, 'nombre': self.nombre,
+                'tamano_referencia': list(self.tamano_referencia), 'parametros': self.parametros}
+
+    @classmethod
+    def desde_dict(cls, datos: Dict) -> 'PlantillaKit':
+        if datos.get('version') != VERSION_PLANTILLA:
+            raise ValueError(f"Versión de plantilla no soportada: {datos.get('version')}")
+        parametros = datos['parametros']
+        for p in parametros:
+            if len(p['rectangulos']) > len(p['valores']):
+                raise ValueError(f"{p['parametro']}: más rectángulos que valores")
+            if any(len(r) != 4 for r in p['rectangulos']):
+                raise ValueError(f"{p['parametro']}: rectángulos mal formados")
+        ancho, alto = datos['tamano_referencia']
+        return cls(datos['kit_id'], datos['nombre'], (int(ancho), int(alto)), parametros)
+
+    def huella(self) -> str:
+        return hashlib.blake2b(json.dumps(self.a_dict(), sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def resumen(self) -> Dict:
+        """Lo que necesita el frontend para ofrecer el kit."""
+        return {'kit_id': self.kit_id, 'nombre': self.nombre,
+                'parametros': [{'parametro': p['parametro'], 'nombre_completo': p['nombre_completo'],
+                                'valores': p['valores']} for p in self.parametros]}
+
+
+def construir_plantilla(kit_id: str, nombre: str, img_referencia: np.ndarray,
+                        parametros_config: Dict[str, Dict]) -> PlantillaKit:
+    """
+    Analizar una imagen de referencia en B&N (parches negros sobre blanco) y compilar su plantilla.
+
+    Args:
+        kit_id: Identificador del kit (nombre del archivo)
+        nombre: Nombre legible del kit
+        img_referencia: Imagen de referencia
+        parametros_config: Parámetros en orden de columna con 'valores' y 'nombre_completo'
+
+    Raises:
+        ValueError: Si el kit_id no es válido o no se encuentran los parches
+    """
+    if not PATRON_KIT_ID.match(kit_id):
+        raise ValueError(f"kit_id inválido: {kit_id!r} (minúsculas, dígitos, '_' y '-')")
+    extractor = ExtractorProporcional(parametros_config=parametros_config)
+    bbox_ref = extractor.detectar_tabla_en_referencia(img_referencia)
+    if bbox_ref is None:
+        raise ValueError("No se pudo detectar la tabla en la referencia")
+    rectangulos_ref = extractor.extraer_rectangulos_referencia(img_referencia, bbox_ref)
+    if not rectangulos_ref:
+        raise ValueError("No se pudieron extraer rectángulos de la referencia")
+
+    x_ref, y_ref, ancho, alto = bbox_ref
+    parametros = []
+    for parametro, config in extractor.parametros_config.items():
+        rects = rectangulos_ref.get(parametro, [])
+        if len(rects) < len(config['valores']):
+            logger.warning(f"⚠️ {parametro}: {len(rects)} parches para {len(config['valores'])} valores")
+        if not rects:
+            raise ValueError(f"No se encontraron parches para {parametro}")
+        parametros.append({
+            'parametro': parametro,
+            'nombre_completo': config['nombre_completo'],
+            'valores': list(config['valores']),
+            'rectangulos': [[round((x - x_ref) / ancho, DECIMALES), round((y - y_ref) / alto, DECIMALES),
+                             round(w / ancho, DECIMALES), round(h / alto, DECIMALES)] for x, y, w, h in rects]
+        })
+    return PlantillaKit(kit_id, nombre, (ancho, alto), parametros)
+
+
+def guardar_plantilla(plantilla: PlantillaKit, directorio: str = DIRECTORIO_PLANTILLAS) -> str:
+    """Escribir plantillas/<kit_id>.json (compacto: un parámetro por línea)."""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f'{plantilla.kit_id}.json')
+    datos = plantilla.a_dict()
+    lineas = [json.dumps(p, ensure_ascii=False, separators=(',', ':')) for p in datos.pop('parametros')]
+    cabecera = json.dumps(datos, ensure_ascii=False, separators=(',', ':'))[:-1]
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write(cabecera + ',"parametros":[\n' + ',\n'.join(lineas) + '\n]}\n')
+    return ruta
+
+
+class RegistroPlantillas:
+    """Plantillas por kit_id, cargadas del disco bajo demanda y cacheadas en memoria."""
+
+    def __init__(self, directorio: str = DIRECTORIO_PLANTILLAS):
+        self.directorio = directorio
+        self._plantillas: Dict[str, PlantillaKit] = {}
+        self._lock = threading.Lock()
+
+    def disponibles(self) -> List[str]:
+        """kit_id de las plantillas del directorio (sin cargarlas)."""
+        if not os.path.isdir(self.directorio):
+            return []
+        return sorted(nombre[:-5] for nombre in os.listdir(self.directorio)
+                      if nombre.endswith('.json') and PATRON_KIT_ID.match(nombre[:-5]))
+
+    def obtener(self, kit_id: str) -> PlantillaKit:
+        """
+        Plantilla de un kit.
+
+        Raises:
+            KitDesconocido: Si no existe o no se puede leer
+        """
+        # Primero el tipo: un kit que llega del JSON como lista o dict no es hashable
+        if not isinstance(kit_id, str):
+            raise KitDesconocido(f"Kit inválido: {kit_id!r}")
+        plantilla = self._plantillas.get(kit_id)
+        if plantilla is not None:
+            PLANTILLAS_SERVIDAS.inc(kit=kit_id, origen='memoria')
+            return plantilla
+        if not PATRON_KIT_ID.match(kit_id):
+            raise KitDesconocido(f"Kit inválido: {kit_id!r}")
+        with self._lock:
+            plantilla = self._plantillas.get(kit_id)
+            if plantilla is None:
+                plantilla = self._cargar(kit_id)
+                self._plantillas[kit_id] = plantilla
+                PLANTILLAS_SERVIDAS.inc(kit=kit_id, origen='disco')
+            else:
+                PLANTILLAS_SERVIDAS.inc(kit=kit_id, origen='memoria')
+        return plantilla
+
+    def _cargar(self, kit_id: str) -> PlantillaKit:
+        ruta = os.path.join(self.directorio, f'{kit_id}.json')
+        if not os.path.exists(ruta):
+            raise KitDesconocido(f"No hay plantilla para el kit {kit_id}. Disponibles: {self.disponibles()}")
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                plantilla = PlantillaKit.desde_dict(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Plantilla inválida en {ruta}: {e}")
+            raise KitDesconocido(f"Plantilla del kit {kit_id} inválida")
+        if plantilla.kit_id != kit_id:
+            raise KitDesconocido(f"{ruta} declara el kit {plantilla.kit_id}")
+        logger.info(f"🗂️ Plantilla {kit_id} cargada: {len(plantilla.parametros)} parámetros, "
+                    f"{plantilla.total_parches()} parches")
+        return plantilla
+
+    def estadisticas(self) -> Dict:
+        return {'directorio': self.directorio, 'cargadas': sorted(self._plantillas)}
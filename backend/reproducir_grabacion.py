@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+🔁 Reproducción de tráfico grabado contra una versión nueva
+Reenvía en orden las peticiones grabadas por grabacion.Grabador (GRABACION_MUESTREO) y
+compara cada respuesta con la grabada (valores, tasas de éxito, dimensiones y color medio
+de las imágenes) y la latencia total y por etapa (cabecera Server-Timing).
+
+Los tiempos grabados vienen de otra máquina: para comparar latencias con rigor, reproducir
+primero con la versión anterior (--salida base.json) y después con la nueva
+(--linea-base base.json) en la misma máquina.
+
+Uso:
+    python reproducir_grabacion.py grabaciones/                  # app local en proceso
+    python reproducir_grabacion.py grabacion_*.zip --url http://127.0.0.1:5000
+    python reproducir_grabacion.py grabaciones/ --salida base.json
+    python reproducir_grabacion.py grabaciones/ --linea-base base.json --tolerancia-latencia 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# La app en proceso no debe servir desde caché ni calibraciones guardadas, ni volver a grabar lo que se reproduce
+os.environ.setdefault('CACHE_RESULTADOS_MB', '0')
+os.environ.setdefault('IDEMPOTENCIA_TTL_S', '0')
+os.environ.setdefault('CALIBRACIONES_DB', '')
+os.environ['GRABACION_MUESTREO'] = '0'
+
+from grabacion import leer_registros, reconstruir_payload, resumir_respuesta, comparar_respuestas
+
+
+def parsear_server_timing(cabecera: Optional[str]) -> Dict[str, float]:
+    """{'etapa': ms, ..., 'total': ms} a partir de la cabecera Server-Timing."""
+    tiempos = {}
+    for entrada in (cabecera or '').split(','):
+        partes = [p.strip() for p in entrada.split(';')]
+        if not partes[0]:
+            continue
+        for parte in partes[1:]:
+            if parte.startswith('dur='):
+                tiempos[partes[0]] = float(parte[4:])
+    return tiempos
+
+
+class ClienteLocal:
+    """App de main.py en proceso (cliente de pruebas de Flask)."""
+
+    def __init__(self):
+        logging.disable(logging.INFO)
+        import main as api
+        self.cliente = api.app.test_client()
+
+    def post(self, ruta: str, payload: Dict) -> Tuple[int, Dict, Dict[str, float]]:
+        respuesta = self.cliente.post(ruta, json=payload)
+        return respuesta.status_code, respuesta.get_json(silent=True) or {}, \
+            parsear_server_timing(respuesta.headers.get('Server-Timing'))
+
+
+class ClienteHTTP:
+    """Servidor ya arrancado."""
+
+    def __init__(self, url: str, timeout: float = 300.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def post(self, ruta: str, payload: Dict) -> Tuple[int, Dict, Dict[str, float]]:
+        peticion = urllib.request.Request(self.url + ruta, data=json.dumps(payload).encode(),
+                                          headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                return respuesta.status, json.loads(respuesta.read()), \
+                    parsear_server_timing(respuesta.headers.get('Server-Timing'))
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b'{}'), parsear_server_timing(e.headers.get('Server-Timing'))
+
+
+def medianas(tiempos: List[Dict[str, float]]) -> Dict[str, float]:
+    """Mediana por etapa ('total' incluido) de una lista de {etapa: ms}."""
+    etapas = sorted({e for t in tiempos for e in t})
+    return {e: round(float(np.median([t[e] for t in tiempos if e in t])), 2) for e in etapas}
+
+
+def main():
+    """Función principal de la reproducción."""
+    parser = argparse.ArgumentParser(description="Reproducir tráfico grabado y comparar resultados y latencias")
+    parser.add_argument('archivos', nargs='+', help="Zip de grabación o directorios que los contienen")
+    parser.add_argument('--url', default=None, help="Servidor a probar (por defecto la app en proceso)")
+    parser.add_argument('--salida', default=None, help="JSON con el informe (sirve de línea base)")
+    parser.add_argument('--linea-base', default=None, help="Informe de una reproducción anterior para comparar latencias")
+    parser.add_argument('--tolerancia-valor', type=float, default=1e-6, help="Diferencia relativa admitida en números")
+    parser.add_argument('--tolerancia-rgb', type=float, default=2.0, help="Diferencia admitida en el color medio de imágenes")
+    parser.add_argument('--tolerancia-latencia', type=float, default=0.25, help="Empeoramiento relativo admitido")
+    parser.add_argument('--estricto-latencia', action='store_true', help="Salir con 1 también si hay regresiones de latencia")
+    args = parser.parse_args()
+
+    registros = leer_registros(args.archivos)
+    if not registros:
+        print("❌ No hay registros en los archivos indicados")
+        sys.exit(1)
+    print(f"🔁 Reproduciendo {len(registros)} peticiones grabadas...")
+
+    cliente = ClienteHTTP(args.url) if args.url else ClienteLocal()
+    diferencias = []
+    grabados, nuevos = defaultdict(list), defaultdict(list)
+    inicio = time.perf_counter()
+    for registro, archivos in registros:
+        codigo, datos, tiempos = cliente.post(registro['ruta'], reconstruir_payload(registro, archivos))
+        cambios = comparar_respuestas(registro['respuesta'], resumir_respuesta(datos),
+                                      args.tolerancia_valor, args.tolerancia_rgb)
+        if codigo != registro['codigo']:
+            cambios.insert(0, {'campo': 'codigo_http', 'grabado': registro['codigo'], 'nuevo': codigo})
+        if cambios:
+            diferencias.append({'id': registro['id'], 'endpoint': registro['endpoint'],
+                                'usuario': registro['usuario'], 'cambios': cambios})
+        endpoint = registro['endpoint']
+        grabado = dict(registro.get('etapas_ms') or {})
+        if registro.get('duracion_ms') is not None:
+            grabado['total'] = registro['duracion_ms']
+        grabados[endpoint].append(grabado)
+        nuevos[endpoint].append(tiempos)
+    duracion = time.perf_counter() - inicio
+
+    latencias = {e: medianas(t) for e, t in nuevos.items()}
+    if args.linea_base:
+        with open(args.linea_base, encoding='utf-8') as f:
+            referencia, origen = json.load(f)['latencias_ms'], args.linea_base
+    else:
+        referencia, origen = {e: medianas(t) for e, t in grabados.items()}, 'grabación'
+
+    regresiones = []
+    print(f"\n⏱️ Latencia mediana (ms): {origen} → esta reproducción")
+    for endpoint in sorted(latencias):
+        base = referencia.get(endpoint, {})
+        for etapa, ms in sorted(latencias[endpoint].items(), key=lambda x: x[0] != 'total'):
+            ms_base = base.get(etapa)
+            if ms_base is None:
+                continue
+            ratio = ms / ms_base if ms_base > 0 else float('inf')
+            marca = ''
+            if ratio > 1 + args.tolerancia_latencia and max(ms, ms_base) >= 2.0:
+                regresiones.append({'endpoint': endpoint, 'etapa': etapa, 'base_ms': ms_base, 'actual_ms': ms})
+                marca = ' ⚠️'
+            nombre = endpoint if etapa == 'total' else f"  · {etapa}"
+            print(f"   {nombre:<32} {ms_base:9.1f} → {ms:9.1f}  x{ratio:.2f}{marca}")
+
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'destino': args.url or 'app en proceso',
+        'registros': len(registros),
+        'duracion_s': round(duracion, 2),
+        'latencias_ms': latencias,
+        'diferencias': diferencias,
+        'regresiones_latencia': regresiones
+    }
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Informe guardado en {args.salida}")
+
+    if diferencias:
+        print(f"\n❌ {len(diferencias)} de {len(registros)} respuestas cambian:")
+        for d in diferencias[:20]:
+            for cambio in d['cambios'][:5]:
+                print(f"   • [{d['endpoint']} {d['usuario']}] {cambio['campo']}: {cambio['grabado']} → {cambio['nuevo']}")
+    else:
+        print(f"\n✅ Las {len(registros)} respuestas coinciden con las grabadas")
+    if regresiones:
+        print(f"⚠️ {len(regresiones)} etapas más lentas que {origen} (tolerancia {args.tolerancia_latencia:.0%})")
+    if diferencias or (regresiones and args.estricto_latencia):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
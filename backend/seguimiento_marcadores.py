@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+🎥 Seguimiento de marcadores ArUco entre frames para guía de captura en vivo
+Sigue las 16 esquinas de los 4 marcadores con flujo óptico (Lucas-Kanade) y solo
+ejecuta detectMarkers cada N frames o cuando se pierde el seguimiento.
+"""
+
+import cv2
+import numpy as np
+import logging
+from typing import Dict, List, Optional
+
+from a2_detectar_aruco import TablaAPIDetector
+from calidad_imagen import reducir_imagen, a_grises, medir_nitidez
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Lado mayor al que se reducen los frames recibidos
+LADO_FRAME = 480
+
+
+class SeguidorMarcadores:
+    """Estado de una sesión de guía en vivo (un objeto por conexión)."""
+
+    def __init__(self, detector: Optional[TablaAPIDetector] = None,
+                 deteccion_cada: int = 10,
+                 umbral_movimiento_px: float = 1.5,
+                 frames_quieto: int = 6,
+                 error_fb_max_px: float = 1.0,
+                 nitidez_min: float = 30.0):
+        """
+        Inicializar seguidor.
+
+        Args:
+            detector: Detector con el diccionario y los IDs esperados
+            deteccion_cada: Frames entre detecciones completas
+            umbral_movimiento_px: Movimiento máximo de esquinas para considerar el móvil quieto
+            frames_quieto: Frames quietos consecutivos necesarios para pedir la captura
+            error_fb_max_px: Error adelante-atrás máximo del flujo óptico para aceptar un punto
+            nitidez_min: Varianza mínima del Laplaciano del frame para pedir la captura
+        """
+        self.detector = detector or TablaAPIDetector(filtrar_calidad=False, reintentos_paralelos=False)
+        self.deteccion_cada = deteccion_cada
+        self.umbral_movimiento_px = umbral_movimiento_px
+        self.frames_quieto = frames_quieto
+        self.error_fb_max_px = error_fb_max_px
+        self.nitidez_min = nitidez_min
+
+        self.parametros_lk = dict(winSize=(21, 21), maxLevel=3,
+                                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+        self.gray_anterior = None
+        self.ids_seguidos: List[int] = []
+        self.puntos = None  # (4 * len(ids_seguidos), 1, 2) float32
+        self.frames_desde_deteccion = 0
+        self.contador_quieto = 0
+        self.frames_procesados = 0
+        self.detecciones_completas = 0
+
+    def reiniciar(self):
+        """Olvidar los marcadores seguidos: el siguiente frame hace una detección completa."""
+        self.gray_anterior = None
+        self.ids_seguidos = []
+        self.puntos = None
+        self.contador_quieto = 0
+
+    def _detectar(self, gray: np.ndarray):
+        """Detección completa: reinicia los puntos seguidos con los marcadores esperados."""
+        corners, ids, _ = self.detector.detector.detectMarkers(gray)
+        _, validos = self.detector._clasificar_marcadores(corners, ids)
+        self.ids_seguidos = sorted(int(id_) for id_ in validos.keys())
+        if self.ids_seguidos:
+            self.puntos = np.concatenate(
+                [validos[id_]['corners'] for id_ in sorted(validos.keys())]).reshape(-1, 1, 2).astype(np.float32)
+        else:
+            self.puntos = None
+        self.frames_desde_deteccion = 0
+        self.detecciones_completas += 1
+
+    def _seguir(self, gray: np.ndarray) -> Optional[float]:
+        """
+        Seguir las esquinas con flujo óptico y comprobación adelante-atrás.
+
+        Returns:
+            Movimiento máximo de las esquinas en px, o None si se perdió el seguimiento
+        """
+        if self.puntos is None or self.gray_anterior is None:
+            return None
+        nuevos, estado, _ = cv2.calcOpticalFlowPyrLK(self.gray_anterior, gray, self.puntos, None, **self.parametros_lk)
+        vuelta, estado_vuelta, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray_anterior, nuevos, None, **self.parametros_lk)
+        error_fb = np.linalg.norm((vuelta - self.puntos).reshape(-1, 2), axis=1)
+        validos = (estado.ravel() == 1) & (estado_vuelta.ravel() == 1) & (error_fb < self.error_fb_max_px)
+
+        # Un marcador se pierde si cualquiera de sus 4 esquinas falla
+        if not validos.reshape(-1, 4).all():
+            return None
+
+        movimiento = float(np.max(np.linalg.norm((nuevos - self.puntos).reshape(-1, 2), axis=1)))
+        self.puntos = nuevos
+        return movimiento
+
+    def procesar_frame(self, img: np.ndarray) -> Dict:
+        """
+        Procesar un frame de la cámara.
+
+        Returns:
+            Dict con estado de marcadores, modo usado y la señal 'capturar'
+        """
+        reducida, escala = reducir_imagen(img, LADO_FRAME)
+        gray = a_grises(reducida)
+        if self.gray_anterior is not None and gray.shape != self.gray_anterior.shape:
+            # La cámara cambió de resolución: flujo óptico y movimiento no se pueden comparar
+            self.reiniciar()
+        self.frames_procesados += 1
+        self.frames_desde_deteccion += 1
+
+        modo = "seguimiento"
+        movimiento = None
+        if self.frames_desde_deteccion < self.deteccion_cada and len(self.ids_seguidos) == 4:
+            movimiento = self._seguir(gray)
+        if movimiento is None:
+            modo = "deteccion"
+            puntos_previos = self.puntos if len(self.ids_seguidos) == 4 else None
+            self._detectar(gray)
+            if puntos_previos is not None and len(self.ids_seguidos) == 4:
+                movimiento = float(np.max(np.linalg.norm((self.puntos - puntos_previos).reshape(-1, 2), axis=1)))
+        self.gray_anterior = gray
+
+        completos = len(self.ids_seguidos) == 4
+        if completos and movimiento is not None and movimiento < self.umbral_movimiento_px:
+            self.contador_quieto += 1
+        else:
+            self.contador_quieto = 0
+
+        nitidez = medir_nitidez(gray)
+        faltan = sorted(set(self.detector.expected_ids.keys()) - set(self.ids_seguidos))
+        capturar = completos and self.contador_quieto >= self.frames_quieto and nitidez >= self.nitidez_min
+
+        if faltan:
+            mensaje = "Encuadra los 4 marcadores: faltan " + ", ".join(
+                self.detector.expected_ids[id_] for id_ in faltan)
+        elif capturar:
+            mensaje = "¡Captura ahora!"
+        elif nitidez < self.nitidez_min:
+            mensaje = "Imagen borrosa, enfoca la tabla"
+        else:
+            mensaje = "Mantén el móvil quieto"
+
+        esquinas = {}
+        if self.puntos is not None:
+            # Coordenadas en el frame original recibido
+            por_marcador = (self.puntos.reshape(-1, 4, 2) / escala).round(1)
+            esquinas = {str(id_): por_marcador[i].tolist() for i, id_ in enumerate(self.ids_seguidos)}
+
+        return {
+            'modo': modo,
+            'marcadores': {str(id_): id_ in self.ids_seguidos for id_ in self.detector.expected_ids},
+            'faltan': faltan,
+            'esquinas': esquinas,
+            'movimiento_px': None if movimiento is None else movimiento / escala,
+            'nitidez': nitidez,
+            'capturar': capturar,
+            'mensaje': mensaje
+        }
@@ -0,0 +1,23 @@
+"""Respuestas conservadas para duplicados: acotadas por memoria además de por número."""
+
+from cache_resultados import VuelosUnicos
+
+
+def test_completados_acotados_por_bytes():
+    vuelos = VuelosUnicos(max_bytes=2500)
+    for i in range(5):
+        vuelos.ejecutar(f'c{i}', lambda: b'x' * 1000)
+    assert vuelos.bytes_usados <= 2500
+    assert list(vuelos.completados) == ['c3', 'c4']
+
+    # Se expulsan las más antiguas: c0 vuelve a calcularse, c4 se repite
+    assert vuelos.ejecutar('c0', lambda: b'y')[1] == 'calculado'
+    assert vuelos.ejecutar('c4', lambda: b'z') == (b'x' * 1000, 'repetido')
+
+
+def test_resultado_mayor_que_el_limite_no_se_conserva():
+    vuelos = VuelosUnicos(max_bytes=100)
+    vuelos.ejecutar('pequeno', lambda: b'x' * 10)
+    vuelos.ejecutar('grande', lambda: b'x' * 1000)
+    assert list(vuelos.completados) == ['pequeno']
+    assert vuelos.bytes_usados == 10
@@ -0,0 +1,93 @@
+"""Anonimización de las imágenes grabadas: metadatos fuera, píxeles intactos."""
+
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+
+from grabacion import _app1_orientacion, limpiar_metadatos
+
+EXIF_GPS = b'Exif\x00\x00MM\x00\x2aGPS-secreto'
+
+
+def codificar(extension: str, *parametros) -> bytes:
+    img = np.random.default_rng(1).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    ok, buffer = cv2.imencode(extension, img, list(parametros))
+    assert ok
+    return buffer.tobytes()
+
+
+def decodificar(datos: bytes) -> np.ndarray:
+    return cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_COLOR)
+
+
+def app1(cuerpo: bytes) -> bytes:
+    return b'\xff\xe1' + (len(cuerpo) + 2).to_bytes(2, 'big') + cuerpo
+
+
+def bloque_png(tipo: bytes, cuerpo: bytes) -> bytes:
+    return len(cuerpo).to_bytes(4, 'big') + tipo + cuerpo + zlib.crc32(tipo + cuerpo).to_bytes(4, 'big')
+
+
+def bloque_riff(tipo: bytes, cuerpo: bytes) -> bytes:
+    return tipo + len(cuerpo).to_bytes(4, 'little') + cuerpo + b'\x00' * (len(cuerpo) & 1)
+
+
+@pytest.mark.parametrize('parametros', [(), (cv2.IMWRITE_JPEG_PROGRESSIVE, 1)])
+def test_jpeg_sin_exif_ni_imagenes_anadidas(parametros):
+    base = codificar('.jpg', *parametros)
+    # Exif con GPS delante y una segunda imagen (como MPF o un mapa de ganancia) con su Exif tras el EOI
+    original = base[:2] + app1(EXIF_GPS) + b'\xff\xfe\x00\x0ccomentario' + base[2:]
+    original += base[:2] + app1(EXIF_GPS) + base[2:]
+
+    limpios, extension = limpiar_metadatos(original)
+    assert extension == '.jpg'
+    assert b'GPS-secreto' not in limpios and b'comentario' not in limpios
+    assert limpios.count(b'\xff\xd9') == 1 and limpios.endswith(b'\xff\xd9')
+    assert np.array_equal(decodificar(limpios), decodificar(base))
+
+
+def test_jpeg_conserva_la_orientacion():
+    base = codificar('.jpg')
+    limpios, _ = limpiar_metadatos(base[:2] + _app1_orientacion(6) + base[2:])
+    assert _app1_orientacion(6) in limpios
+
+
+def test_jpeg_truncado_no_se_graba():
+    base = codificar('.jpg')
+    assert limpiar_metadatos(base[:len(base) // 2]) is None
+
+
+def test_png_sin_bloques_de_texto_ni_exif():
+    base = codificar('.png')
+    fin_ihdr = 8 + 25
+    original = (base[:fin_ihdr] + bloque_png(b'tEXt', b'Author\x00GPS-secreto')
+                + bloque_png(b'eXIf', EXIF_GPS[6:]) + bloque_png(b'iTXt', b'XML:com.adobe.xmp\x00\x00\x00\x00\x00GPS-secreto')
+                + base[fin_ihdr:] + b'basura tras IEND')
+
+    limpios, extension = limpiar_metadatos(original)
+    assert extension == '.png'
+    assert b'GPS-secreto' not in limpios and b'basura' not in limpios
+    assert np.array_equal(decodificar(limpios), decodificar(base))
+
+
+def test_webp_sin_exif_ni_xmp():
+    base = codificar('.webp', cv2.IMWRITE_WEBP_QUALITY, 80)
+    vp8 = base[12:]
+    ancho, alto = 64, 48
+    vp8x = bloque_riff(b'VP8X', bytes([0x08 | 0x04, 0, 0, 0]) + (ancho - 1).to_bytes(3, 'little')
+                       + (alto - 1).to_bytes(3, 'little'))
+    cuerpo = b'WEBP' + vp8x + vp8 + bloque_riff(b'EXIF', EXIF_GPS[6:]) + bloque_riff(b'XMP ', b'GPS-secreto')
+    original = b'RIFF' + len(cuerpo).to_bytes(4, 'little') + cuerpo
+
+    limpios, extension = limpiar_metadatos(original)
+    assert extension == '.webp'
+    assert b'GPS-secreto' not in limpios and b'EXIF' not in limpios
+    assert limpios[20] & (0x08 | 0x04) == 0
+    assert np.array_equal(decodificar(limpios), decodificar(base))
+
+
+def test_formatos_que_no_se_saben_limpiar():
+    assert limpiar_metadatos(codificar('.bmp')) is None
+    assert limpiar_metadatos(b'texto plano cualquiera') is None
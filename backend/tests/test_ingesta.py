@@ -0,0 +1,106 @@
+"""Sondeo de cabeceras de imagen: dimensiones sin decodificar y entradas truncadas o basura."""
+
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from ingesta import GuardiaIngesta, ImagenRechazada, sondear, sondear_base64
+
+ANCHO, ALTO = 641, 479
+
+
+def codificar(extension: str, *parametros) -> bytes:
+    img = np.random.default_rng(0).integers(0, 256, (ALTO, ANCHO, 3), dtype=np.uint8)
+    ok, buffer = cv2.imencode(extension, img, list(parametros))
+    assert ok
+    return buffer.tobytes()
+
+
+FORMATOS = [
+    ('jpeg', '.jpg', ()),
+    ('jpeg', '.jpg', (cv2.IMWRITE_JPEG_PROGRESSIVE, 1)),
+    ('png', '.png', ()),
+    ('webp', '.webp', (cv2.IMWRITE_WEBP_QUALITY, 80)),   # VP8 (con pérdida)
+    ('webp', '.webp', (cv2.IMWRITE_WEBP_QUALITY, 101)),  # VP8L (sin pérdida)
+    ('bmp', '.bmp', ()),
+]
+
+
+@pytest.mark.parametrize('formato, extension, parametros', FORMATOS)
+def test_dimensiones_desde_cabecera(formato, extension, parametros):
+    sonda, incompleto = sondear(codificar(extension, *parametros))
+    assert not incompleto
+    assert (sonda.formato, sonda.ancho, sonda.alto) == (formato, ANCHO, ALTO)
+
+
+@pytest.mark.parametrize('formato, extension, parametros', FORMATOS)
+def test_cabecera_truncada_pide_mas_bytes(formato, extension, parametros):
+    datos = codificar(extension, *parametros)
+    sonda, incompleto = sondear(datos[:12])
+    assert sonda is None and incompleto
+
+
+@pytest.mark.parametrize('formato, extension, parametros', FORMATOS)
+def test_base64_con_y_sin_prefijo(formato, extension, parametros):
+    cadena = base64.b64encode(codificar(extension, *parametros)).decode()
+    for valor in (cadena, f'data:image/{formato};base64,{cadena}'):
+        sonda = sondear_base64(valor, bloque=64)
+        assert (sonda.ancho, sonda.alto) == (ANCHO, ALTO)
+
+
+def test_jpeg_con_segmento_largo_antes_del_sof():
+    # APP1 de ~40 KB antes del SOF: hace falta leer más allá del primer bloque base64
+    datos = codificar('.jpg')
+    app1 = b'\xff\xe1' + (40000 + 2).to_bytes(2, 'big') + b'\x00' * 40000
+    datos = datos[:2] + app1 + datos[2:]
+    assert sondear(datos[:1000]) == (None, True)
+    sonda = sondear_base64(base64.b64encode(datos).decode(), bloque=1024)
+    assert (sonda.ancho, sonda.alto) == (ANCHO, ALTO)
+
+
+@pytest.mark.parametrize('datos', [
+    b'esto no es una imagen, solo texto',
+    b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + b'\x00' * 20,    # JPEG con un segmento que no empieza por 0xFF
+    b'\xff\xd8\xff\xda\x00\x08' + b'\x00' * 20,            # SOS sin SOF
+    b'RIFF\x00\x00\x00\x00WEBPXXXX' + b'\x00' * 20,       # bloque WebP desconocido
+])
+def test_basura_no_se_reconoce(datos):
+    sonda, incompleto = sondear(datos)
+    assert sonda is None and not incompleto
+
+
+def test_pocos_bytes_desconocidos_piden_mas():
+    assert sondear(b'\x00\x01') == (None, True)
+
+
+def test_base64_invalido():
+    assert sondear_base64('data:image/png;base64,@@@@no-es-base64@@@@') is None
+    assert sondear_base64(base64.b64encode(b'texto plano cualquiera').decode()) is None
+
+
+def cabecera_jpeg(ancho: int, alto: int) -> str:
+    """JPEG con solo SOI y SOF0 (lo único que lee la guardia), relleno hasta parecer una imagen."""
+    sof = b'\xff\xc0\x00\x11\x08' + alto.to_bytes(2, 'big') + ancho.to_bytes(2, 'big') + b'\x03' + b'\x00' * 9
+    return base64.b64encode(b'\xff\xd8' + sof + b'\x00' * 3000).decode()
+
+
+def test_rafaga_maxima_de_12_mp_se_admite():
+    # Defaults de main.py: 1024 MB de presupuesto, 8 frames por ráfaga, pila de rectificadas 800x533
+    guardia = GuardiaIngesta(bytes_frame_rafaga=800 * 533 * 3 * 2)
+    foto = cabecera_jpeg(4000, 3000)
+    bytes_cuerpo = 8 * 6 * 2**20  # ~4.5 MB por foto en base64
+    una = guardia.revisar({'imagen': foto}, bytes_cuerpo // 8)
+    rafaga = guardia.revisar({'imagenes': [foto] * 8}, bytes_cuerpo)
+    assert rafaga <= guardia.presupuesto_bytes
+    # La ráfaga cuesta una decodificación más la pila, no ocho decodificaciones
+    assert rafaga < 2 * una + 2 * bytes_cuerpo
+
+
+def test_imagenes_sueltas_si_se_suman():
+    guardia = GuardiaIngesta(presupuesto_bytes=256 * 2**20)
+    foto = cabecera_jpeg(4000, 3000)
+    guardia.revisar({'imagen': foto})
+    with pytest.raises(ImagenRechazada):
+        guardia.revisar({'imagen': foto, 'imagen_probeta': foto})
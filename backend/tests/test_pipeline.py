@@ -0,0 +1,148 @@
+"""Motor de pipeline: huellas encadenadas, reutilización desde caché, ciclos y etapas fallidas."""
+
+import numpy as np
+import pytest
+
+from b3_extractor import ColorInfo
+from cache_resultados import CacheResultados
+from calibracion_compacta import CalibracionCompacta
+from pipeline import Etapa, EtapaFallida, Pipeline, huella_valor
+from pipeline_probetas import crear_pipeline
+
+
+def pipeline_lineal(cache, llamadas):
+    """a → doble → b → suma(+c) → d"""
+    def doble(a):
+        llamadas.append('doble')
+        return {'b': a * 2}
+
+    def suma(b, c):
+        llamadas.append('suma')
+        return {'d': b + c}
+
+    return Pipeline([Etapa('doble', doble, ('a',), ('b',)),
+                     Etapa('suma', suma, ('b', 'c'), ('d',))], cache)
+
+
+def test_huella_valor_por_contenido():
+    assert huella_valor({'x': [1, 2], 'y': 'z'}) == huella_valor({'y': 'z', 'x': [1, 2]})
+    assert huella_valor(np.zeros(3)) != huella_valor(np.zeros(4))
+    assert huella_valor(1) != huella_valor('1')
+
+
+def test_reutiliza_etapas_con_las_mismas_entradas():
+    llamadas = []
+    pipeline = pipeline_lineal(CacheResultados(), llamadas)
+
+    primera = pipeline.ejecutar({'a': 1, 'c': 10}, ['d'])
+    assert primera['d'] == 12
+    assert primera.calculadas == ['doble', 'suma']
+
+    # Con las salidas de 'suma' en caché ni siquiera se resuelve 'doble'
+    segunda = pipeline.ejecutar({'a': 1, 'c': 10}, ['d'])
+    assert segunda['d'] == 12
+    assert segunda.calculadas == []
+    assert segunda.reutilizadas == ['suma']
+    assert llamadas == ['doble', 'suma']
+
+
+def test_huella_encadenada_solo_recalcula_lo_afectado():
+    llamadas = []
+    pipeline = pipeline_lineal(CacheResultados(), llamadas)
+    pipeline.ejecutar({'a': 1, 'c': 10}, ['d'])
+
+    # Cambia una entrada de la última etapa: 'doble' sale de caché
+    otra_c = pipeline.ejecutar({'a': 1, 'c': 20}, ['d'])
+    assert otra_c['d'] == 22
+    assert otra_c.calculadas == ['suma']
+    assert otra_c.reutilizadas == ['doble']
+
+    # Cambia la entrada inicial: la huella se propaga y se recalcula todo
+    otra_a = pipeline.ejecutar({'a': 2, 'c': 20}, ['d'])
+    assert otra_a['d'] == 24
+    assert otra_a.calculadas == ['doble', 'suma']
+
+
+def test_intermedio_dado_como_entrada_salta_su_etapa():
+    llamadas = []
+    ejecucion = pipeline_lineal(None, llamadas).ejecutar({'b': 5, 'c': 1}, ['d'])
+    assert ejecucion['d'] == 6
+    assert llamadas == ['suma']
+
+
+def test_etapa_fallida_no_se_guarda_en_cache():
+    intentos = []
+
+    def fallar(a):
+        intentos.append(a)
+        raise EtapaFallida('sin datos', 422, detalle='x')
+
+    pipeline = Pipeline([Etapa('fallar', fallar, ('a',), ('b',))], CacheResultados())
+    for _ in range(2):
+        with pytest.raises(EtapaFallida) as error:
+            pipeline.ejecutar({'a': 1}, ['b'])
+        assert error.value.codigo == 422
+        assert error.value.datos == {'detalle': 'x'}
+    assert intentos == [1, 1]
+
+
+def test_etapa_sin_cachear_se_recalcula():
+    llamadas = []
+
+    def decodificar(a):
+        llamadas.append(a)
+        return {'b': a}
+
+    pipeline = Pipeline([Etapa('decodificar', decodificar, ('a',), ('b',), cachear=False)], CacheResultados())
+    pipeline.ejecutar({'a': 1}, ['b'])
+    assert pipeline.ejecutar({'a': 1}, ['b']).calculadas == ['decodificar']
+    assert llamadas == [1, 1]
+
+
+def test_ciclos_y_productores_duplicados():
+    identidad = lambda **kw: {}
+    with pytest.raises(ValueError, match='Ciclo'):
+        Pipeline([Etapa('x', identidad, ('b',), ('a',)), Etapa('y', identidad, ('a',), ('b',))])
+    with pytest.raises(ValueError, match='lo producen'):
+        Pipeline([Etapa('x', identidad, (), ('a',)), Etapa('y', identidad, (), ('a',))])
+    with pytest.raises(ValueError, match='Falta la entrada'):
+        Pipeline([Etapa('x', identidad, ('b',), ('a',))]).ejecutar({}, ['a'])
+
+
+@pytest.fixture
+def calibracion():
+    colores = [ColorInfo(parametro, valor, (0, 0, 1, 1), (0, 0, 1, 1), rgb[::-1], rgb, (0.0, 0.0, 0.0), 0.9, 5)
+               for parametro, valores in (('pH', (6.0, 7.0, 8.0)), ('Ammonia', (0.0, 1.0, 2.0)))
+               for valor, rgb in zip(valores, ((200, 180, 40), (160, 120, 60), (120, 60, 80)))]
+    return CalibracionCompacta.desde_colores(colores)
+
+
+def test_reanalisis_con_otra_area_o_tipo_de_test(calibracion):
+    probeta = np.zeros((513, 800, 3), np.uint8)
+    probeta[:, :400] = (60, 120, 160)
+    probeta[:, 400:] = (40, 180, 200)
+    pipeline = crear_pipeline(CacheResultados())
+    objetivos = ['analisis']
+    entradas = {'probeta': probeta, 'area': (100, 100, 40, 40), 'tipo_test': 'pH', 'metrica': 'rgb',
+                'calibracion': calibracion}
+
+    primera = pipeline.ejecutar(entradas, objetivos)
+    assert primera.calculadas == ['color_medio', 'neutros_probeta', 'normalizar_color', 'clasificar']
+    assert primera['analisis']['valor_final'] == 7.0
+
+    # Otra área: se reutilizan los neutros de la foto
+    otra_area = pipeline.ejecutar({**entradas, 'area': (500, 100, 40, 40)}, objetivos)
+    assert otra_area.calculadas == ['color_medio', 'normalizar_color', 'clasificar']
+    assert otra_area.reutilizadas == ['neutros_probeta']
+    assert otra_area['analisis']['valor_final'] == 6.0
+
+    # Otro tipo de test con la misma área: solo la clasificación
+    otro_tipo = pipeline.ejecutar({**entradas, 'tipo_test': 'ammonia'}, objetivos)
+    assert otro_tipo.calculadas == ['clasificar']
+    assert otro_tipo.reutilizadas == ['normalizar_color']
+    assert otro_tipo['analisis']['parametro_cercano'] == 'ammonia 1.0'
+
+    # Repetir exactamente la primera petición: todo desde caché
+    repetida = pipeline.ejecutar(entradas, objetivos)
+    assert repetida.calculadas == []
+    assert repetida.reutilizadas == ['clasificar']
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+🧵 Trazas por petición
+Cada petición abre una traza en un contextvar; las etapas medidas con metricas.etapa()
+se añaden a ella como spans (se registra como oyente de metricas). Al terminar, la traza
+se resume en la cabecera Server-Timing y, si hay archivo configurado, una muestra se
+escribe como JSONL para análisis offline.
+"""
+
+import json
+import time
+import uuid
+import random
+import threading
+import logging
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import metricas
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Traza:
+    """Spans de una petición (inicio relativo y duración en segundos)."""
+
+    __slots__ = ('id', 'inicio', 'marca_tiempo', 'spans')
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.inicio = time.perf_counter()
+        self.marca_tiempo = datetime.now().isoformat(timespec='milliseconds')
+        self.spans: List[tuple] = []
+
+    def agregar(self, nombre: str, inicio: float, duracion: float):
+        self.spans.append((nombre, inicio - self.inicio, duracion))
+
+    def duracion(self) -> float:
+        return time.perf_counter() - self.inicio
+
+    def agregados(self) -> Dict[str, List[float]]:
+        """Duración total (s) y número de veces de cada span, en orden de aparición."""
+        agregados: Dict[str, List[float]] = {}
+        for nombre, _, duracion in self.spans:
+            acumulado = agregados.setdefault(nombre, [0.0, 0])
+            acumulado[0] += duracion
+            acumulado[1] += 1
+        return agregados
+
+    def server_timing(self, max_entradas: int = 20) -> str:
+        """Cabecera Server-Timing: spans agregados por nombre, más el total."""
+        entradas = []
+        for nombre, (duracion, veces) in list(self.agregados().items())[:max_entradas]:
+            desc = f';desc="x{veces}"' if veces > 1 else ''
+            entradas.append(f'{nombre};dur={duracion * 1000:.1f}{desc}')
+        entradas.append(f'total;dur={self.duracion() * 1000:.1f}')
+        return ', '.join(entradas)
+
+    def a_dict(self) -> Dict:
+        return {
+            'traza_id': self.id,
+            'inicio': self.marca_tiempo,
+            'duracion_ms': round(self.duracion() * 1000, 2),
+            'spans': [{'nombre': n, 'inicio_ms': round(i * 1000, 2), 'duracion_ms': round(d * 1000, 2)}
+                      for n, i, d in self.spans]
+        }
+
+
+_traza_actual: ContextVar[Optional[Traza]] = ContextVar('traza_actual', default=None)
+
+
+def _oyente_etapa(nombre: str, inicio: float, duracion: float):
+    traza = _traza_actual.get()
+    if traza is not None:
+        traza.agregar(nombre, inicio, duracion)
+
+
+metricas.registrar_oyente(_oyente_etapa)
+
+
+def iniciar() -> Traza:
+    """Abrir la traza de la petición actual."""
+    traza = Traza()
+    _traza_actual.set(traza)
+    return traza
+
+
+def actual() -> Optional[Traza]:
+    return _traza_actual.get()
+
+
+def terminar() -> Optional[Traza]:
+    """Cerrar la traza de la petición actual y devolverla."""
+    traza = _traza_actual.get()
+    _traza_actual.set(None)
+    return traza
+
+
+class EscritorTrazas:
+    """Escritura muestreada de trazas en un archivo JSONL (una línea por petición)."""
+
+    def __init__(self, ruta: Optional[str], muestreo: float = 0.1):
+        """
+        Args:
+            ruta: Archivo JSONL (None o vacío para desactivar)
+            muestreo: Fracción de peticiones que se escriben
+        """
+        self.ruta = ruta or None
+        self.muestreo = muestreo
+        self._lock = threading.Lock()
+
+    def escribir(self, traza: Traza, **campos):
+        """Añadir la traza al archivo si entra en la muestra."""
+        if self.ruta is None or random.random() >= self.muestreo:
+            return
+        linea = json.dumps({**campos, **traza.a_dict()}, ensure_ascii=False)
+        try:
+            with self._lock, open(self.ruta, 'a', encoding='utf-8') as f:
+                f.write(linea + '\n')
+        except OSError as e:
+            logger.warning(f"No se pudo escribir la traza en {self.ruta}: {e}")
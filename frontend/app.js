@@ -289,15 +289,71 @@ function manejarFotoTabla(event) {
     reader.readAsDataURL(file);
 }
 
+// Genera una miniatura JPEG (lado mayor = ladoMax) a partir de un dataURL
+function generarMiniatura(dataUrl, ladoMax = 320) {
+    return new Promise((resolve, reject) => {
+        const img = new Image();
+        img.onload = () => {
+            const escala = Math.min(1, ladoMax / Math.max(img.width, img.height));
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.round(img.width * escala);
+            canvas.height = Math.round(img.height * escala);
+            canvas.getContext('2d').drawImage(img, 0, 0, canvas.width, canvas.height);
+            resolve(canvas.toDataURL('image/jpeg', 0.8));
+        };
+        img.onerror = reject;
+        img.src = dataUrl;
+    });
+}
+
+// Preflight: comprueba marcadores y calidad con una miniatura antes de subir la foto completa.
+// Devuelve true si se debe continuar con la subida.
+async function comprobarPreflight(dataUrl) {
+    try {
+        const miniatura = await generarMiniatura(dataUrl);
+        const response = await fetch(`${API_URL}/preflight_aruco`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                imagen: miniatura,
+                user_code: estado.userCode
+            })
+        });
+        const data = await response.json();
+
+        if (!data.exito || data.enviar) return true;
+        return confirm(`⚠️ ${data.mensaje}\n\n¿Enviar la foto de todas formas?`);
+    } catch (error) {
+        // Si el preflight falla no bloqueamos el flujo normal
+        console.warn('Preflight no disponible:', error);
+        return true;
+    }
+}
+
+// Tiempos por etapa del servidor (cabecera Server-Timing) junto al tiempo total del cliente,
+// que incluye la subida y la descarga
+function registrarTiempos(etiqueta, inicio, response) {
+    const servidor = response.headers.get('Server-Timing');
+    const total = Math.round(performance.now() - inicio);
+    console.log(`⏱️ ${etiqueta}: ${total} ms en cliente | servidor: ${servidor || 'n/d'}`);
+}
+
 async function procesarTablaAruco() {
     if (!estado.imagenTablaOriginal) {
         alert('No hay imagen para procesar');
         return;
     }
 
+    mostrarLoading('Comprobando foto...');
+    if (!(await comprobarPreflight(estado.imagenTablaOriginal))) {
+        ocultarLoading();
+        return;
+    }
+
     mostrarLoading('Detectando marcadores ArUco...');
 
     try {
+        const inicio = performance.now();
         const response = await fetch(`${API_URL}/detectar_aruco`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -306,6 +362,7 @@ async function procesarTablaAruco() {
                 user_code: estado.userCode
             })
         });
+        registrarTiempos('detectar_aruco', inicio, response);
 
         const data = await response.json();
 
@@ -503,6 +560,7 @@ async function confirmarSeleccionArea() {
     mostrarLoading('Extrayendo colores de la tabla...');
 
     try {
+        const inicio = performance.now();
         const response = await fetch(`${API_URL}/extraer_colores`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -512,6 +570,7 @@ async function confirmarSeleccionArea() {
                 user_code: estado.userCode
             })
         });
+        registrarTiempos('extraer_colores', inicio, response);
 
         const data = await response.json();
 
@@ -575,9 +634,16 @@ async function leerYRectificarProbeta(file) {
     reader.onload = async function (ev) {
         const base64Img = ev.target.result;
 
+        mostrarLoading("Comprobando foto...");
+        if (!(await comprobarPreflight(base64Img))) {
+            ocultarLoading();
+            return;
+        }
+
         mostrarLoading("Detectando ArUco en probeta...");
 
         try {
+            const inicio = performance.now();
             const response = await fetch(`${API_URL}/rectificar_probeta`, {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
@@ -586,6 +652,7 @@ async function leerYRectificarProbeta(file) {
                     user_code: estado.userCode
                 })
             });
+            registrarTiempos('rectificar_probeta', inicio, response);
 
             const data = await response.json();
 